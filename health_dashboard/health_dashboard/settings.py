@@ -90,3 +90,49 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # django-plotly-dash settings (optional customization)
 X_FRAME_OPTIONS = 'SAMEORIGIN'  # To allow embedding Dash apps
+
+# Google Fit API base URL; point it at a local stand-in (manage.py fit_standin) for offline testing
+GOOGLE_FIT_API_URL = os.environ.get("GOOGLE_FIT_API_URL", "https://www.googleapis.com/fitness/v1")
+
+# Google Fit sync: how far back the first sync for a user reaches
+GOOGLE_FIT_SYNC_LOOKBACK_DAYS = 30
+
+# Google Fit backfill: days per dataset:aggregate request and parallel windows
+GOOGLE_FIT_BACKFILL_WINDOW_DAYS = 30
+GOOGLE_FIT_BACKFILL_MAX_WORKERS = 4
+
+# Google Fit raw mode: store intraday points and roll daily rows up locally
+GOOGLE_FIT_RAW_MODE = False
+
+# Google Fit streaming parse: decode responses incrementally and write them in batches
+GOOGLE_FIT_STREAM_PARSE = False
+
+# Stored Google OAuth credentials: refresh the access token this many seconds before it expires
+GOOGLE_FIT_TOKEN_REFRESH_MARGIN = 300
+
+# Key (Fernet: 32 url-safe base64-encoded bytes) encrypting the stored refresh tokens and client
+# secrets; derived from SECRET_KEY if unset. Changing it means users connect Google Fit again
+FIT_CREDENTIAL_KEY = os.environ.get("FIT_CREDENTIAL_KEY", "")
+
+# Google Fit scheduler (manage.py fit_scheduler): seconds between rounds and syncs in flight
+GOOGLE_FIT_SCHEDULER_INTERVAL = 3600
+GOOGLE_FIT_SCHEDULER_MAX_CONCURRENCY = 4
+
+# Sync worker (stats.sync_worker): seconds without progress before a running job is resumed by a new process
+SYNC_JOB_STALE_TIMEOUT = 30 * 60
+
+# Outbound HTTP (stats.http_client): timeouts, retries and per-host rate limits
+HTTP_TIMEOUT = (5, 60)  # (connect, read) seconds
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5  # seconds, doubled on each retry (with full jitter)
+HTTP_BACKOFF_MAX = 30.0  # seconds
+HTTP_POOL_MAXSIZE = 10  # keep-alive connections, and concurrent requests, per host
+HTTP_RATE_LIMITS = {  # host -> (requests per second, burst)
+    "www.googleapis.com": (10, 20),
+    "openrouter.ai": (2, 5),
+}
+OPENROUTER_TIMEOUT = (5, 180)  # (connect, read) seconds for an AI completion, longer than HTTP_TIMEOUT
+
+# Chunked uploads (stats.chunked_upload): bytes per chunk, and seconds a load waits for the next one
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_STALL_TIMEOUT = 60
@@ -1,8 +1,20 @@
 from django.contrib import admin
-from .models import UserSteps, ManualData, UserHR, UserCalories, UserSleep
+from .models import UserSteps, ManualData, UserHR, UserCalories, UserSleep, SyncState, BackfillWindow, SyncJob, FitDataPoint, UploadReject, UploadQuarantine, UploadColumn, UploadFile, ChunkedUpload, Metric, MetricMapping, Observation
 
 admin.site.register(UserSteps)
 admin.site.register(ManualData)
 admin.site.register(UserHR)
 admin.site.register(UserCalories)
 admin.site.register(UserSleep)
+admin.site.register(SyncState)
+admin.site.register(BackfillWindow)
+admin.site.register(SyncJob)
+admin.site.register(FitDataPoint)
+admin.site.register(UploadReject)
+admin.site.register(UploadQuarantine)
+admin.site.register(UploadColumn)
+admin.site.register(UploadFile)
+admin.site.register(ChunkedUpload)
+admin.site.register(Metric)
+admin.site.register(MetricMapping)
+admin.site.register(Observation)
@@ -0,0 +1,211 @@
+# FILE: stats/bulk_import.py
+
+import collections
+import contextlib
+import csv
+import functools
+import hashlib
+import itertools
+import multiprocessing
+import os
+import time
+import zipfile
+
+from .dedup import _already_loaded, _hash_batches, _hash_types, _hashed
+from .ingest import (
+    SCHEMA_SAMPLE_ROWS, _csv_batches, _finish_load, _load_plan, _prepare_table, _record_widened, _store_batch,
+    table_name_from_filename,
+)
+from .parsing import _infer_types, _read_csv
+from .readers import ARROW_FORMATS, _arrow_batches, _arrow_columns, _import_pyarrow, _open_arrow
+from .upload_db import _bulk_load, _gc_paused, quote_identifier
+
+
+IMPORT_QUEUE_SIZE = 4  # Parsed batches waiting for the writer, per parser process
+
+# Set in each parser process of import_files
+_import_queue = None
+
+
+def _importable(name):
+    parts = name.replace("\\", "/").split("/")
+    if parts[-1].startswith(".") or "__MACOSX" in parts:
+        return False
+    extension = os.path.splitext(name)[1].lower()
+    return extension == ".csv" or extension in ARROW_FORMATS
+
+
+def find_import_files(path):
+    """
+    The CSV, Parquet and Arrow files in a directory (searched recursively)
+    or a zip archive, in name order, as (archive path or None, file path).
+    """
+    if os.path.isdir(path):
+        found = [
+            os.path.join(directory, filename)
+            for directory, _, filenames in os.walk(path)
+            for filename in filenames
+        ]
+        return [(None, name) for name in sorted(found) if _importable(os.path.relpath(name, path))]
+    with zipfile.ZipFile(path) as archive:
+        members = [info.filename for info in archive.infolist() if not info.is_dir()]
+    return [(path, member) for member in sorted(members) if _importable(member)]
+
+
+@contextlib.contextmanager
+def _open_import_file(entry):
+    archive_path, name = entry
+    if archive_path is None:
+        with open(name, "rb") as f:
+            yield f
+    else:
+        with zipfile.ZipFile(archive_path) as archive, archive.open(name) as f:
+            yield f
+
+
+def _read_chunks(f, size=1 << 16):
+    return iter(functools.partial(f.read, size), b"")
+
+
+def _init_import_worker(queue):
+    global _import_queue
+    _import_queue = queue
+
+
+def _probe_import_file(entry):
+    """
+    Parser process: SHA-256, size, column names and the types a new table
+    would get for one file; or {"error": message} if it cannot be read.
+    """
+    extension = os.path.splitext(entry[1])[1].lower()
+    try:
+        with _open_import_file(entry) as f:
+            digest, source = hashlib.sha256(), {"size": 0}
+            collections.deque(_hashed(_read_chunks(f, 1 << 20), digest, source), maxlen=0)
+            f.seek(0)
+            if extension in ARROW_FORMATS:
+                pa = _import_pyarrow()
+                names, types = _arrow_columns(pa, _open_arrow(pa, f, ARROW_FORMATS[extension])[0])
+            else:
+                names, rows = _read_csv(_read_chunks(f))
+                types = _infer_types(names, list(itertools.islice(rows, SCHEMA_SAMPLE_ROWS)))
+    except (OSError, ValueError, csv.Error) as e:
+        return {"error": str(e)}
+    return {"sha256": digest.hexdigest(), "size": source["size"], "names": names, "types": types}
+
+
+def _parse_import_file(index, entry, names, types, hash_types):
+    """
+    Parser process: parses one file into hashed batches and sends them to the
+    writer as ("start", index, time), ("batch", index, batch)... then
+    ("done", index, types as widened), or ("error", index, message).
+    """
+    queue = _import_queue
+    queue.put(("start", index, time.perf_counter()))
+    extension = os.path.splitext(entry[1])[1].lower()
+    try:
+        with _open_import_file(entry) as f, _gc_paused():
+            if extension in ARROW_FORMATS:
+                pa = _import_pyarrow()
+                arrow_schema, record_batches = _open_arrow(pa, f, ARROW_FORMATS[extension])
+                _, arrow_types = _arrow_columns(pa, arrow_schema)
+                batches = _arrow_batches(pa, record_batches, names, arrow_types, types)
+            else:
+                _, rows = _read_csv(_read_chunks(f))
+                batches = _csv_batches(rows, names, types)
+            for batch in _hash_batches(batches, names, hash_types):
+                queue.put(("batch", index, batch))
+    except Exception as e:
+        queue.put(("error", index, str(e)))
+    else:
+        queue.put(("done", index, types))
+
+
+def import_files(path, db_path, processes=None, log=None, user_id=None):
+    """
+    Loads every file of find_import_files(path) into the table named after
+    it, as an upload would. Files are parsed in a pool of processes (default:
+    one per CPU) and written by this one, in one transaction. A file that
+    cannot be read is skipped; an error while parsing one aborts the import.
+
+    log, if given, is called with a line per file. Returns a dict per file:
+    file, table, rows, rejected, quarantined, duplicates, skipped, error and seconds.
+    """
+    entries = find_import_files(path)
+    if not entries:
+        return []
+    processes = processes or os.cpu_count() or 1
+    log = log or (lambda message: None)
+    # Forked where the platform allows, so parser processes start without
+    # importing anything again; spawned elsewhere (Windows), where they
+    # import this module afresh (it needs no Django setup)
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(start_method)
+    queue = context.Queue(maxsize=IMPORT_QUEUE_SIZE * processes)
+    results = []
+
+    with context.Pool(processes, initializer=_init_import_worker, initargs=(queue,)) as pool:
+        probes = pool.map(_probe_import_file, entries)
+        with _bulk_load(db_path) as cursor:
+            pending = {}
+            loaded = set()
+            loaded_hashes = {}
+            taken_times = {}
+            for index, (entry, probe) in enumerate(zip(entries, probes)):
+                table_name = table_name_from_filename(entry[1])
+                result = {
+                    "file": entry[1] if entry[0] else os.path.relpath(entry[1], path), "table": table_name,
+                    "rows": 0, "rejected": 0, "quarantined": 0, "duplicates": 0, "skipped": False, "error": probe.get("error"),
+                    "seconds": 0.0,
+                }
+                results.append(result)
+                if result["error"]:
+                    log(f"{result['file']}: skipped, {result['error']}")
+                    continue
+                if (table_name, probe["sha256"]) in loaded or _already_loaded(cursor, table_name, probe["sha256"]):
+                    result["skipped"] = True
+                    log(f"{result['file']}: already loaded into {table_name}, skipped")
+                    continue
+                loaded.add((table_name, probe["sha256"]))
+
+                schema, names, types = _prepare_table(cursor, table_name, probe["names"], lambda: probe["types"])
+                plan = _load_plan(cursor, table_name, schema, names, types, user_id=user_id)
+                if plan["loaded"] is not None:
+                    # Files loading into the same new table skip each other's rows
+                    plan["loaded"] = loaded_hashes.setdefault(table_name, plan["loaded"])
+                if plan["checks"] and plan["checks"]["key"]:
+                    # ... and each other's times
+                    plan["checks"]["taken"] = taken_times.setdefault(table_name, plan["checks"]["taken"])
+                pending[index] = {
+                    "result": result, "probe": probe, "schema": schema, "names": names,
+                    "columns": [quote_identifier(name) for name in names],
+                    "plan": plan,
+                }
+                pool.apply_async(
+                    _parse_import_file, (index, entry, names, types, _hash_types(cursor, table_name, names, types)),
+                    # Reports failures outside the parser's own handling, e.g. a dead process
+                    error_callback=lambda e, index=index: queue.put(("error", index, str(e))),
+                )
+
+            while pending:
+                kind, index, payload = queue.get()
+                state = pending[index]
+                result = state["result"]
+                if kind == "start":
+                    state["started"] = payload
+                elif kind == "batch":
+                    _store_batch(cursor, result["table"], state["columns"], payload, result, state["plan"])
+                elif kind == "error":
+                    raise ValueError(f"{result['file']}: {payload}")
+                else:
+                    _record_widened(cursor, result["table"], state["schema"], state["names"], payload)
+                    _finish_load(cursor, result["table"], state["schema"], state["probe"]["sha256"],
+                                 state["probe"]["size"], result)
+                    result["seconds"] = time.perf_counter() - state["started"]
+                    log(
+                        f"{result['file']} -> {result['table']}: {result['rows']} rows in {result['seconds']:.2f}s, "
+                        f"{result['rows'] / max(result['seconds'], 1e-9):,.0f} rows/s "
+                        f"({result['duplicates']} duplicates, {result['rejected']} rejected, {result['quarantined']} quarantined)"
+                    )
+                    del pending[index]
+    return results
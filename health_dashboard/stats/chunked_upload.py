@@ -0,0 +1,269 @@
+# FILE: stats/chunked_upload.py
+
+import contextlib
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+from .dedup import file_sha256
+from .ingest import ingest_csv, table_name_from_filename
+from .models import ChunkedUpload, UploadQuarantine, UploadReject
+from .readers import ARROW_FORMATS, XLSX_EXTENSIONS, ingest_arrow, ingest_xlsx
+
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes per chunk the dashboard sends
+DEFAULT_STALL_TIMEOUT = 60  # Seconds a load waits for the next chunk before giving up
+READ_SIZE = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+# Each load runs in a background thread of its own, but only the one holding
+# _slot parses and writes: a load gives the slot up while it waits for its
+# next chunk, so a slow or stalled upload does not hold up the others, and
+# SQLite still sees one writer at a time. Per upload, an Event wakes the load
+# when a chunk arrives, and the bytes parsed so far are kept for the progress
+# endpoint. Chunk writes hold the upload's lock, kept only while some request
+# uses it.
+_slot = threading.Lock()
+_loads = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UploadConflict(Exception):
+    """
+    A chunk that does not continue the part file, or an upload that is
+    already loaded. Carries the bytes received, where the client resumes.
+    """
+    def __init__(self, message, received):
+        super().__init__(message)
+        self.received = received
+
+
+class UploadStalled(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _upload_lock(upload_id):
+    # [lock, requests holding or waiting for it]
+    with _locks_guard:
+        entry = _locks.setdefault(upload_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[upload_id]
+
+
+def upload_dir():
+    return os.path.join(settings.MEDIA_ROOT, "uploads")
+
+
+def part_path(upload):
+    return os.path.join(upload_dir(), f"{upload.upload_id}.part")
+
+
+def received_bytes(upload):
+    try:
+        return os.path.getsize(part_path(upload))
+    except FileNotFoundError:
+        # Removed once loaded
+        return upload.size if upload.status == "done" else 0
+
+
+def start_upload(user_id, filename, size):
+    """
+    Registers a chunked upload of size bytes and creates its empty part file.
+    Raises ValueError for a file type the upload pipeline does not read.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension != ".csv" and extension not in ARROW_FORMATS and extension not in XLSX_EXTENSIONS:
+        raise ValueError("Only CSV, Parquet, Arrow (.arrow, .feather) and Excel (.xlsx) files are allowed.")
+    if size <= 0:
+        raise ValueError("The file is empty.")
+    upload = ChunkedUpload.objects.create(
+        upload_id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=filename,
+        table_name=table_name_from_filename(filename),
+        size=size,
+    )
+    os.makedirs(upload_dir(), exist_ok=True)
+    open(part_path(upload), "wb").close()
+    return upload
+
+
+def write_chunk(upload, offset, chunks):
+    """
+    Appends a chunk (an iterable of bytes, e.g. the request body) that
+    starts at byte offset of the file. A chunk resent after a lost response
+    is accepted; only its bytes not yet received are written. Raises
+    UploadConflict if the chunk would leave a gap or run past the announced
+    size, or the upload is already loaded.
+
+    CSV files start loading with their first chunk, other files once
+    complete. Returns the number of bytes received.
+    """
+    with _upload_lock(upload.upload_id):
+        received = received_bytes(upload)
+        if upload.status == "done":
+            raise UploadConflict("This upload is already loaded.", received)
+        if offset > received:
+            raise UploadConflict(f"Expected the chunk at byte {received}.", received)
+
+        skip = received - offset
+        with open(part_path(upload), "ab") as f:
+            for data in chunks:
+                if skip:
+                    data, skip = data[skip:], max(0, skip - len(data))
+                if received + len(data) > upload.size:
+                    raise UploadConflict(f"The file is larger than the announced {upload.size} bytes.", received)
+                f.write(data)
+                received += len(data)
+
+    load = _loads.get(upload.upload_id)
+    if load is not None:
+        load["arrived"].set()
+    elif os.path.splitext(upload.filename)[1].lower() == ".csv" or received == upload.size:
+        enqueue_load(upload)
+    return received
+
+
+def enqueue_load(upload):
+    with _locks_guard:
+        if upload.upload_id in _loads:
+            return
+        _loads[upload.upload_id] = {"arrived": threading.Event(), "processed": 0}
+    # Marked before it starts: a client polling after resuming a failed
+    # upload must not see the old failure while the load waits its turn
+    _update(upload, status="loading", error="")
+    threading.Thread(
+        target=_run_load_thread, args=(upload.upload_id,), name=f"chunked-upload-{upload.upload_id}", daemon=True,
+    ).start()
+
+
+def _run_load_thread(upload_id):
+    try:
+        run_load(upload_id)
+    except Exception as e:
+        logger.exception("Chunked upload %s failed", upload_id)
+        ChunkedUpload.objects.filter(upload_id=upload_id).update(status="failed", error=str(e))
+    finally:
+        with _locks_guard:
+            _loads.pop(upload_id, None)
+        connection.close()
+
+
+def _tail(upload, load, timeout):
+    """
+    Yields the part file's bytes as they arrive, until upload.size bytes
+    were read, giving up _slot while waiting for them. Raises UploadStalled
+    if no chunk comes for timeout seconds.
+    """
+    path = part_path(upload)
+    with open(path, "rb") as f:
+        position = 0
+        while position < upload.size:
+            data = f.read(min(READ_SIZE, upload.size - position))
+            if data:
+                position += len(data)
+                load["processed"] = position
+                yield data
+                continue
+            load["arrived"].clear()
+            # A chunk may have been written between the read and clear()
+            if os.path.getsize(path) > position:
+                continue
+            # Other loads run meanwhile
+            _slot.release()
+            try:
+                arrived = load["arrived"].wait(timeout)
+            finally:
+                _slot.acquire()
+            if not arrived:
+                raise UploadStalled("No data for a while; resume the upload to finish loading it.")
+
+
+def run_load(upload_id):
+    # One load at a time parses and writes; see _tail for when it lets others run
+    with _slot:
+        upload = ChunkedUpload.objects.get(upload_id=upload_id)
+        load = _loads[upload_id]
+        _update(upload, status="loading", error="")
+        # Rows earlier attempts committed before failing; this one skips them as duplicates
+        earlier_rows = upload.rows
+        committed = {"rows": 0}
+        timeout = getattr(settings, "CHUNKED_UPLOAD_STALL_TIMEOUT", DEFAULT_STALL_TIMEOUT)
+        db_path = settings.DATABASES["default"]["NAME"]
+        extension = os.path.splitext(upload.filename)[1].lower()
+        try:
+            # Rows a failed attempt rejected or quarantined (and committed) are
+            # recorded again by this one
+            UploadReject.objects.filter(upload_id=upload_id).delete()
+            UploadQuarantine.objects.filter(upload_id=upload_id).delete()
+            if extension in XLSX_EXTENSIONS:
+                with open(part_path(upload), "rb") as f:
+                    results = ingest_xlsx(f, db_path, upload.table_name, user_id=upload.user_id,
+                                          upload_id=upload_id)
+                # Totals over the sheets; the tables are named after them
+                result = {key: sum(sheet[key] for sheet in results.values()) for key in ("rows", "rejected", "quarantined", "duplicates")}
+                load["processed"] = upload.size
+            elif extension in ARROW_FORMATS:
+                with open(part_path(upload), "rb") as f:
+                    sha256 = file_sha256(iter(lambda: f.read(1 << 20), b""))
+                    result = ingest_arrow(f, db_path, upload.table_name, ARROW_FORMATS[extension], sha256=sha256,
+                                          user_id=upload.user_id, upload_id=upload_id)
+                load["processed"] = upload.size
+            else:
+                # Parsed while later chunks are still arriving; committed batch by
+                # batch, so the database is not locked while waiting for them
+                result = ingest_csv(_tail(upload, load, timeout), db_path, upload.table_name, checkpoint=True,
+                                    user_id=upload.user_id, upload_id=upload_id, committed=committed)
+        except Exception as e:
+            # The part file is kept: resuming the upload loads it again
+            _update(upload, status="failed", error=str(e), rows=earlier_rows + committed["rows"])
+            return
+        _update(upload, status="done", rows=earlier_rows + result["rows"], rejected=result["rejected"],
+                quarantined=result["quarantined"], duplicates=max(0, result["duplicates"] - earlier_rows))
+        try:
+            os.remove(part_path(upload))
+        except OSError:
+            # The rows are in: a part file left behind only takes disk space
+            logger.warning("Could not remove the part file of chunked upload %s", upload_id, exc_info=True)
+
+
+def _update(upload, **fields):
+    for name, value in fields.items():
+        setattr(upload, name, value)
+    upload.save()
+
+
+def upload_progress(upload):
+    """
+    JSON-serialisable progress of a ChunkedUpload for the status endpoint:
+    bytes received, and bytes parsed while it is loading.
+    """
+    load = _loads.get(upload.upload_id)
+    return {
+        "id": upload.upload_id,
+        "status": upload.status,
+        "filename": upload.filename,
+        "table": upload.table_name,
+        "size": upload.size,
+        "received": received_bytes(upload),
+        "processed": upload.size if upload.status == "done" else (load["processed"] if load else 0),
+        "rows": upload.rows,
+        "rejected": upload.rejected,
+        "quarantined": upload.quarantined,
+        "duplicates": upload.duplicates,
+        "error": upload.error,
+    }
@@ -0,0 +1,201 @@
+# FILE: stats/dedup.py
+
+import datetime
+import hashlib
+
+import numpy as np
+import pandas as pd
+from pandas.util import hash_array
+
+from .upload_db import load_schema, quote_identifier
+
+
+ROW_HASH_COLUMN = "_row_hash"  # Content hash of each uploaded row, under a unique index
+FILE_TABLE = "stats_uploadfile"  # UploadFile
+
+# Column type -> dtype its values are hashed as; other types hash as strings
+HASH_DTYPES = {"INTEGER": np.int64, "TIMESTAMP": np.int64, "REAL": np.float64}
+
+
+def file_sha256(chunks):
+    """
+    Hex SHA-256 of a file given as byte chunks.
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hashed(chunks, digest, stats):
+    # Passes the chunks through, hashing and counting them on the way
+    for chunk in chunks:
+        digest.update(chunk)
+        stats["size"] += len(chunk)
+        yield chunk
+
+
+def _file_loaded(cursor, table_name, sha256):
+    return cursor.execute(
+        f"SELECT 1 FROM {FILE_TABLE} WHERE table_name = ? AND sha256 = ?", [table_name, sha256]
+    ).fetchone() is not None
+
+
+def _already_loaded(cursor, table_name, sha256):
+    return bool(sha256) and load_schema(cursor, table_name) is not None and _file_loaded(cursor, table_name, sha256)
+
+
+def _record_file(cursor, table_name, sha256, size, rows):
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+    cursor.execute(
+        f"INSERT OR REPLACE INTO {FILE_TABLE} (table_name, sha256, size, rows, created_at) VALUES (?, ?, ?, ?, ?)",
+        [table_name, sha256, size, rows, now],
+    )
+
+
+def _hash_key(names, types):
+    # (index, dtype, salt) per column; salted by name, so column order does not matter
+    return [
+        (
+            index,
+            HASH_DTYPES.get(sql_type, object),
+            np.uint64(int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little")),
+        )
+        for index, (name, sql_type) in enumerate(zip(names, types))
+    ]
+
+
+def _row_hashes(rows, key):
+    """
+    64-bit content hashes of converted rows, as signed integers for SQLite.
+    Empty values do not count, so a row still matches after columns are added.
+    """
+    if not rows:
+        return []
+    combined = np.zeros(len(rows), dtype=np.uint64)
+    columns = list(zip(*rows))
+    for index, dtype, salt in key:
+        values = np.array(columns[index], dtype=object)
+        missing = pd.isna(values)
+        if dtype is not object:
+            # Numbers are hashed from their binary form, far faster than as strings
+            values = np.where(missing, 0, values)
+            if dtype is np.int64 and float in set(map(type, values)):
+                hashed = _widened_hashes(values)
+            else:
+                hashed = hash_array(values.astype(dtype))
+        else:
+            hashed = hash_array(values)
+        hashed = hash_array(hashed ^ salt)
+        hashed[missing] = 0
+        combined ^= hashed
+    return combined.view(np.int64).tolist()
+
+
+def _widened_hashes(values):
+    # A column widened from INTEGER to REAL: whole numbers hash as the integers they equal
+    whole = np.fromiter(
+        (type(value) is int or (value.is_integer() and -2 ** 63 <= value < 2 ** 63) for value in values),
+        dtype=bool, count=len(values),
+    )
+    hashed = np.empty(len(values), dtype=np.uint64)
+    hashed[whole] = hash_array(values[whole].astype(np.int64))
+    hashed[~whole] = hash_array(values[~whole].astype(np.float64))
+    return hashed
+
+
+def _hash_types(cursor, table_name, names, types):
+    # Types the columns hash as: a column created INTEGER still hashes as INTEGER once widened to REAL
+    declared = {row[1]: row[2] for row in cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)})")}
+    return [
+        "INTEGER" if sql_type == "REAL" and declared.get(name) == "INTEGER" else sql_type
+        for name, sql_type in zip(names, types)
+    ]
+
+
+def _hash_batches(batches, names, types):
+    # (rows, row numbers, rejects) batches -> (rows, row hashes, row numbers, rejects), with columns hashed as types
+    key = _hash_key(names, types)
+    for rows, numbers, rejects in batches:
+        yield rows, _row_hashes(rows, key), numbers, rejects
+
+
+def _row_hash_index_name(table_name):
+    return f"{table_name}_{ROW_HASH_COLUMN}_idx"
+
+
+def _row_hash_index(cursor, table_name):
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(_row_hash_index_name(table_name))} "
+        f"ON {quote_identifier(table_name)} ({quote_identifier(ROW_HASH_COLUMN)})"
+    )
+
+
+def _has_row_hash_index(cursor, table_name):
+    return cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", [_row_hash_index_name(table_name)]
+    ).fetchone() is not None
+
+
+def _add_row_hashes(cursor, table_name, schema):
+    """
+    Adds the row hash column to a table created before uploads were
+    deduplicated. Repeated rows already in it keep a NULL hash.
+    """
+    table = quote_identifier(table_name)
+    names = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if ROW_HASH_COLUMN in names:
+        return
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {quote_identifier(ROW_HASH_COLUMN)} INTEGER")
+    key = _hash_key(names, [schema.get(name, "TEXT") for name in names])
+    rows = cursor.execute(f"SELECT {', '.join(quote_identifier(name) for name in names)}, rowid FROM {table}").fetchall()
+    seen = set()
+    updates = []
+    for row_hash, row in zip(_row_hashes(rows, key), rows):
+        if row_hash not in seen:
+            seen.add(row_hash)
+            updates.append((row_hash, row[-1]))
+    cursor.executemany(f"UPDATE {table} SET {quote_identifier(ROW_HASH_COLUMN)} = ? WHERE rowid = ?", updates)
+    _row_hash_index(cursor, table_name)
+
+
+def _dedup_plan(cursor, table_name, checkpoint):
+    """
+    None if rows are deduplicated by the table's unique row hash index. A new
+    table gets the index after the load; until then its hashes are kept in
+    the list returned (see _new_rows).
+    """
+    if _has_row_hash_index(cursor, table_name):
+        return None
+    # A checkpointed load may share the table with other writers
+    if checkpoint or cursor.execute(f"SELECT 1 FROM {quote_identifier(table_name)} LIMIT 1").fetchone():
+        _row_hash_index(cursor, table_name)
+        return None
+    return []
+
+
+def _new_rows(loaded, batch):
+    """
+    The hashed batch without the rows whose hash is in loaded or repeated
+    in it. loaded is a list of sorted hash arrays, each more than twice the
+    size of the next; the new hashes are merged in.
+    """
+    rows, hashes, numbers, rejects = batch
+    if not rows:
+        return batch
+    # First occurrence of each hash in the batch
+    candidates, firsts = np.unique(np.asarray(hashes, dtype=np.int64), return_index=True)
+    seen = np.zeros(len(candidates), dtype=bool)
+    for run in loaded:
+        positions = np.minimum(np.searchsorted(run, candidates), len(run) - 1)
+        seen |= run[positions] == candidates
+    run = candidates[~seen]
+    if len(run):
+        while loaded and len(loaded[-1]) <= 2 * len(run):
+            run = np.sort(np.concatenate([loaded.pop(), run]), kind="mergesort")
+        loaded.append(run)
+
+    kept = np.sort(firsts[~seen]).tolist()
+    if len(kept) == len(rows):
+        return batch
+    return [rows[i] for i in kept], [hashes[i] for i in kept], [numbers[i] for i in kept], rejects
@@ -0,0 +1,159 @@
+# FILE: stats/fit_credentials.py
+
+import base64
+import datetime
+import hashlib
+import threading
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.utils import timezone
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from .models import FitCredential
+
+
+DEFAULT_TOKEN_REFRESH_MARGIN = 300  # Seconds before expiry at which the access token is refreshed
+
+# user_id -> Credentials whose access token is still valid. Access tokens are
+# also stored, so a restarted process reuses them instead of refreshing.
+_cache = {}
+_locks = {}
+_locks_guard = threading.Lock()
+# Token refreshes reuse one keep-alive session
+_transport = Request()
+
+
+class CredentialsMissing(Exception):
+    """
+    No usable stored credentials for a user; they have to connect Google Fit again.
+    """
+
+
+def _fernet():
+    # Keyed by FIT_CREDENTIAL_KEY, else by a key derived from SECRET_KEY
+    key = getattr(settings, "FIT_CREDENTIAL_KEY", "")
+    if not key:
+        key = base64.urlsafe_b64encode(hashlib.sha256(f"fit-credential:{settings.SECRET_KEY}".encode()).digest())
+    return Fernet(key)
+
+
+def encrypt_secret(value):
+    """
+    Encrypts a refresh token or client secret for storage in FitCredential.
+    """
+    return _fernet().encrypt(value.encode()).decode()
+
+
+def decrypt_secret(value):
+    """
+    Decrypts a value from encrypt_secret. Raises CredentialsMissing if it was
+    encrypted under another key (FIT_CREDENTIAL_KEY or SECRET_KEY changed).
+    """
+    try:
+        return _fernet().decrypt(value.encode()).decode()
+    except InvalidToken:
+        raise CredentialsMissing("Stored Google Fit credentials cannot be decrypted; please connect Google Fit again.")
+
+
+def _user_lock(user_id):
+    with _locks_guard:
+        return _locks.setdefault(user_id, threading.Lock())
+
+
+def save_credentials(user_id, credentials):
+    """
+    Stores the credentials from a finished OAuth flow for user_id, with the
+    refresh token and client secret encrypted. Google only issues a refresh
+    token on first consent, so a stored one is kept if the new credentials
+    come without it.
+    """
+    stored = FitCredential.objects.filter(user_id=user_id).first()
+    refresh_token = credentials.refresh_token or (decrypt_secret(stored.refresh_token) if stored else None)
+    if not refresh_token:
+        raise CredentialsMissing("Google did not return a refresh token; unattended sync is not possible.")
+
+    expiry = credentials.expiry
+    if expiry is not None:
+        # google-auth uses naive UTC datetimes
+        expiry = timezone.make_aware(expiry, datetime.timezone.utc)
+    FitCredential.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            "token": credentials.token or "",
+            "refresh_token": encrypt_secret(refresh_token),
+            "token_uri": credentials.token_uri,
+            "client_id": credentials.client_id,
+            "client_secret": encrypt_secret(credentials.client_secret or ""),
+            "scopes": " ".join(credentials.scopes or []),
+            "expiry": expiry,
+        },
+    )
+    with _user_lock(user_id):
+        _cache.pop(user_id, None)
+
+
+def delete_credentials(user_id):
+    FitCredential.objects.filter(user_id=user_id).delete()
+    with _user_lock(user_id):
+        _cache.pop(user_id, None)
+
+
+def connected_user_ids():
+    """
+    Ids of all users with stored credentials.
+    """
+    return list(FitCredential.objects.order_by("user_id").values_list("user_id", flat=True))
+
+
+def _needs_refresh(credentials):
+    if not credentials.token or credentials.expiry is None:
+        return True
+    margin = getattr(settings, "GOOGLE_FIT_TOKEN_REFRESH_MARGIN", DEFAULT_TOKEN_REFRESH_MARGIN)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - datetime.timedelta(seconds=margin) <= now
+
+
+def _from_record(record):
+    expiry = record.expiry
+    if expiry is not None:
+        expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return Credentials(
+        token=record.token or None,
+        refresh_token=decrypt_secret(record.refresh_token),
+        token_uri=record.token_uri,
+        client_id=record.client_id,
+        client_secret=decrypt_secret(record.client_secret),
+        scopes=record.scopes.split() or None,
+        expiry=expiry,
+    )
+
+
+def get_credentials(user_id):
+    """
+    Returns Credentials for user_id with an access token valid for at least
+    GOOGLE_FIT_TOKEN_REFRESH_MARGIN seconds, refreshing and storing a new one
+    if needed. Raises CredentialsMissing if the user never connected, or
+    their stored credentials cannot be decrypted.
+    """
+    with _user_lock(user_id):
+        credentials = _cache.get(user_id)
+        if credentials is None:
+            record = FitCredential.objects.filter(user_id=user_id).first()
+            if record is None:
+                raise CredentialsMissing(f"No stored Google Fit credentials for {user_id}. Please sync again.")
+            credentials = _from_record(record)
+
+        if _needs_refresh(credentials):
+            credentials.refresh(_transport)
+            expiry = credentials.expiry
+            FitCredential.objects.filter(user_id=user_id).update(
+                token=credentials.token,
+                # Google may rotate the refresh token
+                refresh_token=encrypt_secret(credentials.refresh_token),
+                expiry=timezone.make_aware(expiry, datetime.timezone.utc) if expiry else None,
+                updated_at=timezone.now(),
+            )
+        _cache[user_id] = credentials
+        return credentials
@@ -0,0 +1,152 @@
+# FILE: stats/fit_metrics.py
+
+from collections import namedtuple
+
+import numpy as np
+
+from .models import UserSteps, UserHR, UserCalories, UserSleep
+
+
+# One entry per synced Google Fit metric:
+#   name            short key used in logs/progress
+#   data_type       Google Fit dataTypeName
+#   data_source_id  Google Fit dataSourceId to aggregate
+#   value_field     point value to read: "intVal", "fpVal", or "duration"
+#                   (segment length in minutes, from the point's nanosecond bounds)
+#   reducer         how points are combined per daily bucket (see REDUCERS)
+#   model           daily model the result is stored in (unique on user_id, date)
+#   model_field     column of `model` holding the value
+#   cast            conversion applied to the reduced value before storing
+FitMetric = namedtuple("FitMetric", [
+    "name", "data_type", "data_source_id", "value_field", "reducer", "model", "model_field", "cast",
+])
+
+
+FIT_METRICS = [
+    FitMetric(
+        name="steps",
+        data_type="com.google.step_count.delta",
+        data_source_id="derived:com.google.step_count.delta:com.google.android.gms:merge_step_deltas",
+        value_field="intVal",
+        reducer="sum",
+        model=UserSteps,
+        model_field="steps",
+        cast=int,
+    ),
+    FitMetric(
+        name="heart_rate",
+        data_type="com.google.heart_rate.bpm",
+        data_source_id="derived:com.google.heart_rate.bpm:com.google.android.gms:merge_heart_rate_bpm",
+        value_field="fpVal",
+        reducer="mean",
+        model=UserHR,
+        model_field="average_hr",
+        cast=float,
+    ),
+    FitMetric(
+        name="calories",
+        data_type="com.google.calories.expended",
+        data_source_id="derived:com.google.calories.expended:com.google.android.gms:merge_calories_expended",
+        value_field="fpVal",
+        reducer="sum",
+        model=UserCalories,
+        model_field="calories",
+        cast=float,
+    ),
+    FitMetric(
+        # Real logic might skip awake segments, but let's sum everything for simplicity
+        name="sleep",
+        data_type="com.google.sleep.segment",
+        data_source_id="derived:com.google.sleep.segment:com.google.android.gms:merged",
+        value_field="duration",
+        reducer="sum",
+        model=UserSleep,
+        model_field="sleep_minutes",
+        cast=int,
+    ),
+]
+
+
+def _reduce_sum(bucket_index, values, n_buckets):
+    return np.bincount(bucket_index, weights=values, minlength=n_buckets)
+
+
+def _reduce_mean(bucket_index, values, n_buckets):
+    sums = np.bincount(bucket_index, weights=values, minlength=n_buckets)
+    counts = np.bincount(bucket_index, minlength=n_buckets)
+    # Buckets without points average to 0.0
+    return np.divide(sums, counts, out=np.zeros(n_buckets), where=counts > 0)
+
+
+def _reduce_extreme(ufunc, initial):
+    def reduce(bucket_index, values, n_buckets):
+        out = np.full(n_buckets, initial)
+        ufunc.at(out, bucket_index, values)
+        out[np.isinf(out)] = 0.0
+        return out
+    return reduce
+
+
+# reducer name -> f(bucket_index, values, n_buckets) returning one value per bucket
+REDUCERS = {
+    "sum": _reduce_sum,
+    "mean": _reduce_mean,
+    "min": _reduce_extreme(np.minimum, np.inf),
+    "max": _reduce_extreme(np.maximum, -np.inf),
+}
+
+
+def flatten_buckets(data, value_field):
+    """
+    Flattens a dataset:aggregate response into NumPy arrays in one pass:
+    bucket start times (epoch millis), the bucket index of every point, and
+    every point's value.
+    """
+    buckets = data.get("bucket", [])
+    bucket_starts = np.fromiter(
+        (int(bucket["startTimeMillis"]) for bucket in buckets), dtype=np.int64, count=len(buckets)
+    )
+    point_lists = [
+        [dataset.get("point", []) for dataset in bucket.get("dataset", [])]
+        for bucket in buckets
+    ]
+    counts = np.fromiter(
+        (sum(len(points) for points in lists) for lists in point_lists), dtype=np.intp, count=len(buckets)
+    )
+    bucket_index = np.repeat(np.arange(len(buckets)), counts)
+    n_points = int(counts.sum())
+
+    # Generators over the existing point dicts, so no per-point objects are allocated
+    def each_point():
+        for lists in point_lists:
+            for points in lists:
+                yield from points
+
+    if value_field == "duration":
+        starts = np.fromiter((int(p["startTimeNanos"]) for p in each_point()), dtype=np.int64, count=n_points)
+        ends = np.fromiter((int(p["endTimeNanos"]) for p in each_point()), dtype=np.int64, count=n_points)
+        values = (ends - starts) / 6e10  # nanoseconds -> minutes
+    else:
+        values = np.fromiter(
+            (p["value"][0].get(value_field, 0) for p in each_point()), dtype=np.float64, count=n_points
+        )
+    return bucket_starts, bucket_index, values
+
+
+def bucket_dates(bucket_starts):
+    """
+    Epoch millis -> 'YYYY-MM-DD' (UTC) for an array of bucket start times.
+    """
+    return bucket_starts.astype("datetime64[ms]").astype("datetime64[D]").astype(str)
+
+
+def parse_metric(metric, data, user_id):
+    """
+    Turns a dataset:aggregate response into one `metric.model` row per bucket.
+    """
+    bucket_starts, bucket_index, values = flatten_buckets(data, metric.value_field)
+    reduced = REDUCERS[metric.reducer](bucket_index, values, len(bucket_starts))
+    return [
+        metric.model(user_id=user_id, date=date, **{metric.model_field: metric.cast(value)})
+        for date, value in zip(bucket_dates(bucket_starts), reduced)
+    ]
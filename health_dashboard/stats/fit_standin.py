@@ -0,0 +1,211 @@
+# FILE: stats/fit_standin.py
+
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fit_fixtures")
+
+# Synthetic value generators per data type: (value key, generator(rng))
+SYNTHETIC_VALUES = {
+    "com.google.step_count.delta": ("intVal", lambda rng: rng.randint(0, 600)),
+    "com.google.heart_rate.bpm": ("fpVal", lambda rng: round(rng.uniform(55, 120), 1)),
+    "com.google.calories.expended": ("fpVal", lambda rng: round(rng.uniform(20, 150), 2)),
+    "com.google.sleep.segment": ("intVal", lambda rng: rng.choice([1, 4, 5, 6])),  # sleep stage
+}
+
+
+def load_recorded_bucket(data_type_name):
+    """
+    Returns the recorded single-day bucket for a data type from
+    stats/fit_fixtures/<dataTypeName>.json, or None if there is none.
+    """
+    path = os.path.join(FIXTURES_DIR, f"{data_type_name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class FitStandInHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the parts of the Google Fit REST API the sync uses:
+    POST .../users/me/dataset:aggregate and
+    GET .../users/me/dataSources/<id>/datasets/<startNanos>-<endNanos>,
+    plus an OAuth token endpoint (POST /token) for refresh-token grants.
+
+    Responses have the shapes fetch_all_fit_data parses. Settings are class
+    attributes; start_standin() binds them to a per-server subclass.
+    """
+    points_per_bucket = 24  # Synthetic points per day (sleep: segments per night)
+    latency = 0.0  # Seconds added to every response
+    latencies = {}  # Per data type latency, overrides `latency`
+    jitter = 0.0  # Extra uniform random latency, in seconds
+    failure_rate = 0.0  # Probability of answering with failure_status
+    failure_status = 503
+    replay = False  # Serve recorded fixtures instead of synthetic points
+    seed = 0
+    token_lifetime = 3600  # expires_in of issued access tokens, in seconds
+
+    def do_POST(self):
+        if urlsplit(self.path).path == "/token":
+            return self.issue_token()
+        if not self.path.endswith("/dataset:aggregate"):
+            return self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        aggregate_by = body["aggregateBy"][0]
+        data_type_name = aggregate_by["dataTypeName"]
+        if self.simulate_network(data_type_name):
+            return
+
+        bucket_millis = int(body.get("bucketByTime", {}).get("durationMillis", 86400000))
+        buckets = []
+        for bucket_start in range(int(body["startTimeMillis"]), int(body["endTimeMillis"]), bucket_millis):
+            points = self.make_points(data_type_name, aggregate_by.get("dataSourceId", ""),
+                                      bucket_start, bucket_millis)
+            buckets.append({
+                "startTimeMillis": str(bucket_start),
+                "endTimeMillis": str(bucket_start + bucket_millis),
+                "dataset": [{
+                    "dataSourceId": f"derived:{data_type_name}:com.google.android.gms:aggregated",
+                    "point": points,
+                }],
+            })
+        self.send_json(200, {"bucket": buckets})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.split("/")
+        if "dataSources" not in parts or "datasets" not in parts:
+            return self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+        data_source_id = parts[parts.index("dataSources") + 1]
+        data_type_name = data_source_id.split(":")[1] if ":" in data_source_id else data_source_id
+        if self.simulate_network(data_type_name):
+            return
+
+        start_nanos, end_nanos = (int(x) for x in parts[parts.index("datasets") + 1].split("-"))
+        points = []
+        for day_start in range(start_nanos // 1000000, end_nanos // 1000000, 86400000):
+            points.extend(self.make_points(data_type_name, data_source_id, day_start, 86400000))
+
+        query = parse_qs(url.query)
+        limit = int(query.get("limit", [len(points) or 1])[0])
+        offset = int(query.get("pageToken", ["0"])[0])
+        payload = {
+            "minStartTimeNs": str(start_nanos),
+            "maxEndTimeNs": str(end_nanos),
+            "dataSourceId": data_source_id,
+            "point": points[offset:offset + limit],
+        }
+        if offset + limit < len(points):
+            payload["nextPageToken"] = str(offset + limit)
+        self.send_json(200, payload)
+
+    def issue_token(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        if form.get("grant_type") != ["refresh_token"] or not form.get("refresh_token"):
+            return self.send_json(400, {"error": "invalid_grant"})
+        self.send_json(200, {
+            "access_token": f"standin-{random.getrandbits(64):x}",
+            "expires_in": self.token_lifetime,
+            "token_type": "Bearer",
+        })
+
+    def simulate_network(self, data_type_name):
+        """
+        Sleeps for the configured latency and, with probability failure_rate,
+        sends an error response. Returns True if the request was failed.
+        """
+        delay = self.latencies.get(data_type_name, self.latency)
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.send_json(self.failure_status, {
+                "error": {"code": self.failure_status, "message": "Simulated failure from Fit stand-in"}
+            })
+            return True
+        return False
+
+    def make_points(self, data_type_name, data_source_id, bucket_start, bucket_millis):
+        if self.replay:
+            recorded = load_recorded_bucket(data_type_name)
+            if recorded is not None:
+                return self.replay_points(recorded, data_type_name, bucket_start)
+
+        rng = random.Random(f"{self.seed}:{data_type_name}:{bucket_start}")
+        value_key, generate = SYNTHETIC_VALUES.get(data_type_name, ("fpVal", lambda r: r.random()))
+        count = max(self.points_per_bucket, 1)
+        if data_type_name == "com.google.sleep.segment":
+            # Consecutive segments covering roughly the first 8 hours of the day
+            span = 8 * 3600000 // count
+        else:
+            span = bucket_millis // count
+        points = []
+        for i in range(count):
+            start = bucket_start + i * span
+            points.append({
+                "startTimeNanos": str(start * 1000000),
+                "endTimeNanos": str((start + span) * 1000000),
+                "dataTypeName": data_type_name,
+                "originDataSourceId": data_source_id,
+                "value": [{value_key: generate(rng)}],
+            })
+        return points
+
+    def replay_points(self, recorded, data_type_name, bucket_start):
+        """
+        Shifts the recorded day's points onto the requested bucket.
+        """
+        offset_nanos = (bucket_start - int(recorded["startTimeMillis"])) * 1000000
+        points = []
+        for dataset in recorded.get("dataset", []):
+            for point in dataset.get("point", []):
+                shifted = dict(point)
+                shifted["startTimeNanos"] = str(int(point["startTimeNanos"]) + offset_nanos)
+                shifted["endTimeNanos"] = str(int(point["endTimeNanos"]) + offset_nanos)
+                shifted.setdefault("dataTypeName", data_type_name)
+                points.append(shifted)
+        return points
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_standin(host="127.0.0.1", port=0, **config):
+    """
+    Starts a stand-in server on a background thread. Keyword arguments set
+    the FitStandInHandler options. Returns (server, base_url), where base_url
+    is suitable for settings.GOOGLE_FIT_API_URL; the token endpoint is at
+    http://<host>:<port>/token.
+    """
+    handler = type("ConfiguredFitStandInHandler", (FitStandInHandler,), config)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/fitness/v1"
+
+
+def serve_standin(conn, config):
+    """
+    Process target: starts a stand-in with the options in config, sends its
+    base URL through conn (a multiprocessing Connection) and serves until
+    anything is received back.
+    """
+    server, api_url = start_standin(**config)
+    conn.send(api_url)
+    conn.recv()
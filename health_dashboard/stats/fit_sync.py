@@ -0,0 +1,462 @@
+# FILE: stats/fit_sync.py
+
+import calendar
+import contextlib
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, F, Max, Min, Sum
+
+from . import http_client
+from .json_stream import iter_json_array
+from .fit_metrics import FIT_METRICS, parse_metric
+from .models import SyncState, BackfillWindow, FitDataPoint
+
+
+DEFAULT_FIT_API_URL = "https://www.googleapis.com/fitness/v1"
+DAY_MILLIS = 86400000
+DEFAULT_SYNC_LOOKBACK_DAYS = 30
+DEFAULT_BACKFILL_WINDOW_DAYS = 30
+DEFAULT_BACKFILL_MAX_WORKERS = 4
+RAW_PAGE_SIZE = 10000
+RAW_INSERT_BATCH_SIZE = 5000
+UPSERT_BATCH_SIZE = 1000
+STREAM_BATCH_BUCKETS = 10  # Buckets parsed and written together in streaming mode
+STREAM_QUEUE_SIZE = 8  # Parsed batches buffered between the fetch threads and the writer
+STREAM_CHUNK_SIZE = 65536
+
+
+def get_fit_api_url():
+    """
+    Base URL of the Google Fit REST API (overridable via settings.GOOGLE_FIT_API_URL).
+    """
+    return getattr(settings, "GOOGLE_FIT_API_URL", DEFAULT_FIT_API_URL).rstrip("/")
+
+
+def _aggregate_request(token, data_type_name, data_source_id, start_time_millis, end_time_millis):
+    url = f"{get_fit_api_url()}/users/me/dataset:aggregate"
+    headers = {"Authorization": f"Bearer {token}"}
+    body = {
+        "aggregateBy": [
+            {
+                "dataTypeName": data_type_name,
+                "dataSourceId": data_source_id,
+            }
+        ],
+        "bucketByTime": {"durationMillis": DAY_MILLIS},  # 1 day
+        "startTimeMillis": start_time_millis,
+        "endTimeMillis": end_time_millis,
+    }
+    return url, headers, body
+
+
+def aggregate_fitness_data(token, data_type_name, data_source_id, start_time_millis, end_time_millis):
+    """
+    Calls Google Fit's dataset:aggregate endpoint for one data type,
+    bucketed by day, and returns the decoded JSON response.
+    """
+    url, headers, body = _aggregate_request(
+        token, data_type_name, data_source_id, start_time_millis, end_time_millis
+    )
+    response = http_client.post(url, headers=headers, json=body)
+    if response.status_code != 200:
+        raise Exception(f"Error fetching {data_type_name}: {response.status_code} - {response.text}")
+    return response.json()
+
+
+def stream_fitness_buckets(token, data_type_name, data_source_id, start_time_millis, end_time_millis):
+    """
+    Like aggregate_fitness_data, but reads the response body incrementally
+    and yields its buckets one at a time instead of decoding it whole.
+    """
+    url, headers, body = _aggregate_request(
+        token, data_type_name, data_source_id, start_time_millis, end_time_millis
+    )
+    with http_client.post(url, headers=headers, json=body, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Error fetching {data_type_name}: {response.status_code} - {response.text}")
+        yield from iter_json_array(response.iter_content(STREAM_CHUNK_SIZE), "bucket")
+
+
+def stream_raw_points(token, data_type_name, data_source_id, start_time_millis, end_time_millis):
+    """
+    Pages through a data source's raw dataset for [start, end), yielding
+    data points (startTimeNanos, endTimeNanos, value, ...) as they are read.
+    """
+    dataset_id = f"{start_time_millis * 1000000}-{end_time_millis * 1000000}"
+    url = f"{get_fit_api_url()}/users/me/dataSources/{data_source_id}/datasets/{dataset_id}"
+    headers = {"Authorization": f"Bearer {token}"}
+    page_token = None
+    while True:
+        params = {"limit": RAW_PAGE_SIZE}
+        if page_token:
+            params["pageToken"] = page_token
+        page = {}
+        with http_client.get(url, headers=headers, params=params, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Error fetching raw {data_type_name}: {response.status_code} - {response.text}")
+            yield from iter_json_array(response.iter_content(STREAM_CHUNK_SIZE), "point", page)
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def fetch_raw_points(token, data_type_name, data_source_id, start_time_millis, end_time_millis):
+    """
+    Returns all raw data points of a data source for [start, end) as a list.
+    """
+    return list(stream_raw_points(token, data_type_name, data_source_id, start_time_millis, end_time_millis))
+
+
+def store_raw_points(user_id, data_type_name, points):
+    """
+    Appends raw points to FitDataPoint in batches; points already stored are skipped.
+    """
+    rows = []
+    for point in points:
+        value = point["value"][0]
+        rows.append(FitDataPoint(
+            user_id=user_id,
+            data_type=data_type_name,
+            start_ms=int(point["startTimeNanos"]) // 1000000,
+            end_ms=int(point["endTimeNanos"]) // 1000000,
+            value=value["fpVal"] if "fpVal" in value else value.get("intVal", 0),
+            source_id=point.get("originDataSourceId", ""),
+        ))
+    FitDataPoint.objects.bulk_create(rows, batch_size=RAW_INSERT_BATCH_SIZE, ignore_conflicts=True)
+
+
+# Reducer name -> ORM aggregate used when rolling raw points up per day
+RAW_AGGREGATES = {"sum": Sum, "mean": Avg, "min": Min, "max": Max}
+
+
+def rollup_raw_points(metric, user_id, start_millis, end_millis):
+    """
+    Computes daily rows for one metric from the stored raw points in
+    [start, end) with a single GROUP BY query, without calling the API.
+    """
+    if metric.value_field == "duration":
+        # Segment lengths in millis, converted to minutes below
+        expression = F("end_ms") - F("start_ms")
+    else:
+        expression = F("value")
+    days = (
+        FitDataPoint.objects
+        .filter(user_id=user_id, data_type=metric.data_type,
+                start_ms__gte=start_millis, start_ms__lt=end_millis)
+        .annotate(day=F("start_ms") / DAY_MILLIS)
+        .values("day")
+        .annotate(total=RAW_AGGREGATES[metric.reducer](expression))
+        .order_by("day")
+    )
+    rows = []
+    for row in days:
+        value = row["total"] / 60000 if metric.value_field == "duration" else row["total"]
+        rows.append(metric.model(
+            user_id=user_id,
+            date=time.strftime("%Y-%m-%d", time.gmtime(row["day"] * DAY_MILLIS // 1000)),
+            **{metric.model_field: metric.cast(value)},
+        ))
+    return rows
+
+
+def upsert_daily_rows(model, rows):
+    """
+    Writes daily rows with INSERT ... ON CONFLICT (user_id, date) DO UPDATE,
+    in batches, so days that are already stored (e.g. today's partial step
+    count) get their values refreshed instead of being skipped.
+    """
+    if not rows:
+        return
+    value_fields = [
+        field.name for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in ("user_id", "date")
+    ]
+    model.objects.bulk_create(
+        rows,
+        batch_size=UPSERT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["user_id", "date"],
+        update_fields=value_fields,
+    )
+
+
+def floor_to_day(millis):
+    return millis - millis % DAY_MILLIS
+
+
+def fetch_all_fit_data(credentials, user_id, max_workers=4, raw=None, stream=None, end_millis=None):
+    """
+    Fetch Steps, HR, Calories, and Sleep from Google Fit in daily buckets.
+
+    Each metric only asks for the interval since its SyncState watermark
+    (or the last GOOGLE_FIT_SYNC_LOOKBACK_DAYS days on a first sync). The
+    watermark is left at the start of the current (partial) day, so a sync
+    with nothing new fetches a single bucket however much history is stored.
+
+    The metrics are requested concurrently over the shared session, so the
+    sync takes about as long as the slowest request rather than the sum of
+    all of them. Rows and watermarks are written in a single transaction
+    (but see streaming mode below).
+
+    In raw mode (GOOGLE_FIT_RAW_MODE, or raw=True) the intraday points are
+    fetched instead, appended to FitDataPoint, and the daily rows are rolled
+    up from them locally.
+
+    In streaming mode (GOOGLE_FIT_STREAM_PARSE, or stream=True) responses are
+    parsed incrementally and written in batches while they download, so peak
+    memory stays bounded however many points a window holds. Each batch is
+    committed on its own, so the database is not locked for the length of
+    the download; the watermarks are still only moved once every metric
+    has been written.
+
+    end_millis (UTC midnight) stops the sync there instead of at the current
+    time and moves the watermarks to it, so a user far behind can be caught
+    up in slices. Metrics already synced past it are skipped.
+    Returns the number of daily rows fetched.
+    """
+    if raw is None:
+        raw = getattr(settings, "GOOGLE_FIT_RAW_MODE", False)
+    if stream is None:
+        stream = getattr(settings, "GOOGLE_FIT_STREAM_PARSE", False)
+    now_millis = int(time.time() * 1000)
+    if end_millis is None:
+        end_millis = now_millis
+        synced_until = floor_to_day(now_millis)
+    else:
+        synced_until = end_millis
+    lookback_days = getattr(settings, "GOOGLE_FIT_SYNC_LOOKBACK_DAYS", DEFAULT_SYNC_LOOKBACK_DAYS)
+    default_start = floor_to_day(now_millis) - lookback_days * DAY_MILLIS
+
+    starts = get_sync_starts(user_id, default_start)
+    metric_starts = [
+        (metric, start_millis)
+        for metric, start_millis in zip(FIT_METRICS, starts)
+        if start_millis < end_millis
+    ]
+    if not metric_starts:
+        return 0
+
+    if stream:
+        rows_fetched = _sync_streamed(credentials.token, user_id, metric_starts, end_millis, raw, max_workers)
+    with transaction.atomic():
+        if not stream:
+            rows_fetched = _sync_buffered(credentials.token, user_id, metric_starts, end_millis, raw, max_workers)
+        SyncState.objects.bulk_create(
+            [
+                SyncState(user_id=user_id, metric=metric.data_type, synced_until=synced_until)
+                for metric, _ in metric_starts
+            ],
+            update_conflicts=True,
+            unique_fields=["user_id", "metric"],
+            update_fields=["synced_until"],
+        )
+    return rows_fetched
+
+
+def get_sync_starts(user_id, default_start):
+    """
+    Start of the next sync for every metric in FIT_METRICS: its SyncState
+    watermark, or default_start if it was never synced.
+    """
+    watermarks = dict(
+        SyncState.objects.filter(user_id=user_id).values_list("metric", "synced_until")
+    )
+    return [watermarks.get(metric.data_type, default_start) for metric in FIT_METRICS]
+
+
+def _sync_buffered(token, user_id, metric_starts, end_millis, raw, max_workers):
+    fetch = fetch_raw_points if raw else aggregate_fitness_data
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(fetch, token, metric.data_type, metric.data_source_id, start_millis, end_millis)
+            for metric, start_millis in metric_starts
+        ]
+        responses = [future.result() for future in futures]
+
+    rows_fetched = 0
+    for (metric, start_millis), data in zip(metric_starts, responses):
+        if raw:
+            store_raw_points(user_id, metric.data_type, data)
+            rows = rollup_raw_points(metric, user_id, start_millis, end_millis)
+        else:
+            rows = parse_metric(metric, data, user_id)
+        upsert_daily_rows(metric.model, rows)
+        rows_fetched += len(rows)
+    return rows_fetched
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _put(batches, item, cancelled):
+    # Waits for room in the bounded queue unless the writer has given up
+    while not cancelled.is_set():
+        try:
+            batches.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            pass
+
+
+def _produce_batches(token, user_id, metric, start_millis, end_millis, raw, batches, cancelled):
+    """
+    Streams one metric and puts (metric, batch) items on `batches`: lists of
+    raw points in raw mode, parsed daily rows otherwise. Always finishes with
+    (metric, None).
+    """
+    try:
+        if raw:
+            stream = stream_raw_points(token, metric.data_type, metric.data_source_id, start_millis, end_millis)
+            size = RAW_INSERT_BATCH_SIZE
+        else:
+            stream = stream_fitness_buckets(token, metric.data_type, metric.data_source_id, start_millis, end_millis)
+            size = STREAM_BATCH_BUCKETS
+        with contextlib.closing(stream):
+            for batch in _batched(stream, size):
+                if cancelled.is_set():
+                    return
+                if not raw:
+                    batch = parse_metric(metric, {"bucket": batch}, user_id)
+                _put(batches, (metric, batch), cancelled)
+    finally:
+        _put(batches, (metric, None), cancelled)
+
+
+def _sync_streamed(token, user_id, metric_starts, end_millis, raw, max_workers):
+    """
+    Fetch threads parse their responses incrementally and hand fixed-size
+    batches through a bounded queue to this thread, which writes them as they
+    arrive. Peak memory is a few batches per metric, whatever the window holds.
+    Every batch is its own short transaction: a write held open across the
+    download (and its retries) would lock out every other writer meanwhile.
+    """
+    batches = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
+    rows_fetched = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_produce_batches, token, user_id, metric, start_millis, end_millis, raw, batches, cancelled)
+            for metric, start_millis in metric_starts
+        ]
+        try:
+            remaining = len(futures)
+            while remaining:
+                metric, batch = batches.get()
+                if batch is None:
+                    remaining -= 1
+                    continue
+                with transaction.atomic():
+                    if raw:
+                        store_raw_points(user_id, metric.data_type, batch)
+                    else:
+                        upsert_daily_rows(metric.model, batch)
+                        rows_fetched += len(batch)
+        except BaseException:
+            cancelled.set()
+            raise
+        for future in futures:
+            future.result()
+
+    if raw:
+        for metric, start_millis in metric_starts:
+            rows = rollup_raw_points(metric, user_id, start_millis, end_millis)
+            with transaction.atomic():
+                upsert_daily_rows(metric.model, rows)
+            rows_fetched += len(rows)
+    return rows_fetched
+
+
+def date_to_millis(date_str):
+    """
+    Converts a YYYY-MM-DD string to epoch millis at UTC midnight.
+    """
+    return int(calendar.timegm(time.strptime(date_str, "%Y-%m-%d")) * 1000)
+
+
+def split_into_windows(start_millis, end_millis, window_millis):
+    windows = []
+    window_start = start_millis
+    while window_start < end_millis:
+        window_end = min(window_start + window_millis, end_millis)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def backfill_fit_data(credentials, user_id, start_date, end_date=None,
+                      window_days=None, max_workers=None, progress=None):
+    """
+    Backfill Google Fit history between start_date and end_date (YYYY-MM-DD,
+    end defaults to today) for every metric.
+
+    The range is split into windows of GOOGLE_FIT_BACKFILL_WINDOW_DAYS days,
+    fetched in parallel by at most GOOGLE_FIT_BACKFILL_MAX_WORKERS threads.
+    Each finished window is stored together with its BackfillWindow
+    checkpoint, so re-running an interrupted backfill only fetches the
+    windows that are still missing.
+
+    progress, if given, is called as progress(windows_done, windows_total).
+    Returns the number of daily rows fetched.
+    """
+    if window_days is None:
+        window_days = getattr(settings, "GOOGLE_FIT_BACKFILL_WINDOW_DAYS", DEFAULT_BACKFILL_WINDOW_DAYS)
+    if max_workers is None:
+        max_workers = getattr(settings, "GOOGLE_FIT_BACKFILL_MAX_WORKERS", DEFAULT_BACKFILL_MAX_WORKERS)
+
+    start_millis = date_to_millis(start_date)
+    end_millis = date_to_millis(end_date) if end_date else floor_to_day(int(time.time() * 1000))
+    windows = split_into_windows(start_millis, end_millis, window_days * DAY_MILLIS)
+
+    completed = set(
+        BackfillWindow.objects.filter(
+            user_id=user_id, window_start__gte=start_millis, window_end__lte=end_millis
+        ).values_list("metric", "window_start", "window_end")
+    )
+    pending = [
+        (metric, window_start, window_end)
+        for metric in FIT_METRICS
+        for window_start, window_end in windows
+        if (metric.data_type, window_start, window_end) not in completed
+    ]
+    total = len(FIT_METRICS) * len(windows)
+    done = total - len(pending)
+    if progress:
+        progress(done, total)
+
+    rows_fetched = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                aggregate_fitness_data,
+                credentials.token, metric.data_type, metric.data_source_id, window_start, window_end,
+            ): (metric, window_start, window_end)
+            for metric, window_start, window_end in pending
+        }
+        try:
+            # Windows are written from this thread as they finish, keeping a single DB writer
+            for future in as_completed(futures):
+                metric, window_start, window_end = futures[future]
+                rows = parse_metric(metric, future.result(), user_id)
+                with transaction.atomic():
+                    upsert_daily_rows(metric.model, rows)
+                    BackfillWindow.objects.create(
+                        user_id=user_id, metric=metric.data_type,
+                        window_start=window_start, window_end=window_end, rows=len(rows),
+                    )
+                rows_fetched += len(rows)
+                done += 1
+                if progress:
+                    progress(done, total)
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+    return rows_fetched
@@ -0,0 +1,161 @@
+# FILE: stats/http_client.py
+
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+
+# Defaults, each overridable in settings.py
+DEFAULT_TIMEOUT = (5, 60)  # (connect, read) seconds
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5  # seconds
+DEFAULT_BACKOFF_MAX = 30.0  # seconds
+DEFAULT_POOL_MAXSIZE = 10  # also caps concurrent requests per host
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses saying the request was not processed, so even one that is not
+# idempotent (e.g. a billed completion) can be sent again
+UNPROCESSED_STATUSES = {429, 503}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _build_session():
+    pool_maxsize = getattr(settings, "HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)
+    # pool_block makes callers wait for a free connection instead of opening
+    # extra throwaway ones, which bounds concurrent calls to each host.
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize, pool_block=True)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session, adapter
+
+
+_session, _adapter = _build_session()
+_buckets = {}
+_buckets_lock = threading.Lock()
+_counters = {"requests": 0, "retries": 0, "failures": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name, amount=1):
+    with _counters_lock:
+        _counters[name] += amount
+
+
+def _bucket_for(host):
+    with _buckets_lock:
+        if host not in _buckets:
+            limit = getattr(settings, "HTTP_RATE_LIMITS", {}).get(host)
+            _buckets[host] = TokenBucket(*limit) if limit else None
+        return _buckets[host]
+
+
+def _backoff_delay(attempt, response=None):
+    """
+    Full-jitter exponential backoff; honours a numeric Retry-After header.
+    """
+    backoff_max = getattr(settings, "HTTP_BACKOFF_MAX", DEFAULT_BACKOFF_MAX)
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), backoff_max)
+    base = getattr(settings, "HTTP_BACKOFF_BASE", DEFAULT_BACKOFF_BASE)
+    return random.uniform(0, min(backoff_max, base * (2 ** attempt)))
+
+
+def request(method, url, max_retries=None, idempotent=True, **kwargs):
+    """
+    Sends a request over the shared keep-alive session.
+
+    Every attempt waits for the host's token bucket (settings.HTTP_RATE_LIMITS)
+    and uses a hard timeout. Connection errors, timeouts and 429/5xx responses
+    are retried with jittered exponential backoff. A request that is not
+    idempotent is only retried when it cannot have been processed: the
+    connection was never made, or the response is 429/503. The last response
+    is returned (whatever its status); if the last attempt raised, the
+    exception propagates.
+    """
+    if max_retries is None:
+        max_retries = getattr(settings, "HTTP_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+    kwargs.setdefault("timeout", getattr(settings, "HTTP_TIMEOUT", DEFAULT_TIMEOUT))
+    bucket = _bucket_for(urlsplit(url).hostname)
+    retry_errors = (requests.ConnectionError, requests.Timeout) if idempotent else requests.ConnectTimeout
+    retry_statuses = RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+
+    attempt = 0
+    while True:
+        if bucket:
+            bucket.acquire()
+        _count("requests")
+        try:
+            response = _session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if not isinstance(e, retry_errors) or attempt >= max_retries:
+                _count("failures")
+                raise
+            delay = _backoff_delay(attempt)
+        else:
+            if response.status_code not in retry_statuses or attempt >= max_retries:
+                return response
+            response.close()
+            delay = _backoff_delay(attempt, response)
+        _count("retries")
+        attempt += 1
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_stats():
+    """
+    Counters since start-up: requests sent, retries, requests that gave up on
+    a connection error, and how many requests reused a pooled connection.
+    """
+    with _counters_lock:
+        stats = dict(_counters)
+    connections_opened = 0
+    pool_requests = 0
+    pools = _adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is not None:
+            connections_opened += pool.num_connections
+            pool_requests += pool.num_requests
+    stats["connections_opened"] = connections_opened
+    stats["connections_reused"] = max(pool_requests - connections_opened, 0)
+    return stats
@@ -0,0 +1,399 @@
+# FILE: stats/ingest.py
+
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from .dedup import (
+    FILE_TABLE, ROW_HASH_COLUMN, _add_row_hashes, _already_loaded, _dedup_plan, _hash_batches, _hash_types,
+    _hashed, _new_rows, _record_file, _row_hash_index,
+)
+from .observations import OBSERVATION_TABLE, _column_metrics, _observation_plan, _write_observations
+from .parsing import _batched, _check_lengths, _convert_batch, _infer_types, _read_csv
+from .upload_db import SCHEMA_TABLE, _bulk_load, _table_exists, load_schema, quote_identifier
+from .validation import check_rows, has_checks, plan_checks
+
+
+CSV_INSERT_BATCH_SIZE = 10000  # Rows per savepoint; a failed batch is retried row by row
+REJECT_TABLE = "stats_uploadreject"  # UploadReject
+QUARANTINE_TABLE = "stats_uploadquarantine"  # UploadQuarantine
+SCHEMA_SAMPLE_ROWS = 1000  # Rows inspected to infer column types
+MAX_COVERING_COLUMNS = 4  # Numeric columns carried in each time index
+
+# SQLite's limit on ? parameters per statement (SQLITE_MAX_VARIABLE_NUMBER)
+MAX_SQL_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+MAX_ROWS_PER_INSERT = 500
+
+
+def table_name_from_filename(filename):
+    """
+    Table name for an uploaded file: the file name without extension,
+    reduced to alphanumerics and underscores, lower-cased.
+    """
+    table_name = os.path.splitext(os.path.basename(filename))[0]
+    return "".join(x for x in table_name if x.isalnum() or x == '_').lower()
+
+
+def _insert_statement(table_name, columns, n_rows):
+    row = "(" + ", ".join(["?"] * (len(columns) + 1)) + ")"
+    return (
+        f'INSERT OR IGNORE INTO {quote_identifier(table_name)} '
+        f'({", ".join(columns)}, {quote_identifier(ROW_HASH_COLUMN)}) '
+        f'VALUES {", ".join([row] * n_rows)}'
+    )
+
+
+def _insert_rows(cursor, table_name, columns, rows, hashes):
+    """
+    Inserts rows with their content hashes appended; rows whose hash is
+    already in the table are skipped. Returns the number of rows inserted.
+    """
+    # Multi-row VALUES statements: far fewer statement executions than executemany()
+    per_statement = max(1, min(MAX_ROWS_PER_INSERT, MAX_SQL_VARIABLES // (len(columns) + 1)))
+    inserted = 0
+    for start in range(0, len(rows), per_statement):
+        chunk = rows[start:start + per_statement]
+        # Each row with its hash appended, flattened in C
+        values = itertools.chain.from_iterable(map(tuple.__add__, chunk, zip(hashes[start:start + per_statement])))
+        cursor.execute(_insert_statement(table_name, columns, len(chunk)), list(values))
+        inserted += cursor.rowcount
+    return inserted
+
+
+def _write_batch(cursor, table_name, columns, rows, hashes, numbers, rejects):
+    """
+    Inserts rows under a savepoint. If the database refuses the batch it is
+    retried row by row, refused rows going to rejects. Returns the rows inserted.
+    """
+    cursor.execute("SAVEPOINT batch")
+    try:
+        inserted = _insert_rows(cursor, table_name, columns, rows, hashes)
+        cursor.execute("RELEASE batch")
+        return inserted
+    except (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.DataError):
+        cursor.execute("ROLLBACK TO batch")
+        cursor.execute("RELEASE batch")
+
+    inserted = 0
+    for number, row, row_hash in zip(numbers, rows, hashes):
+        try:
+            inserted += _insert_rows(cursor, table_name, columns, [row], [row_hash])
+        except (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.DataError) as e:
+            rejects.append((number, row, str(e)))
+    return inserted
+
+
+def _create_table(cursor, table_name, names, types):
+    columns_def = ", ".join(
+        [f"{quote_identifier(name)} {sql_type}" for name, sql_type in zip(names, types)]
+        + [f"{quote_identifier(ROW_HASH_COLUMN)} INTEGER"]
+    )
+    # The unique row hash index is built by _finish_load, after the rows (see _dedup_plan)
+    cursor.execute(f"CREATE TABLE {quote_identifier(table_name)} ({columns_def})")
+    # Left over if the table was dropped outside the upload pipeline
+    cursor.execute(f"DELETE FROM {SCHEMA_TABLE} WHERE table_name = ?", [table_name])
+    cursor.execute(f"DELETE FROM {FILE_TABLE} WHERE table_name = ?", [table_name])
+    if _table_exists(cursor, OBSERVATION_TABLE):
+        cursor.execute(f"DELETE FROM {OBSERVATION_TABLE} WHERE source_id = ?", [table_name])
+    cursor.executemany(
+        f"INSERT INTO {SCHEMA_TABLE} (table_name, position, name, sql_type) VALUES (?, ?, ?, ?)",
+        [(table_name, position, name, sql_type) for position, (name, sql_type) in enumerate(zip(names, types))],
+    )
+
+
+def _save_rejects(cursor, table_name, rejects, upload_id=None):
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+    cursor.executemany(
+        f"INSERT INTO {REJECT_TABLE} (table_name, row_number, row, reason, upload_id, created_at) "
+        f"VALUES (?, ?, ?, ?, ?, ?)",
+        [(table_name, number, json.dumps(row), reason, upload_id or "", now) for number, row, reason in rejects],
+    )
+
+
+def ensure_time_indexes(cursor, table_name, schema):
+    """
+    Indexes every DATE and TIMESTAMP column of an uploaded table, covering
+    its first MAX_COVERING_COLUMNS numeric columns.
+    """
+    numeric = [name for name, sql_type in schema.items() if sql_type in ("INTEGER", "REAL")][:MAX_COVERING_COLUMNS]
+    for name, sql_type in schema.items():
+        if sql_type not in ("DATE", "TIMESTAMP"):
+            continue
+        indexed = ", ".join(quote_identifier(column) for column in [name] + numeric)
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'{table_name}_{name}_idx')} "
+            f"ON {quote_identifier(table_name)} ({indexed})"
+        )
+
+
+def _time_key_sql(names, key):
+    # SQL for the epoch seconds of a row, for a validation key (see stats.validation.plan_checks)
+    kind, first, second = key
+    moment = quote_identifier(names[first])
+    if kind == "timestamp":
+        return moment
+    if kind == "datetime":
+        moment = f"{moment} || ' ' || COALESCE({quote_identifier(names[second])}, '00:00:00')"
+    return f"CAST(strftime('%s', {moment}) AS INTEGER)"
+
+
+def _validation_plan(cursor, table_name, names, types):
+    """
+    Checks for the rows of a load (stats.validation.plan_checks), or None.
+    Checking for taken times reads the table's times into checks["taken"].
+    """
+    checks = plan_checks(names, types, _column_metrics(cursor, table_name, names, types))
+    if not has_checks(checks):
+        return None
+    if checks["key"]:
+        key_sql = _time_key_sql(names, checks["key"])
+        # In rowid order, so the first row at a time is the one kept. A NULL
+        # hash marks a copy of an earlier row (_add_row_hashes), never the first
+        times = cursor.execute(
+            f"SELECT {key_sql}, {quote_identifier(ROW_HASH_COLUMN)} FROM {quote_identifier(table_name)} "
+            f"WHERE {key_sql} IS NOT NULL AND {quote_identifier(ROW_HASH_COLUMN)} IS NOT NULL"
+        ).fetchall()
+        checks["taken"] = []
+        if times:
+            keys, hashes = np.array(times, dtype=np.int64).T
+            keys, firsts = np.unique(keys, return_index=True)
+            _add_taken_times(checks["taken"], keys, hashes[firsts])
+    return checks
+
+
+def _add_taken_times(taken, keys, hashes):
+    # Merges new sorted times and their row hashes into taken, runs kept as in _new_rows
+    while taken and len(taken[-1][0]) <= 2 * len(keys):
+        run_keys, run_hashes = taken.pop()
+        keys, hashes = np.concatenate([run_keys, keys]), np.concatenate([run_hashes, hashes])
+        order = np.argsort(keys, kind="stable")
+        keys, hashes = keys[order], hashes[order]
+    taken.append((keys, hashes))
+
+
+def _taken_times(taken, keys, hashes, bad):
+    """
+    Indexes of the rows of a batch whose time is taken by a different row,
+    earlier in the batch or in taken; the other rows' times are added to it.
+    """
+    positions = np.flatnonzero(~np.isnan(keys))
+    positions = positions[~np.isin(positions, list(bad))]
+    if not len(positions):
+        return []
+    batch_keys = keys[positions].astype(np.int64)
+    batch_hashes = np.asarray(hashes, dtype=np.int64)[positions]
+    # Rows differing from the first row of the batch at their time
+    times, firsts, inverse = np.unique(batch_keys, return_index=True, return_inverse=True)
+    first_hashes = batch_hashes[firsts]
+    conflicting = batch_hashes != first_hashes[inverse]
+
+    # Times whose first row differs from the row already at that time
+    seen = np.zeros(len(times), dtype=bool)
+    conflicts = np.zeros(len(times), dtype=bool)
+    for run_keys, run_hashes in taken:
+        found = np.minimum(np.searchsorted(run_keys, times), len(run_keys) - 1)
+        hit = run_keys[found] == times
+        conflicts |= hit & (run_hashes[found] != first_hashes)
+        seen |= hit
+    if not seen.all():
+        _add_taken_times(taken, times[~seen], first_hashes[~seen])
+    conflicting |= conflicts[inverse]
+    return positions[conflicting].tolist()
+
+
+def _quarantine_batch(checks, batch):
+    """
+    Runs the checks of a load over a hashed batch. Returns the batch
+    without the rows failing them, and those as (row_number, row, reason).
+    """
+    rows, hashes, numbers, rejects = batch
+    bad, keys = check_rows(checks, rows)
+    if keys is not None:
+        for row_index in _taken_times(checks["taken"], keys, hashes, bad):
+            bad.setdefault(row_index, "Another row has the same time")
+    if not bad:
+        return batch, []
+    kept = [row_index for row_index in range(len(rows)) if row_index not in bad]
+    quarantined = [(numbers[row_index], rows[row_index], reason) for row_index, reason in sorted(bad.items())]
+    batch = ([rows[i] for i in kept], [hashes[i] for i in kept], [numbers[i] for i in kept], rejects)
+    return batch, quarantined
+
+
+def _save_quarantined(cursor, table_name, quarantined, upload_id=None):
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+    cursor.executemany(
+        f"INSERT INTO {QUARANTINE_TABLE} (table_name, row_number, row, reason, upload_id, created_at) "
+        f"VALUES (?, ?, ?, ?, ?, ?)",
+        [(table_name, number, json.dumps(row), reason, upload_id or "", now) for number, row, reason in quarantined],
+    )
+
+
+def _add_columns(cursor, table_name, schema, names, types):
+    """
+    Adds the columns of names the table lacks; rows already in it read NULL
+    for them. Returns the schema with the columns added.
+    """
+    table = quote_identifier(table_name)
+    # SQLite column names are case-insensitive
+    existing = {row[1].lower() for row in cursor.execute(f"PRAGMA table_info({table})")}
+    added = [(name, sql_type) for name, sql_type in zip(names, types) if name.lower() not in existing]
+    if not added:
+        return schema
+    for name, sql_type in added:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {quote_identifier(name)} {sql_type}")
+    position = cursor.execute(
+        f"SELECT COALESCE(MAX(position) + 1, 0) FROM {SCHEMA_TABLE} WHERE table_name = ?", [table_name]
+    ).fetchone()[0]
+    cursor.executemany(
+        f"INSERT INTO {SCHEMA_TABLE} (table_name, position, name, sql_type) VALUES (?, ?, ?, ?)",
+        [(table_name, position + offset, name, sql_type) for offset, (name, sql_type) in enumerate(added)],
+    )
+    return {**schema, **dict(added)}
+
+
+def _prepare_table(cursor, table_name, names, new_types):
+    """
+    Creates table_name with new_types(), or adds the columns it lacks.
+    Returns (schema, names as spelled in the table, the stored type of each).
+    """
+    schema = load_schema(cursor, table_name)
+    if schema is None:
+        types = new_types()
+        _create_table(cursor, table_name, names, types)
+        return dict(zip(names, types)), names, types
+    _add_row_hashes(cursor, table_name, schema)
+    # Matched regardless of case, as SQLite does, so a column hashes the same whatever the header
+    spelling = {row[1].lower(): row[1] for row in cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)})")}
+    names = [spelling.get(name.lower(), name) for name in names]
+    if any(name not in schema for name in names):
+        schema = _add_columns(cursor, table_name, schema, names, new_types())
+    return schema, names, [schema.get(name, "TEXT") for name in names]
+
+
+def _record_widened(cursor, table_name, schema, names, types):
+    # Records the columns of schema a load widened to REAL (see stats.parsing._convert_widening)
+    widened = [name for name, sql_type in zip(names, types) if sql_type == "REAL" and schema.get(name) == "INTEGER"]
+    if widened:
+        cursor.executemany(
+            f"UPDATE {SCHEMA_TABLE} SET sql_type = 'REAL' WHERE table_name = ? AND name = ?",
+            [(table_name, name) for name in widened],
+        )
+        schema.update(dict.fromkeys(widened, "REAL"))
+
+
+def _load_plan(cursor, table_name, schema, names, types, checkpoint=False, user_id=None, upload_id=None):
+    # Deduplication, checks and observations for a load into table_name
+    return {
+        "loaded": _dedup_plan(cursor, table_name, checkpoint),
+        "checks": _validation_plan(cursor, table_name, names, types),
+        "observations": _observation_plan(cursor, table_name, schema, user_id),
+        "upload_id": upload_id,
+    }
+
+
+def _store_batch(cursor, table_name, columns, batch, result, plan):
+    """
+    Quarantines, deduplicates and writes a hashed batch, with its rejects
+    and observations, counting into result.
+    """
+    quarantined = []
+    if plan["checks"]:
+        batch, quarantined = _quarantine_batch(plan["checks"], batch)
+    rows, hashes, numbers, rejects = batch
+    rejected = len(rejects)
+    duplicates = 0
+    if plan["loaded"] is not None:
+        batch = _new_rows(plan["loaded"], batch)
+        duplicates = len(rows) - len(batch[0])
+        rows, hashes, numbers, rejects = batch
+    observations = plan["observations"]
+    if observations:
+        # Inserted rows get rowids above the current largest
+        last_rowid = cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {quote_identifier(table_name)}").fetchone()[0]
+    inserted = _write_batch(cursor, table_name, columns, rows, hashes, numbers, rejects)
+    if observations and inserted:
+        _write_observations(cursor, observations, last_rowid)
+    result["rows"] += inserted
+    result["duplicates"] += duplicates + len(rows) - inserted - (len(rejects) - rejected)
+    if rejects:
+        _save_rejects(cursor, table_name, rejects, plan["upload_id"])
+        result["rejected"] += len(rejects)
+    if quarantined:
+        _save_quarantined(cursor, table_name, quarantined, plan["upload_id"])
+        result["quarantined"] += len(quarantined)
+
+
+def _load_batches(cursor, table_name, schema, names, types, batches, result, checkpoint=False, user_id=None,
+                  upload_id=None, committed=None):
+    columns = [quote_identifier(name) for name in names]
+    plan = _load_plan(cursor, table_name, schema, names, types, checkpoint, user_id, upload_id)
+    if checkpoint:
+        # The table and its mappings are in before waiting for the first rows
+        cursor.execute("COMMIT")
+        cursor.execute("BEGIN")
+    # types is widened in place as the batches are converted
+    for batch in _hash_batches(batches, names, _hash_types(cursor, table_name, names, types)):
+        _store_batch(cursor, table_name, columns, batch, result, plan)
+        _record_widened(cursor, table_name, schema, names, types)
+        if checkpoint:
+            cursor.execute("COMMIT")
+            if committed is not None:
+                committed.update(result)
+            cursor.execute("BEGIN")
+
+
+def _finish_load(cursor, table_name, schema, sha256, size, result):
+    _row_hash_index(cursor, table_name)
+    ensure_time_indexes(cursor, table_name, schema)
+    _record_file(cursor, table_name, sha256, size, result["rows"])
+
+
+def _csv_batches(rows, names, types):
+    row_number = 1
+    for batch in _batched(rows, CSV_INSERT_BATCH_SIZE):
+        rejects = []
+        numbers = range(row_number, row_number + len(batch))
+        row_number += len(batch)
+        batch, numbers = _check_lengths(batch, numbers, len(names), rejects)
+        batch, numbers = _convert_batch(batch, numbers, names, types, rejects)
+        yield batch, numbers, rejects
+
+
+def ingest_csv(chunks, db_path, table_name, sha256=None, checkpoint=False, user_id=None, upload_id=None,
+               committed=None):
+    """
+    Streams a CSV file (byte chunks, header row first) into table_name, in
+    one transaction. Column types are inferred from the first
+    SCHEMA_SAMPLE_ROWS rows for a new table; rows already in the table, and
+    files already loaded (by sha256), are skipped. Rows that do not fit go
+    to UploadReject, rows failing validation to UploadQuarantine.
+
+    With checkpoint every batch is committed on its own, and committed kept
+    up to date with the counts so far. Numeric values are also written to
+    the observation table as user_id's.
+
+    Raises ValueError for a file without a header row. Returns {"rows",
+    "rejected", "quarantined", "duplicates", "skipped"}.
+    """
+    # A checkpointed load lasts as long as the upload: leave the collector to
+    # the rest of the process meanwhile
+    result = {"rows": 0, "rejected": 0, "quarantined": 0, "duplicates": 0, "skipped": False}
+    with _bulk_load(db_path, pause_gc=not checkpoint) as cursor:
+        if _already_loaded(cursor, table_name, sha256):
+            result["skipped"] = True
+            return result
+
+        digest, source = hashlib.sha256(), {"size": 0}
+        names, rows = _read_csv(_hashed(chunks, digest, source))
+        sample = list(itertools.islice(rows, SCHEMA_SAMPLE_ROWS))
+        schema, names, types = _prepare_table(cursor, table_name, names, lambda: _infer_types(names, sample))
+        _load_batches(cursor, table_name, schema, names, types,
+                      _csv_batches(itertools.chain(sample, rows), names, types), result, checkpoint, user_id, upload_id,
+                      committed)
+        _finish_load(cursor, table_name, schema, digest.hexdigest(), source["size"], result)
+    return result
@@ -0,0 +1,132 @@
+# FILE: stats/json_stream.py
+
+import codecs
+import json
+import re
+
+
+_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR_RE = re.compile(r'[-+0-9.eE]+|true|false|null')
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+# Consumed text is dropped from the buffer once it grows past this size
+_COMPACT_AT = 1 << 16
+
+
+class _JsonReader:
+    """
+    Pull parser over an iterable of byte chunks. Holds only the text of the
+    value currently being read, not the whole document.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Appends the next chunk to the buffer. Returns False at end of input.
+        """
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += self.decoder.decode(chunk)
+                return True
+        self.buffer += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Reads and decodes one complete JSON value starting at the next token.
+        """
+        first = self.peek()
+        if self.pos > _COMPACT_AT:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        start = self.pos
+        if first in "{[":
+            return self._read_container(start)
+        if first == '"':
+            match = _STRING_RE.match(self.buffer, start)
+            while match is None:
+                if not self.fill():
+                    raise ValueError("Unterminated JSON string")
+                match = _STRING_RE.match(self.buffer, start)
+            end = match.end()
+        else:
+            match = _SCALAR_RE.match(self.buffer, start)
+            # A scalar is only complete once the character after it has arrived
+            while (match is None or match.end() == len(self.buffer)) and self.fill():
+                match = _SCALAR_RE.match(self.buffer, start)
+            if match is None:
+                raise ValueError(f"Invalid JSON value at offset {start}")
+            end = match.end()
+        self.pos = end
+        return json.loads(self.buffer[start:end])
+
+    def _read_container(self, start):
+        # The C decoder does the work. A value that is not fully buffered yet
+        # fails to decode; the buffered part is then at least doubled before
+        # retrying, so a large value costs a bounded number of attempts.
+        while True:
+            try:
+                value, self.pos = _decoder.raw_decode(self.buffer, start)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            target = 2 * (len(self.buffer) - start)
+            while len(self.buffer) - start < target and self.fill():
+                pass
+
+
+def iter_json_array(chunks, key, rest=None):
+    """
+    Yields the elements of the array stored under `key` in a top-level JSON
+    object, decoding them one at a time from an iterable of byte chunks
+    (e.g. response.iter_content()). Other top-level members are decoded
+    normally and, if `rest` is a dict, stored in it.
+    """
+    reader = _JsonReader(chunks)
+    reader.expect("{")
+    while reader.peek() != "}":
+        if reader.peek() == ",":
+            reader.pos += 1
+            continue
+        name = reader.read_value()
+        reader.expect(":")
+        if name != key:
+            value = reader.read_value()
+            if rest is not None:
+                rest[name] = value
+            continue
+        reader.expect("[")
+        while reader.peek() != "]":
+            if reader.peek() == ",":
+                reader.pos += 1
+                continue
+            yield reader.read_value()
+        reader.pos += 1
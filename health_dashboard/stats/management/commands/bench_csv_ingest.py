@@ -0,0 +1,207 @@
+import csv
+import datetime
+import glob
+import itertools
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from stats.dedup import _hash_batches, file_sha256
+from stats.ingest import (
+    SCHEMA_SAMPLE_ROWS, _create_table, _csv_batches, _insert_rows, ingest_csv, table_name_from_filename,
+)
+from stats.observations import MAPPING_TABLE
+from stats.parsing import _infer_types, _read_csv
+from stats.readers import ingest_arrow
+from stats.upload_db import _bulk_load, quote_identifier
+
+
+DEFAULT_SOURCE_DIR = os.path.join(os.path.dirname(settings.BASE_DIR), "Generated Dummy Data")
+BENCH_COLUMN = "Bench_Row"
+INSERT_TARGET = 500000  # Rows/s the row insert stage of an upload is to reach
+
+
+def read_chunks(path, chunk_size):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def create_database(path):
+    """
+    Creates a SQLite database at path with the project's tables, by running
+    the migrations on it.
+    """
+    alias = "bench"
+    connections.settings[alias] = {
+        **connections.settings["default"], "ENGINE": "django.db.backends.sqlite3", "NAME": path,
+    }
+    try:
+        call_command("migrate", database=alias, verbosity=0)
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def time_insert_stage(path, db_path, table_name, chunk_size):
+    """
+    Times the row insert stage of ingest_csv (_insert_rows) for the CSV file
+    at path, into a new table table_name, as for a first upload. Rows are
+    parsed, converted and hashed batch by batch outside the timing, and no
+    deduplication, validation or observation work is done.
+    Returns (rows inserted, seconds).
+    """
+    names, rows = _read_csv(read_chunks(path, chunk_size))
+    sample = list(itertools.islice(rows, SCHEMA_SAMPLE_ROWS))
+    types = _infer_types(names, sample)
+    inserted, elapsed = 0, 0.0
+    with _bulk_load(db_path) as cursor:
+        _create_table(cursor, table_name, names, types)
+        columns = [quote_identifier(name) for name in names]
+        batches = _csv_batches(itertools.chain(sample, rows), names, types)
+        for batch, hashes, _, _ in _hash_batches(batches, names, types):
+            started = time.perf_counter()
+            inserted += _insert_rows(cursor, table_name, columns, batch, hashes)
+            elapsed += time.perf_counter() - started
+        cursor.execute(f"DROP TABLE {quote_identifier(table_name)}")
+    return inserted, elapsed
+
+
+def write_bench_file(sample, path, n_rows):
+    """
+    Writes n_rows rows to path: the sample CSV's rows repeated, each with a
+    time of its own so the upload validation does not quarantine them as
+    taken (stats.validation). Going back from yesterday, a row every minute
+    if the sample has a Time or Datetime column, else a row a day; spaced
+    closer if needed to stay after 1900. A BENCH_COLUMN number keeps rows
+    of tables without times distinct.
+    """
+    with open(sample, newline="") as f:
+        header, *rows = [row for row in csv.reader(f) if row]
+    columns = {name.lower(): index for index, name in enumerate(header)}
+    step = 60 if "time" in columns or "datetime" in columns else 86400
+    end = np.datetime64(datetime.date.today() - datetime.timedelta(days=1)) + np.timedelta64(86399, "s")
+    span = int((end - np.datetime64("1900-01-02T00:00:00")) / np.timedelta64(1, "s"))
+    step = max(1, min(step, span // max(n_rows, 1)))
+    moments = np.datetime_as_string(end - np.arange(n_rows, dtype=np.int64) * np.timedelta64(step, "s"), unit="s")
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header + [BENCH_COLUMN])
+        for number, (row, moment) in enumerate(zip(itertools.cycle(rows), moments.tolist())):
+            row = list(row)
+            if "date" in columns:
+                row[columns["date"]] = moment[:10]
+            if "time" in columns:
+                row[columns["time"]] = moment[11:]
+            if "datetime" in columns:
+                row[columns["datetime"]] = moment.replace("T", " ")
+            row.append(number)
+            writer.writerow(row)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark CSV upload ingestion: each sample CSV's rows are repeated up to --rows "
+        "(numbered and given times of their own, see write_bench_file) and loaded into a scratch "
+        "database, reporting rows/s with the rows inserted and quarantined. "
+        "The file is then loaded again to time duplicate skipping, and once more by file hash. "
+        f"The row insert stage is timed on its own too, against a target of {INSERT_TARGET:,} rows/s."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000000, help="Data rows per generated file.")
+        parser.add_argument("--source-dir", default=DEFAULT_SOURCE_DIR, help="Directory of sample CSV files.")
+        parser.add_argument("--chunk-size", type=int, default=64 * 1024,
+                            help="Bytes per chunk, as UploadedFile.chunks() would yield them.")
+        parser.add_argument("--memory", action="store_true",
+                            help="Also report peak Python memory (tracemalloc slows the load down).")
+        parser.add_argument("--parquet", action="store_true",
+                            help="Also load each generated file converted to Parquet (needs pyarrow).")
+
+    def handle(self, *args, **options):
+        samples = sorted(glob.glob(os.path.join(options["source_dir"], "*.csv")))
+        if not samples:
+            raise CommandError(f"No CSV files found in {options['source_dir']}")
+
+        with tempfile.TemporaryDirectory() as scratch:
+            db_path = os.path.join(scratch, "bench.sqlite3")
+            create_database(db_path)
+
+            for sample in samples:
+                path = os.path.join(scratch, os.path.basename(sample))
+                write_bench_file(sample, path, options["rows"])
+                table_name = table_name_from_filename(path)
+                with sqlite3.connect(db_path) as conn:
+                    # The row number is not a measurement: map it to no metric, so it
+                    # writes no observations
+                    conn.executemany(
+                        f'INSERT INTO {MAPPING_TABLE} (table_name, "column", metric_id, user_id) '
+                        f"VALUES (?, ?, NULL, 'anonymous_user')",
+                        [(table_name, BENCH_COLUMN), (f"{table_name}_parquet", BENCH_COLUMN)],
+                    )
+
+                if options["memory"]:
+                    tracemalloc.start()
+                started = time.perf_counter()
+                result = ingest_csv(read_chunks(path, options["chunk_size"]), db_path, table_name)
+                elapsed = time.perf_counter() - started
+                line = (
+                    f"{os.path.basename(sample):>20}: {options['rows']} rows "
+                    f"({os.path.getsize(path) / 1e6:.1f} MB) in {elapsed:.2f}s, "
+                    f"{options['rows'] / elapsed:,.0f} rows/s: {result['rows']} inserted, "
+                    f"{result['quarantined']} quarantined, {result['rejected']} rejected"
+                )
+                if options["memory"]:
+                    line += f", peak {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB"
+                    tracemalloc.stop()
+                self.stdout.write(line)
+
+                started = time.perf_counter()
+                result = ingest_csv(read_chunks(path, options["chunk_size"]), db_path, table_name)
+                elapsed = time.perf_counter() - started
+                started = time.perf_counter()
+                sha256 = file_sha256(read_chunks(path, options["chunk_size"]))
+                skipped = ingest_csv(read_chunks(path, options["chunk_size"]), db_path, table_name, sha256=sha256)
+                self.stdout.write(
+                    f"{'':>20}  reload: {result['duplicates']} duplicates skipped in {elapsed:.2f}s; "
+                    f"by file hash: {'skipped' if skipped['skipped'] else 'loaded'} in "
+                    f"{time.perf_counter() - started:.2f}s"
+                )
+
+                inserted, elapsed = time_insert_stage(path, db_path, f"{table_name}_insert", options["chunk_size"])
+                rate = inserted / elapsed
+                self.stdout.write(
+                    f"{'':>20}  insert stage: {inserted} rows in {elapsed:.2f}s, {rate:,.0f} rows/s "
+                    f"(target {INSERT_TARGET:,}: {'met' if rate >= INSERT_TARGET else 'missed'})"
+                )
+
+                if options["parquet"]:
+                    try:
+                        import pyarrow.csv
+                        import pyarrow.parquet
+                    except ImportError:
+                        raise CommandError("--parquet needs pyarrow (pip install -r requirements-optional.txt).")
+
+                    parquet_path = os.path.splitext(path)[0] + ".parquet"
+                    pyarrow.parquet.write_table(pyarrow.csv.read_csv(path), parquet_path)
+                    started = time.perf_counter()
+                    with open(parquet_path, "rb") as f:
+                        result = ingest_arrow(f, db_path, f"{table_name}_parquet", "parquet")
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{'':>20}  parquet ({os.path.getsize(parquet_path) / 1e6:.1f} MB): in {elapsed:.2f}s, "
+                        f"{options['rows'] / elapsed:,.0f} rows/s: {result['rows']} inserted, "
+                        f"{result['quarantined']} quarantined, {result['rejected']} rejected"
+                    )
+                    os.remove(parquet_path)
+                os.remove(path)
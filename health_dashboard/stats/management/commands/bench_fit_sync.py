@@ -0,0 +1,82 @@
+import multiprocessing
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from stats import http_client
+from stats.fit_standin import serve_standin
+from stats.fit_metrics import FIT_METRICS
+from stats.fit_sync import fetch_all_fit_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark Google Fit sync against the local stand-in: sequential vs concurrent "
+        "wall-clock time, row throughput and peak Python memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--latencies", default="0.2,0.4,0.3,0.5",
+            help="Comma-separated stand-in latencies (seconds) for steps, HR, calories and sleep.",
+        )
+        parser.add_argument("--days", type=int, default=15, help="Days of history per sync.")
+        parser.add_argument("--points-per-bucket", type=int, default=24)
+        parser.add_argument("--raw", action="store_true", help="Benchmark the raw datapoint mode.")
+        parser.add_argument("--stream", action="store_true", help="Benchmark the streaming parse mode.")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        latencies = [float(x) for x in options["latencies"].split(",")]
+        config = {
+            "points_per_bucket": options["points_per_bucket"],
+            "latencies": {
+                metric.data_type: latency
+                for metric, latency in zip(FIT_METRICS, latencies)
+            },
+        }
+        # The stand-in runs in a child process, so its own allocations stay out of the
+        # measurements. Forked where the platform allows; spawned elsewhere (Windows),
+        # where the child imports stats.fit_standin afresh (it needs no Django setup)
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(start_method)
+        conn, child_conn = context.Pipe()
+        standin = context.Process(target=serve_standin, args=(child_conn, config), daemon=True)
+        standin.start()
+        api_url = conn.recv()
+        credentials = SimpleNamespace(token="bench-token")
+
+        def run(workers):
+            # Roll back each run so the benchmark leaves the database untouched
+            with transaction.atomic():
+                started = time.perf_counter()
+                rows = fetch_all_fit_data(credentials, "bench_user", max_workers=workers,
+                                          raw=options["raw"], stream=options["stream"])
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+            return elapsed, rows
+
+        self.stdout.write(f"Sum of fetch latencies: {sum(latencies):.3f}s, slowest: {max(latencies):.3f}s")
+        try:
+            with override_settings(GOOGLE_FIT_API_URL=api_url, GOOGLE_FIT_SYNC_LOOKBACK_DAYS=options["days"]):
+                for label, workers in (("sequential", 1), ("concurrent", len(FIT_METRICS))):
+                    timings = [run(workers) for _ in range(options["repeat"])]
+                    elapsed, rows = min(timings)
+                    self.stdout.write(
+                        f"{label:>10}: best {elapsed:.3f}s over {len(timings)} runs, "
+                        f"{rows} daily rows ({rows / elapsed:.0f} rows/s)"
+                    )
+
+                tracemalloc.start()
+                run(len(FIT_METRICS))
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(f"Peak Python memory during one concurrent sync: {peak / 1e6:.1f} MB")
+            self.stdout.write(f"HTTP client: {http_client.get_stats()}")
+        finally:
+            standin.terminate()
+            standin.join()
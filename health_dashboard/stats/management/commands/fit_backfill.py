@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from google.oauth2.credentials import Credentials
+
+from stats.fit_credentials import get_credentials
+from stats.fit_sync import backfill_fit_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill Google Fit history in windows. Finished windows are checkpointed, "
+        "so re-running the same command resumes an interrupted backfill."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", required=True, help="User id the rows are stored under.")
+        parser.add_argument("--start", required=True, help="First day to fetch (YYYY-MM-DD).")
+        parser.add_argument("--end", help="Day to stop before (YYYY-MM-DD). Defaults to today.")
+        parser.add_argument("--token", help="Google OAuth access token. Defaults to the user's stored credentials.")
+        parser.add_argument("--window-days", type=int, help="Days per dataset:aggregate request.")
+        parser.add_argument("--max-workers", type=int, help="Maximum windows fetched in parallel.")
+
+    def handle(self, *args, **options):
+        def report(done, total):
+            self.stdout.write(f"Windows completed: {done}/{total}")
+
+        try:
+            if options["token"]:
+                credentials = Credentials(token=options["token"])
+            else:
+                credentials = get_credentials(options["user_id"])
+            rows = backfill_fit_data(
+                credentials,
+                options["user_id"],
+                options["start"],
+                end_date=options["end"],
+                window_days=options["window_days"],
+                max_workers=options["max_workers"],
+                progress=report,
+            )
+        except Exception as e:
+            raise CommandError(f"Backfill stopped (re-run to resume): {e}")
+        self.stdout.write(self.style.SUCCESS(f"Backfill finished: {rows} daily rows fetched."))
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stats.sync_scheduler import run_sync_round
+
+
+DEFAULT_SCHEDULER_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Periodically sync Google Fit for every user with stored credentials, "
+        "round-robin across users with a global concurrency cap."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float,
+                            help="Seconds between the starts of two rounds (GOOGLE_FIT_SCHEDULER_INTERVAL).")
+        parser.add_argument("--once", action="store_true", help="Run a single round and exit.")
+        parser.add_argument("--max-concurrency", type=int, help="Maximum syncs in flight across all users.")
+        parser.add_argument("--window-days", type=int, help="Days per slice when a user is catching up.")
+        parser.add_argument("--users", help="Comma-separated user ids. Defaults to all connected users.")
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        if interval is None:
+            interval = getattr(settings, "GOOGLE_FIT_SCHEDULER_INTERVAL", DEFAULT_SCHEDULER_INTERVAL)
+        user_ids = options["users"].split(",") if options["users"] else None
+
+        while True:
+            round_started = time.monotonic()
+            stats = run_sync_round(
+                user_ids,
+                max_concurrency=options["max_concurrency"],
+                window_days=options["window_days"],
+                log=lambda message: self.stderr.write(message),
+            )
+            minutes = max(stats["seconds"], 1e-9) / 60
+            self.stdout.write(
+                f"Synced {stats['users'] - stats['failed']}/{stats['users']} users "
+                f"({stats['slices']} slices, {stats['rows']} daily rows) in {stats['seconds']:.1f}s: "
+                f"{(stats['users'] - stats['failed']) / minutes:.1f} users/min, {stats['rows'] / minutes:.0f} rows/min"
+            )
+            if options["once"]:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - round_started)))
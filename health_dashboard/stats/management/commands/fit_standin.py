@@ -0,0 +1,46 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from stats.fit_standin import start_standin
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local Google Fit stand-in server. Point the sync at it with "
+        "GOOGLE_FIT_API_URL=http://<host>:<port>/fitness/v1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--points-per-bucket", type=int, default=24,
+                            help="Synthetic points generated per day and metric.")
+        parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every response.")
+        parser.add_argument("--jitter-ms", type=float, default=0.0, help="Extra random latency per response.")
+        parser.add_argument("--failure-rate", type=float, default=0.0,
+                            help="Fraction of requests answered with --failure-status.")
+        parser.add_argument("--failure-status", type=int, default=503)
+        parser.add_argument("--replay", action="store_true",
+                            help="Serve the recorded days in stats/fit_fixtures instead of synthetic points.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        server, base_url = start_standin(
+            host=options["host"],
+            port=options["port"],
+            points_per_bucket=options["points_per_bucket"],
+            latency=options["latency_ms"] / 1000,
+            jitter=options["jitter_ms"] / 1000,
+            failure_rate=options["failure_rate"],
+            failure_status=options["failure_status"],
+            replay=options["replay"],
+            seed=options["seed"],
+        )
+        self.stdout.write(f"Google Fit stand-in listening on {base_url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
@@ -0,0 +1,46 @@
+import csv
+import os
+import sqlite3
+import time
+import zipfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.bulk_import import import_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Import every CSV, Parquet and Arrow file in a directory or zip archive, each into the "
+        "table named after the file as the upload form would, parsing files in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Directory (searched recursively) or zip archive.")
+        parser.add_argument("--processes", type=int, help="Parser processes. Defaults to the number of CPUs.")
+        parser.add_argument("--user", help="User the imported observations belong to. Defaults to the "
+                                           "owner of each table's metric mappings, else anonymous_user.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.isdir(path) and not zipfile.is_zipfile(path):
+            raise CommandError(f"{path} is not a directory or a zip archive.")
+
+        started = time.perf_counter()
+        try:
+            results = import_files(
+                path, settings.DATABASES["default"]["NAME"], processes=options["processes"], log=self.stdout.write,
+                user_id=options["user"],
+            )
+        except (ValueError, csv.Error, sqlite3.Error) as e:
+            raise CommandError(f"Import failed, nothing was imported: {e}")
+        if not results:
+            raise CommandError(f"No CSV, Parquet or Arrow files found in {path}.")
+
+        elapsed = time.perf_counter() - started
+        rows = sum(result["rows"] for result in results)
+        loaded = sum(1 for result in results if not result["skipped"] and not result["error"])
+        self.stdout.write(
+            f"Imported {loaded}/{len(results)} files, {rows} rows in {elapsed:.2f}s: {rows / elapsed:,.0f} rows/s"
+        )
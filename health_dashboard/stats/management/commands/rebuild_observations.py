@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stats.observations import rebuild_observations
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the observation store from the uploaded tables and their metric mappings: "
+        "for tables uploaded before it existed, or after a mapping was changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("tables", nargs="*", help="Uploaded tables to rebuild. Defaults to all of them.")
+
+    def handle(self, *args, **options):
+        counts = rebuild_observations(settings.DATABASES["default"]["NAME"], options["tables"] or None)
+        for table_name, count in counts.items():
+            self.stdout.write(f"{table_name}: {count} observations")
+        self.stdout.write(f"Rebuilt {len(counts)} tables, {sum(counts.values())} observations")
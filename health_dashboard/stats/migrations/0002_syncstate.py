@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255)),
+                ('metric', models.CharField(max_length=100)),
+                ('synced_until', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('user_id', 'metric')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0002_syncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255)),
+                ('metric', models.CharField(max_length=100)),
+                ('window_start', models.BigIntegerField()),
+                ('window_end', models.BigIntegerField()),
+                ('rows', models.IntegerField(default=0)),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('user_id', 'metric', 'window_start', 'window_end')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0004_syncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitDataPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255)),
+                ('data_type', models.CharField(max_length=100)),
+                ('start_ms', models.BigIntegerField()),
+                ('end_ms', models.BigIntegerField()),
+                ('value', models.FloatField()),
+                ('source_id', models.CharField(max_length=255)),
+            ],
+            options={
+                'unique_together': {('user_id', 'data_type', 'start_ms', 'source_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0005_fitdatapoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitCredential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255, unique=True)),
+                ('token', models.TextField(blank=True)),
+                ('refresh_token', models.TextField()),
+                ('token_uri', models.CharField(max_length=255)),
+                ('client_id', models.CharField(max_length=255)),
+                ('client_secret', models.CharField(max_length=255)),
+                ('scopes', models.TextField(blank=True)),
+                ('expiry', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0006_fitcredential'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadReject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=255)),
+                ('row_number', models.IntegerField()),
+                ('row', models.TextField()),
+                ('reason', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0007_uploadreject'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadColumn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=255)),
+                ('position', models.IntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('sql_type', models.CharField(choices=[('INTEGER', 'Integer'), ('REAL', 'Real'), ('DATE', 'Date (YYYY-MM-DD text)'), ('TIME', 'Time (HH:MM:SS text)'), ('TIMESTAMP', 'Timestamp (epoch seconds, UTC)'), ('TEXT', 'Text')], max_length=10)),
+            ],
+            options={
+                'unique_together': {('table_name', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0009_uploadfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.CharField(max_length=32, unique=True)),
+                ('user_id', models.CharField(max_length=255)),
+                ('filename', models.CharField(max_length=255)),
+                ('table_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('status', models.CharField(choices=[('receiving', 'Receiving'), ('loading', 'Loading'), ('done', 'Done'), ('failed', 'Failed')], default='receiving', max_length=10)),
+                ('rows', models.IntegerField(default=0)),
+                ('rejected', models.IntegerField(default=0)),
+                ('duplicates', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
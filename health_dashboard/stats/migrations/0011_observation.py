@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0010_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Metric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('unit', models.CharField(blank=True, max_length=50)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MetricMapping',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=255)),
+                ('column', models.CharField(max_length=255)),
+                ('user_id', models.CharField(default='anonymous_user', max_length=255)),
+                ('metric', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='stats.metric')),
+            ],
+            options={
+                'unique_together': {('table_name', 'column')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Observation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255)),
+                ('ts', models.BigIntegerField()),
+                ('value', models.FloatField()),
+                ('source_id', models.CharField(max_length=255)),
+                ('metric', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='stats.metric')),
+            ],
+            options={
+                'db_table': 'observation',
+                'indexes': [models.Index(fields=['metric', 'ts'], name='observation_metric_ts_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0011_observation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadQuarantine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=255)),
+                ('row_number', models.IntegerField()),
+                ('row', models.TextField()),
+                ('reason', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='quarantined',
+            field=models.IntegerField(default=0),
+        ),
+    ]
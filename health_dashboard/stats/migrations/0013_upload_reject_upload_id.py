@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0012_uploadquarantine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadquarantine',
+            name='upload_id',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='uploadreject',
+            name='upload_id',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:47
+
+from django.db import migrations, models
+
+
+def encrypt_secrets(apps, schema_editor):
+    from stats.fit_credentials import encrypt_secret
+
+    FitCredential = apps.get_model('stats', 'FitCredential')
+    for credential in FitCredential.objects.using(schema_editor.connection.alias):
+        credential.refresh_token = encrypt_secret(credential.refresh_token)
+        credential.client_secret = encrypt_secret(credential.client_secret)
+        credential.save(update_fields=['refresh_token', 'client_secret'], using=schema_editor.connection.alias)
+
+
+def decrypt_secrets(apps, schema_editor):
+    from stats.fit_credentials import decrypt_secret
+
+    FitCredential = apps.get_model('stats', 'FitCredential')
+    for credential in FitCredential.objects.using(schema_editor.connection.alias):
+        credential.refresh_token = decrypt_secret(credential.refresh_token)
+        credential.client_secret = decrypt_secret(credential.client_secret)
+        credential.save(update_fields=['refresh_token', 'client_secret'], using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0013_upload_reject_upload_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fitcredential',
+            name='client_secret',
+            field=models.TextField(),
+        ),
+        migrations.RunPython(encrypt_secrets, decrypt_secrets),
+    ]
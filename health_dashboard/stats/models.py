@@ -71,3 +71,265 @@ class UserSleep(models.Model):
 
     def __str__(self):
         return f"{self.user_id} - {self.date}: {self.sleep_minutes} min slept"
+
+
+class SyncState(models.Model):
+    """
+    Per-user, per-metric Google Fit watermark: everything before
+    synced_until (epoch millis) has already been fetched and stored.
+    """
+    user_id = models.CharField(max_length=255)
+    metric = models.CharField(max_length=100)  # Google Fit dataTypeName
+    synced_until = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('user_id', 'metric')
+
+    def __str__(self):
+        return f"{self.user_id} - {self.metric}: synced until {self.synced_until}"
+
+
+class BackfillWindow(models.Model):
+    """
+    Checkpoint for one finished Google Fit backfill window
+    [window_start, window_end) in epoch millis, so an interrupted
+    backfill can resume without re-fetching completed windows.
+    """
+    user_id = models.CharField(max_length=255)
+    metric = models.CharField(max_length=100)  # Google Fit dataTypeName
+    window_start = models.BigIntegerField()
+    window_end = models.BigIntegerField()
+    rows = models.IntegerField(default=0)  # Daily rows fetched for the window
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user_id', 'metric', 'window_start', 'window_end')
+
+    def __str__(self):
+        return f"{self.user_id} - {self.metric}: {self.window_start}-{self.window_end} ({self.rows} rows)"
+
+
+class SyncJob(models.Model):
+    """
+    A queued Google Fit sync, run by the background worker in stats.sync_worker.
+    Progress is stored here so the dashboard can poll it.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    user_id = models.CharField(max_length=255)
+    backfill_start = models.CharField(max_length=10, blank=True)  # YYYY-MM-DD, empty for no backfill
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(max_length=20, blank=True)  # 'backfill' or 'sync' while running
+    progress_done = models.IntegerField(default=0)
+    progress_total = models.IntegerField(default=0)
+    rows = models.IntegerField(default=0)  # Daily rows fetched so far
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - sync #{self.pk}: {self.status}"
+
+
+class FitDataPoint(models.Model):
+    """
+    Raw (intraday) Google Fit data points, appended by the optional raw sync
+    mode. Times are epoch millis; daily User* rows are rolled up from here.
+    """
+    user_id = models.CharField(max_length=255)
+    data_type = models.CharField(max_length=100)  # Google Fit dataTypeName
+    start_ms = models.BigIntegerField()
+    end_ms = models.BigIntegerField()
+    value = models.FloatField()
+    source_id = models.CharField(max_length=255)  # originDataSourceId of the point
+
+    class Meta:
+        unique_together = ('user_id', 'data_type', 'start_ms', 'source_id')
+
+    def __str__(self):
+        return f"{self.user_id} - {self.data_type} @ {self.start_ms}: {self.value}"
+
+
+class FitCredential(models.Model):
+    """
+    Stored Google OAuth credentials per user, so syncs can run without the
+    interactive OAuth flow. Managed by stats.fit_credentials, which refreshes
+    the access token ahead of its expiry and encrypts the refresh token and
+    client secret.
+    """
+    user_id = models.CharField(max_length=255, unique=True)
+    token = models.TextField(blank=True)  # Current access token
+    refresh_token = models.TextField()  # Encrypted (fit_credentials.encrypt_secret)
+    token_uri = models.CharField(max_length=255)
+    client_id = models.CharField(max_length=255)
+    client_secret = models.TextField()  # Encrypted (fit_credentials.encrypt_secret)
+    scopes = models.TextField(blank=True)  # Space-separated
+    expiry = models.DateTimeField(null=True, blank=True)  # When `token` expires
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - token expires {self.expiry}"
+
+
+class UploadReject(models.Model):
+    """
+    Rows of an uploaded file that could not be inserted into its table,
+    with the reason. Written by stats.ingest in the upload's transaction.
+    """
+    table_name = models.CharField(max_length=255)
+    row_number = models.IntegerField()  # 1-based position among the file's data rows
+    row = models.TextField()  # The row's fields as a JSON list
+    reason = models.TextField()
+    upload_id = models.CharField(max_length=32, blank=True, default='')  # ChunkedUpload.upload_id, if from one
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.table_name} row {self.row_number}: {self.reason}"
+
+
+class UploadQuarantine(models.Model):
+    """
+    Rows of an uploaded file that parsed but failed validation
+    (stats.validation): implausible values, bad dates, inconsistent sleep
+    times, or a time already taken by another row. Kept out of the table.
+    """
+    table_name = models.CharField(max_length=255)
+    row_number = models.IntegerField()  # 1-based position among the file's data rows
+    row = models.TextField()  # The row's values as a JSON list
+    reason = models.TextField()
+    upload_id = models.CharField(max_length=32, blank=True, default='')  # ChunkedUpload.upload_id, if from one
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.table_name} row {self.row_number}: {self.reason}"
+
+
+class UploadColumn(models.Model):
+    """
+    Schema of an uploaded table as inferred by stats.ingest: one row per
+    column with its type. Readers use it to load values without coercion.
+    """
+    TYPE_CHOICES = [
+        ('INTEGER', 'Integer'),
+        ('REAL', 'Real'),
+        ('DATE', 'Date (YYYY-MM-DD text)'),
+        ('TIME', 'Time (HH:MM:SS text)'),
+        ('TIMESTAMP', 'Timestamp (epoch seconds, UTC)'),
+        ('TEXT', 'Text'),
+    ]
+
+    table_name = models.CharField(max_length=255)
+    position = models.IntegerField()  # 0-based column order
+    name = models.CharField(max_length=255)
+    sql_type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+
+    class Meta:
+        unique_together = ('table_name', 'name')
+
+    def __str__(self):
+        return f"{self.table_name}.{self.name}: {self.sql_type}"
+
+
+class UploadFile(models.Model):
+    """
+    Files loaded into an uploaded table, by SHA-256 of their content.
+    stats.ingest skips a file already recorded for the table.
+    """
+    table_name = models.CharField(max_length=255)
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()  # Bytes
+    rows = models.IntegerField()  # Rows inserted by this file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('table_name', 'sha256')
+
+    def __str__(self):
+        return f"{self.table_name}: {self.sha256[:12]} ({self.rows} rows)"
+
+
+class ChunkedUpload(models.Model):
+    """
+    A file uploaded in chunks through stats.chunked_upload. The chunks are
+    appended to a part file on disk, whose size is the number of bytes
+    received; the outcome of loading it is stored here when it finishes.
+    """
+    STATUS_CHOICES = [
+        ('receiving', 'Receiving'),
+        ('loading', 'Loading'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    upload_id = models.CharField(max_length=32, unique=True)
+    user_id = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    table_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # Bytes announced by the client
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='receiving')
+    rows = models.IntegerField(default=0)
+    rejected = models.IntegerField(default=0)
+    quarantined = models.IntegerField(default=0)
+    duplicates = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} -> {self.table_name}: {self.status}"
+
+
+class Metric(models.Model):
+    """
+    A kind of measurement (heart_rate, step_counts, ...) in the Observation store.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    unit = models.CharField(max_length=50, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.unit})" if self.unit else self.name
+
+
+class MetricMapping(models.Model):
+    """
+    Which metric a numeric column of an uploaded table is stored as in the
+    Observation store, set once per table (on upload, or here). stats.observations
+    maps columns without a row to a metric named after the column; a row
+    without a metric leaves the column out.
+    """
+    table_name = models.CharField(max_length=255)
+    column = models.CharField(max_length=255)
+    metric = models.ForeignKey(Metric, null=True, blank=True, on_delete=models.CASCADE)
+    user_id = models.CharField(max_length=255, default='anonymous_user')  # Owner of the observations
+
+    class Meta:
+        unique_together = ('table_name', 'column')
+
+    def __str__(self):
+        return f"{self.table_name}.{self.column} -> {self.metric or '(not stored)'}"
+
+
+class Observation(models.Model):
+    """
+    Every numeric value of the uploaded tables in one long table (named
+    'observation'), written by stats.observations alongside the table's own rows:
+    one metric at one time, so any metric over any range is one indexed query.
+    """
+    user_id = models.CharField(max_length=255)
+    # Indexed by (metric, ts)
+    metric = models.ForeignKey(Metric, on_delete=models.CASCADE, db_index=False)
+    ts = models.BigIntegerField()  # Epoch seconds, UTC
+    value = models.FloatField()
+    source_id = models.CharField(max_length=255)  # Uploaded table the value was read from
+
+    class Meta:
+        db_table = 'observation'
+        indexes = [models.Index(fields=['metric', 'ts'], name='observation_metric_ts_idx')]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.metric_id} @ {self.ts}: {self.value}"
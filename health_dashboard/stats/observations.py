@@ -0,0 +1,145 @@
+# FILE: stats/observations.py
+
+import re
+import sqlite3
+
+from .upload_db import SCHEMA_TABLE, _bulk_load, _table_exists, load_schema, quote_identifier
+
+
+OBSERVATION_TABLE = "observation"  # Observation
+METRIC_TABLE = "stats_metric"  # Metric
+MAPPING_TABLE = "stats_metricmapping"  # MetricMapping
+DEFAULT_OBSERVATION_USER = "anonymous_user"
+
+# Forces a CTE to be computed once (SQLite 3.35+); older versions decide for themselves
+MATERIALIZED = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+
+
+def metric_name(column):
+    # Default metric for a column: its name in lower case, e.g. "Heart_Rate" -> "heart_rate"
+    return re.sub(r"[^0-9a-z]+", "_", column.lower()).strip("_")
+
+
+def _observation_time(schema):
+    """
+    SQL for the epoch seconds of a row: its first TIMESTAMP column, else its
+    first DATE column (at the time in a "Time" column, if any). None if neither.
+    """
+    for name, sql_type in schema.items():
+        if sql_type == "TIMESTAMP":
+            return quote_identifier(name)
+    dates = [name for name, sql_type in schema.items() if sql_type == "DATE"]
+    if not dates:
+        return None
+    moment = quote_identifier(dates[0])
+    times = [name for name, sql_type in schema.items() if sql_type == "TIME" and name.lower() == "time"]
+    if times:
+        moment = f"{moment} || ' ' || COALESCE({quote_identifier(times[0])}, '00:00:00')"
+    return f"CAST(strftime('%s', {moment}) AS INTEGER)"
+
+
+def _observation_plan(cursor, table_name, schema, user_id=None):
+    """
+    (statement, parameters) copying the numeric values of table_name's rows
+    after a rowid (the last parameter) into the observation table.
+
+    Columns are mapped to metrics through MetricMapping; unmapped numeric
+    columns get a mapping to the metric named after them. The observations
+    belong to user_id, else to the user of each column's mapping. None if
+    the table has no time or no mapped columns.
+    """
+    if not _table_exists(cursor, OBSERVATION_TABLE):
+        return None
+    moment = _observation_time(schema)
+    if moment is None:
+        return None
+
+    mappings = {
+        column: (metric_id, user_id) for column, metric_id, user_id in cursor.execute(
+            f'SELECT "column", metric_id, user_id FROM {MAPPING_TABLE} WHERE table_name = ?', [table_name]
+        )
+    }
+    owner = user_id or next((owner for _, owner in mappings.values()), DEFAULT_OBSERVATION_USER)
+    for column, sql_type in schema.items():
+        if sql_type not in ("INTEGER", "REAL") or column in mappings or not metric_name(column):
+            continue
+        cursor.execute(f"INSERT OR IGNORE INTO {METRIC_TABLE} (name, unit) VALUES (?, '')", [metric_name(column)])
+        metric_id = cursor.execute(
+            f"SELECT id FROM {METRIC_TABLE} WHERE name = ?", [metric_name(column)]
+        ).fetchone()[0]
+        cursor.execute(
+            f'INSERT INTO {MAPPING_TABLE} (table_name, "column", metric_id, user_id) VALUES (?, ?, ?, ?)',
+            [table_name, column, metric_id, owner],
+        )
+        mappings[column] = (metric_id, owner)
+
+    mapped = [
+        (column, metric_id, user_id or mapping_user)
+        for column, (metric_id, mapping_user) in mappings.items()
+        if metric_id is not None and column in schema
+    ]
+    if not mapped:
+        return None
+    # Columns of new_rows: moment, then v0, v1, ... for the mapped columns
+    value = "CASE mapped.position " + " ".join(
+        f"WHEN {position} THEN new_rows.v{position}" for position in range(len(mapped))
+    ) + " END"
+    statement = (
+        f"WITH mapped (position, metric_id, user_id, source_id) AS "
+        f"(VALUES {', '.join(['(?, ?, ?, ?)'] * len(mapped))}), "
+        f"new_rows (moment, {', '.join(f'v{position}' for position in range(len(mapped)))}) AS {MATERIALIZED}"
+        f"(SELECT {moment}, {', '.join(quote_identifier(column) for column, _, _ in mapped)} "
+        f"FROM {quote_identifier(table_name)} WHERE rowid > ?) "
+        f"INSERT INTO {OBSERVATION_TABLE} (user_id, metric_id, ts, value, source_id) "
+        # CROSS JOIN keeps mapped as the outer loop: each metric's rows are inserted together
+        f"SELECT mapped.user_id, mapped.metric_id, new_rows.moment, {value}, mapped.source_id "
+        f"FROM mapped CROSS JOIN new_rows WHERE new_rows.moment IS NOT NULL AND {value} IS NOT NULL"
+    )
+    parameters = [
+        parameter for position, (_, metric_id, owner) in enumerate(mapped)
+        for parameter in (position, metric_id, owner, table_name)
+    ]
+    return statement, parameters
+
+
+def _write_observations(cursor, plan, after_rowid):
+    # Copies the values of the rows inserted after after_rowid, in SQLite itself
+    statement, parameters = plan
+    cursor.execute(statement, parameters + [after_rowid])
+
+
+def rebuild_observations(db_path, table_names=None):
+    """
+    Rewrites the observations of uploaded tables (default: all) from their
+    rows and metric mappings. Returns {table name: observations written}.
+    """
+    counts = {}
+    with _bulk_load(db_path) as cursor:
+        if table_names is None:
+            table_names = [row[0] for row in cursor.execute(f"SELECT DISTINCT table_name FROM {SCHEMA_TABLE}")]
+        for table_name in table_names:
+            schema = load_schema(cursor, table_name)
+            if schema is None:
+                continue
+            cursor.execute(f"DELETE FROM {OBSERVATION_TABLE} WHERE source_id = ?", [table_name])
+            plan = _observation_plan(cursor, table_name, schema)
+            if plan:
+                _write_observations(cursor, plan, 0)
+            counts[table_name] = cursor.execute(
+                f"SELECT COUNT(*) FROM {OBSERVATION_TABLE} WHERE source_id = ?", [table_name]
+            ).fetchone()[0]
+    return counts
+
+
+def _column_metrics(cursor, table_name, names, types):
+    # Metric of each numeric column: the one it is mapped to, else the one named after it
+    metrics = {name: metric_name(name) for name, sql_type in zip(names, types) if sql_type in ("INTEGER", "REAL")}
+    if _table_exists(cursor, MAPPING_TABLE):
+        for column, name in cursor.execute(
+            f'SELECT mapping."column", metric.name FROM {MAPPING_TABLE} mapping '
+            f'JOIN {METRIC_TABLE} metric ON metric.id = mapping.metric_id WHERE mapping.table_name = ?',
+            [table_name],
+        ):
+            if column in metrics:
+                metrics[column] = name
+    return metrics
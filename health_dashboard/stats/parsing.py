@@ -0,0 +1,235 @@
+# FILE: stats/parsing.py
+
+import codecs
+import collections
+import csv
+import datetime
+import functools
+import itertools
+import re
+
+import pandas as pd
+
+
+def iter_lines(chunks, encoding="utf-8"):
+    """
+    Decodes byte chunks (e.g. UploadedFile.chunks()) and yields them line by
+    line, newline included, as csv.reader expects.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        yield from [line + "\n" for line in lines]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _read_csv(chunks):
+    """
+    (column names, iterator of raw rows) for a CSV file given as byte chunks.
+    """
+    reader = csv.reader(iter_lines(chunks))
+    headers = next(reader, None)
+    if not headers:
+        raise ValueError("CSV file is empty.")
+    # Sanitize column names; blank lines come through as empty rows
+    return [h.strip() for h in headers], filter(None, reader)
+
+
+def _parse_integer(value):
+    number = int(value)
+    if not -2 ** 63 <= number < 2 ** 63:
+        raise ValueError("out of the 64-bit integer range")
+    return number
+
+
+def _parse_date(value):
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+@functools.lru_cache(maxsize=1 << 17)  # Times of day repeat a lot; at most 86400 at second resolution
+def _parse_time(value):
+    if value[1:2] == ":":
+        value = "0" + value  # H:MM -> HH:MM
+    return datetime.time.fromisoformat(value).isoformat()
+
+
+def _parse_timestamp(value):
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        # Naive timestamps are taken as UTC
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+
+# Column type -> (pattern every sampled value must match, parser to the stored form).
+# Checked in this order; a column matching none of them is TEXT.
+TYPE_RULES = [
+    # Leading zeros are kept as TEXT (codes, identifiers)
+    ("INTEGER", re.compile(r"[+-]?(0|[1-9][0-9]*)"), _parse_integer),
+    ("REAL", re.compile(r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?"), float),
+    ("DATE", re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}"), _parse_date),
+    ("TIME", re.compile(r"[0-9]{1,2}:[0-9]{2}(:[0-9]{2}(\.[0-9]{1,6})?)?"), _parse_time),
+    ("TIMESTAMP", re.compile(
+        r"[0-9]{4}-[0-9]{2}-[0-9]{2}[ T][0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]{1,6})?)?(Z|[+-][0-9]{2}:[0-9]{2})?"
+    ), _parse_timestamp),
+]
+PARSERS = {sql_type: parse for sql_type, _, parse in TYPE_RULES}
+PATTERNS = {sql_type: pattern for sql_type, pattern, _ in TYPE_RULES}
+
+
+def infer_column_type(values):
+    """
+    SQL type for a column from a sample of its raw values: the first of
+    TYPE_RULES that every non-empty value matches and parses under.
+    """
+    values = [value for value in values if value != ""]
+    if not values:
+        return "TEXT"
+    for sql_type, pattern, parse in TYPE_RULES:
+        if all(pattern.fullmatch(value) for value in values):
+            try:
+                for value in values:
+                    parse(value)
+            except ValueError:
+                continue
+            return sql_type
+    return "TEXT"
+
+
+def _infer_types(names, sample):
+    return [
+        infer_column_type([row[index] for row in sample if len(row) == len(names)])
+        for index in range(len(names))
+    ]
+
+
+def _convert_integers(values):
+    converted = list(map(int, values))
+    if min(converted) < -2 ** 63 or max(converted) >= 2 ** 63:
+        raise ValueError("out of the 64-bit integer range")
+    return converted
+
+
+def _convert_dates(values):
+    # Validate without building new strings; only canonical YYYY-MM-DD is kept as is
+    collections.deque(map(datetime.date.fromisoformat, values), maxlen=0)
+    if set(map(len, values)) != {10}:
+        raise ValueError("not in YYYY-MM-DD form")
+    return list(values)
+
+
+def _convert_timestamps(values):
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), format="ISO8601", utc=True, errors="coerce")
+    if parsed.isna().any():
+        raise ValueError("unparseable timestamp")
+    # In the datetimes' own unit, which depends on the pandas version
+    unit = parsed.dt.unit
+    return ((parsed - pd.Timestamp(0, tz="UTC").as_unit(unit)) // pd.Timedelta(1, "s").as_unit(unit)).tolist()
+
+
+# Column type -> converter for a whole column of well-formed, non-empty values.
+# Each is a C-level or vectorized pass; any ValueError falls back to PARSERS value by value.
+FAST_CONVERTERS = {
+    "INTEGER": _convert_integers,
+    "REAL": lambda values: list(map(float, values)),
+    "DATE": _convert_dates,
+    "TIME": lambda values: list(map(_parse_time, values)),
+    "TIMESTAMP": _convert_timestamps,
+}
+
+
+def _convert_column(values, sql_type):
+    """
+    Converts one column of raw strings to its stored form, empty strings to
+    NULL. Returns (converted values, {index: error} for values that do not fit).
+    """
+    try:
+        return FAST_CONVERTERS[sql_type](values), {}
+    except ValueError:
+        pass
+
+    parse = PARSERS[sql_type]
+    converted = []
+    errors = {}
+    for index, value in enumerate(values):
+        if value == "":
+            converted.append(None)
+            continue
+        try:
+            converted.append(parse(value))
+        except ValueError:
+            converted.append(None)
+            errors[index] = f"expected {sql_type}, found {value!r}"
+    return converted, errors
+
+
+def _convert_widening(values, types, index):
+    """
+    _convert_column for column index of a batch. An INTEGER column holding
+    REAL numbers (e.g. 72.5) becomes REAL in types instead of rejecting them.
+    """
+    converted, errors = _convert_column(values, types[index])
+    if errors and types[index] == "INTEGER" and any(PATTERNS["REAL"].fullmatch(values[i]) for i in errors):
+        types[index] = "REAL"
+        return _convert_column(values, "REAL")
+    return converted, errors
+
+
+def _check_lengths(batch, numbers, n_columns, rejects):
+    if set(map(len, batch)) == {n_columns}:
+        return batch, numbers
+    kept, kept_numbers = [], []
+    for number, row in zip(numbers, batch):
+        if len(row) == n_columns:
+            kept.append(row)
+            kept_numbers.append(number)
+        else:
+            rejects.append((number, row, f"Expected {n_columns} fields, found {len(row)}"))
+    return kept, kept_numbers
+
+
+def _convert_batch(batch, numbers, names, types, rejects):
+    """
+    Converts a batch of equal-length raw rows column by column. Rows with a
+    value that does not fit its column's type are moved to rejects.
+    """
+    if not batch or all(sql_type == "TEXT" for sql_type in types):
+        return batch, numbers
+    columns = list(zip(*batch))
+    bad = {}
+    for index, sql_type in enumerate(types):
+        if sql_type == "TEXT":
+            continue
+        columns[index], errors = _convert_widening(columns[index], types, index)
+        for row_index, error in errors.items():
+            bad.setdefault(row_index, f"Column {names[index]!r}: {error}")
+    return _drop_bad_rows(batch, list(zip(*columns)), numbers, bad, rejects)
+
+
+def _drop_bad_rows(source_rows, rows, numbers, bad, rejects):
+    """
+    Moves the rows whose index is in bad ({index: reason}) to rejects, as
+    they were in the file (source_rows). Returns the remaining rows and numbers.
+    """
+    if not bad:
+        return rows, numbers
+    kept, kept_numbers = [], []
+    for row_index, (number, row) in enumerate(zip(numbers, rows)):
+        if row_index in bad:
+            rejects.append((number, source_rows[row_index], bad[row_index]))
+        else:
+            kept.append(row)
+            kept_numbers.append(number)
+    return kept, kept_numbers
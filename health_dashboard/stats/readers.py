@@ -0,0 +1,299 @@
+# FILE: stats/readers.py
+
+import datetime
+import functools
+import itertools
+import os
+import zipfile
+
+from .dedup import _already_loaded, file_sha256
+from .ingest import (
+    CSV_INSERT_BATCH_SIZE, SCHEMA_SAMPLE_ROWS, _csv_batches, _finish_load, _load_batches, _prepare_table,
+    table_name_from_filename,
+)
+from .observations import MAPPING_TABLE
+from .parsing import _convert_widening, _drop_bad_rows, _infer_types
+from .upload_db import _bulk_load, _table_exists
+
+
+# Upload file extension -> Arrow container read by ingest_arrow
+ARROW_FORMATS = {
+    ".parquet": "parquet",
+    ".arrow": "ipc",  # Arrow IPC file or stream
+    ".feather": "ipc",  # Feather v2 is the Arrow IPC file format
+}
+TIMESTAMP_UNITS = {"s": 1, "ms": 10 ** 3, "us": 10 ** 6, "ns": 10 ** 9}
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+def _import_pyarrow():
+    # Optional dependency, only needed for Parquet and Arrow uploads
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("Parquet and Arrow uploads need pyarrow (pip install -r requirements-optional.txt).")
+    return pyarrow
+
+
+def _arrow_sql_type(pa, data_type):
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    if pa.types.is_integer(data_type) or pa.types.is_boolean(data_type):
+        return "INTEGER"
+    if pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+        return "REAL"
+    if pa.types.is_date(data_type):
+        return "DATE"
+    if pa.types.is_time(data_type):
+        return "TIME"
+    if pa.types.is_timestamp(data_type):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def _to_list(array):
+    # Array.to_numpy().tolist() is much faster than to_pylist(), but only without nulls
+    if array.null_count:
+        return array.to_pylist()
+    return array.to_numpy(zero_copy_only=False).tolist()
+
+
+def _arrow_values(pa, array, sql_type):
+    """
+    Stored form of an Arrow array for a column of sql_type, as a CSV upload
+    would store it. TEXT gives any array as strings.
+    """
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    if sql_type == "INTEGER":
+        # A safe cast: uint64 values beyond the int64 range raise ArrowInvalid (a ValueError)
+        return _to_list(array.cast(pa.int64()))
+    if sql_type == "REAL":
+        return _to_list(array.cast(pa.float64()))
+    if sql_type == "DATE":
+        return array.cast(pa.date32()).cast(pa.string()).to_pylist()
+    if sql_type == "TIME":
+        array = array.cast(pa.time64("us"), safe=False)
+        try:
+            # Whole seconds (the common case) format as HH:MM:SS, like time.isoformat()
+            return array.cast(pa.time32("s")).cast(pa.string()).to_pylist()
+        except pa.ArrowInvalid:
+            return [None if value is None else value.isoformat() for value in array.to_pylist()]
+    if sql_type == "TIMESTAMP":
+        # The stored integers are UTC for zoned timestamps; naive ones are taken as UTC, as in CSV files
+        seconds = (array.cast(pa.int64()).fill_null(0).to_numpy() // TIMESTAMP_UNITS[array.type.unit]).tolist()
+        if array.null_count:
+            seconds = [None if valid is False else value
+                       for value, valid in zip(seconds, array.is_valid().to_pylist())]
+        return seconds
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return array.to_pylist()
+    try:
+        return array.cast(pa.string()).to_pylist()
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return [None if value is None else str(value) for value in array.to_pylist()]
+
+
+def _arrow_batches(pa, record_batches, names, arrow_types, types):
+    row_number = 1
+    for record_batch in record_batches:
+        for offset in range(0, record_batch.num_rows, CSV_INSERT_BATCH_SIZE):
+            part = record_batch.slice(offset, CSV_INSERT_BATCH_SIZE)
+            numbers = range(row_number, row_number + part.num_rows)
+            row_number += part.num_rows
+            rejects = []
+            columns = []
+            bad = {}
+            for index, (name, array, arrow_type, sql_type) in enumerate(zip(names, part.columns, arrow_types, types)):
+                if arrow_type == sql_type or sql_type == "TEXT":
+                    columns.append(_arrow_values(pa, array, sql_type))
+                    continue
+                # The table stores this column as another type: convert the values
+                # as text, as if they came from a CSV file
+                text = ["" if value is None else value for value in _arrow_values(pa, array, "TEXT")]
+                values, errors = _convert_widening(text, types, index)
+                columns.append(values)
+                for row_index, error in errors.items():
+                    bad.setdefault(row_index, f"Column {name!r}: {error}")
+            rows = list(zip(*columns))
+            yield _drop_bad_rows(rows, rows, numbers, bad, rejects) + (rejects,)
+
+
+def _arrow_columns(pa, arrow_schema):
+    # (column names, SQL type each Arrow type maps to)
+    return [name.strip() for name in arrow_schema.names], [_arrow_sql_type(pa, field.type) for field in arrow_schema]
+
+
+def _open_arrow(pa, source, file_format):
+    """
+    (Arrow schema, iterator of record batches) for a Parquet or Arrow IPC file.
+    """
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=CSV_INSERT_BATCH_SIZE)
+    try:
+        reader = pa.ipc.open_file(source)
+        return reader.schema, (reader.get_batch(index) for index in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        reader = pa.ipc.open_stream(source)
+        return reader.schema, iter(reader)
+
+
+def ingest_arrow(source, db_path, table_name, file_format, sha256=None, user_id=None, upload_id=None):
+    """
+    Loads a Parquet ("parquet") or Arrow IPC ("ipc") file, a seekable binary
+    file object, into table_name as ingest_csv would, with the column types
+    taken from the file's schema.
+
+    Raises ValueError if pyarrow is missing or the file cannot be read.
+    """
+    pa = _import_pyarrow()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    if sha256 is None:
+        sha256 = file_sha256(iter(functools.partial(source.read, 1 << 20), b""))
+        source.seek(0)
+
+    result = {"rows": 0, "rejected": 0, "quarantined": 0, "duplicates": 0, "skipped": False}
+    with _bulk_load(db_path) as cursor:
+        if _already_loaded(cursor, table_name, sha256):
+            result["skipped"] = True
+            return result
+
+        arrow_schema, record_batches = _open_arrow(pa, source, file_format)
+        names, arrow_types = _arrow_columns(pa, arrow_schema)
+        schema, names, types = _prepare_table(cursor, table_name, names, lambda: arrow_types)
+        _load_batches(cursor, table_name, schema, names, types,
+                      _arrow_batches(pa, record_batches, names, arrow_types, types), result, user_id=user_id,
+                      upload_id=upload_id)
+        _finish_load(cursor, table_name, schema, sha256, size, result)
+    return result
+
+
+def _import_openpyxl():
+    # Optional dependency, only needed for Excel uploads
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Excel uploads need openpyxl (pip install -r requirements-optional.txt).")
+    return openpyxl
+
+
+def sheet_table_name(table_name, sheet_name, sheet_count):
+    """
+    Table for one sheet of a workbook uploaded as table_name: table_name
+    itself for a single-sheet workbook, else table_name_<sheet name>.
+    """
+    if sheet_count == 1:
+        return table_name
+    return table_name + "_" + table_name_from_filename(sheet_name.replace(" ", "_"))
+
+
+def _cell_text(value, date_only):
+    # A cell value as it would be written in a CSV file
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if date_only else value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value).strip()
+
+
+def _sheet_rows(worksheet):
+    """
+    (column names, iterator of raw rows as text) for a worksheet: the first
+    non-empty row is the header and rows are cut or padded to its length.
+    """
+    rows = (row for row in worksheet.iter_rows(values_only=True) if any(value is not None for value in row))
+    header = next(rows, None)
+    if header is None:
+        return None, iter(())
+    header = list(header)
+    while header and header[-1] is None:
+        header.pop()
+    names = [
+        f"Column_{index + 1}" if value is None else _cell_text(value, False)
+        for index, value in enumerate(header)
+    ]
+    width = len(names)
+    sample = [tuple(row[:width]) + (None,) * (width - len(row)) for row in itertools.islice(rows, SCHEMA_SAMPLE_ROWS)]
+    # Date cells are dates if the column's sampled ones are all at midnight, else timestamps
+    date_only = [
+        all(value.time() == datetime.time() for value in column if isinstance(value, datetime.datetime))
+        for column in zip(*sample)
+    ] or [True] * width
+    text_rows = (
+        [_cell_text(value, date_only[index]) for index, value in enumerate(row[:width])] + [""] * (width - len(row))
+        for row in itertools.chain(sample, rows)
+    )
+    return names, text_rows
+
+
+def _copy_mappings(cursor, from_table, to_table):
+    # Metric mappings of from_table's columns (MetricMapping) apply to to_table's too
+    if not _table_exists(cursor, MAPPING_TABLE):
+        return
+    cursor.execute(
+        f'INSERT INTO {MAPPING_TABLE} (table_name, "column", metric_id, user_id) '
+        f'SELECT ?, "column", metric_id, user_id FROM {MAPPING_TABLE} WHERE table_name = ? '
+        f'ON CONFLICT (table_name, "column") DO UPDATE SET metric_id = excluded.metric_id, user_id = excluded.user_id',
+        [to_table, from_table],
+    )
+
+
+def ingest_xlsx(source, db_path, table_name, sha256=None, user_id=None, upload_id=None):
+    """
+    Loads every sheet of an Excel workbook, a seekable binary file object,
+    into a table of its own (sheet_table_name) as ingest_csv would, in one
+    transaction. Metric mappings given for table_name apply to every sheet.
+
+    Raises ValueError if openpyxl is missing or the file is not a workbook.
+    Returns {table name: result as from ingest_csv}.
+    """
+    openpyxl = _import_openpyxl()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    if sha256 is None:
+        sha256 = file_sha256(iter(functools.partial(source.read, 1 << 20), b""))
+        source.seek(0)
+
+    try:
+        # Read-only mode streams the rows; formulas give their last computed values
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, KeyError, openpyxl.utils.exceptions.InvalidFileException) as e:
+        raise ValueError(f"Could not read the workbook: {e}")
+    results = {}
+    try:
+        with _bulk_load(db_path) as cursor:
+            for worksheet in workbook.worksheets:
+                sheet_table = sheet_table_name(table_name, worksheet.title, len(workbook.worksheets))
+                if sheet_table != table_name:
+                    _copy_mappings(cursor, table_name, sheet_table)
+                result = {"rows": 0, "rejected": 0, "quarantined": 0, "duplicates": 0, "skipped": False}
+                if _already_loaded(cursor, sheet_table, sha256):
+                    result["skipped"] = True
+                    results[sheet_table] = result
+                    continue
+                names, rows = _sheet_rows(worksheet)
+                if names is None:
+                    continue
+                sample = list(itertools.islice(rows, SCHEMA_SAMPLE_ROWS))
+                schema, names, types = _prepare_table(cursor, sheet_table, names, lambda: _infer_types(names, sample))
+                _load_batches(cursor, sheet_table, schema, names, types,
+                              _csv_batches(itertools.chain(sample, rows), names, types), result, user_id=user_id,
+                              upload_id=upload_id)
+                _finish_load(cursor, sheet_table, schema, sha256, size, result)
+                results[sheet_table] = result
+            if not _table_exists(cursor, table_name) and _table_exists(cursor, MAPPING_TABLE):
+                # Given for the workbook and now held by its sheets' tables
+                cursor.execute(f"DELETE FROM {MAPPING_TABLE} WHERE table_name = ?", [table_name])
+    finally:
+        workbook.close()
+    return results
@@ -0,0 +1,92 @@
+# FILE: stats/sync_scheduler.py
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .fit_credentials import connected_user_ids, get_credentials
+from .fit_sync import (
+    DAY_MILLIS, DEFAULT_BACKFILL_WINDOW_DAYS, DEFAULT_SYNC_LOOKBACK_DAYS,
+    fetch_all_fit_data, floor_to_day, get_sync_starts,
+)
+
+
+DEFAULT_SCHEDULER_MAX_CONCURRENCY = 4
+
+
+def plan_user_sync(user_id, window_days):
+    """
+    Splits a user's sync into slices of at most window_days days: the ends
+    (UTC midnight) of the whole windows between the oldest watermark and
+    today, followed by None for the final sync up to now.
+    """
+    today = floor_to_day(int(time.time() * 1000))
+    lookback_days = getattr(settings, "GOOGLE_FIT_SYNC_LOOKBACK_DAYS", DEFAULT_SYNC_LOOKBACK_DAYS)
+    start = min(get_sync_starts(user_id, today - lookback_days * DAY_MILLIS))
+    window_millis = window_days * DAY_MILLIS
+    return list(range(start + window_millis, today, window_millis)) + [None]
+
+
+def _sync_slice(user_id, end_millis):
+    try:
+        # Fetched per slice, so the access token is refreshed during long catch-ups
+        credentials = get_credentials(user_id)
+        return fetch_all_fit_data(credentials, user_id, end_millis=end_millis)
+    finally:
+        close_old_connections()
+
+
+def run_sync_round(user_ids=None, max_concurrency=None, window_days=None, log=None):
+    """
+    Syncs every connected user (or user_ids) once.
+
+    Each user's sync is cut into slices (see plan_user_sync), and slices are
+    handed out round-robin: a user gets at most one slice in flight and goes
+    to the back of the queue once it finishes, so a long catch-up shares the
+    pool with everybody else instead of blocking it. At most max_concurrency
+    slices run at a time; the request rate per API host is further limited
+    by the shared HTTP client (HTTP_RATE_LIMITS).
+
+    log, if given, is called with a message for every failed user.
+    Returns a dict with users, failed, slices, rows and seconds.
+    """
+    if user_ids is None:
+        user_ids = connected_user_ids()
+    if max_concurrency is None:
+        max_concurrency = getattr(settings, "GOOGLE_FIT_SCHEDULER_MAX_CONCURRENCY", DEFAULT_SCHEDULER_MAX_CONCURRENCY)
+    if window_days is None:
+        window_days = getattr(settings, "GOOGLE_FIT_BACKFILL_WINDOW_DAYS", DEFAULT_BACKFILL_WINDOW_DAYS)
+
+    started = time.perf_counter()
+    stats = {"users": len(user_ids), "failed": 0, "slices": 0, "rows": 0}
+    plans = {}
+    ready = deque(user_ids)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while ready or in_flight:
+            while ready and len(in_flight) < max_concurrency:
+                user_id = ready.popleft()
+                if user_id not in plans:
+                    plans[user_id] = deque(plan_user_sync(user_id, window_days))
+                if plans[user_id]:
+                    end_millis = plans[user_id].popleft()
+                    in_flight[pool.submit(_sync_slice, user_id, end_millis)] = user_id
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                user_id = in_flight.pop(future)
+                try:
+                    stats["rows"] += future.result()
+                    stats["slices"] += 1
+                    ready.append(user_id)
+                except Exception as e:
+                    # The remaining slices are retried from the watermark next round
+                    stats["failed"] += 1
+                    if log:
+                        log(f"Sync failed for {user_id}: {e}")
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
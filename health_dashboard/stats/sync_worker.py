@@ -0,0 +1,112 @@
+# FILE: stats/sync_worker.py
+
+import datetime
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .fit_credentials import get_credentials
+from .fit_sync import fetch_all_fit_data, backfill_fit_data
+from .models import SyncJob
+
+
+DEFAULT_STALE_TIMEOUT = 30 * 60  # Seconds without progress before a running job counts as abandoned
+
+logger = logging.getLogger(__name__)
+
+# Jobs are persisted in the SyncJob table; the queue only carries job ids to
+# the in-process worker thread, which loads the user's stored credentials.
+_job_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue_sync(user_id, backfill_start=""):
+    """
+    Records a queued SyncJob for user_id and hands it to the background worker.
+    Returns the job so the caller can report its id.
+    """
+    ensure_worker_started()
+    job = SyncJob.objects.create(user_id=user_id, backfill_start=backfill_start)
+    _job_queue.put(job.pk)
+    return job
+
+
+def ensure_worker_started():
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        _worker = threading.Thread(target=_work_forever, name="fit-sync-worker", daemon=True)
+        _worker.start()
+        # Resume jobs left queued by a previous process, and running ones it
+        # abandoned (no progress for a while); finished backfill windows are
+        # checkpointed, so they are not fetched again. A job is only run by
+        # whoever claims it (run_sync_job), so one another process is still
+        # running is not run twice.
+        stale_timeout = getattr(settings, "SYNC_JOB_STALE_TIMEOUT", DEFAULT_STALE_TIMEOUT)
+        SyncJob.objects.filter(
+            status="running", updated_at__lt=timezone.now() - datetime.timedelta(seconds=stale_timeout),
+        ).update(status="queued")
+        for job_id in SyncJob.objects.filter(status="queued").values_list("pk", flat=True):
+            _job_queue.put(job_id)
+
+
+def _work_forever():
+    while True:
+        job_id = _job_queue.get()
+        try:
+            run_sync_job(job_id)
+        except Exception:
+            # Keep the worker alive for the jobs after this one
+            logger.exception("Error running sync job %s", job_id)
+        finally:
+            close_old_connections()
+            _job_queue.task_done()
+
+
+def run_sync_job(job_id):
+    # Claim the job; skip it if it is no longer queued (already run, or
+    # claimed by another worker)
+    if not SyncJob.objects.filter(pk=job_id, status="queued").update(status="running", updated_at=timezone.now()):
+        return
+    try:
+        job = SyncJob.objects.get(pk=job_id)
+        credentials = get_credentials(job.user_id)
+        if job.backfill_start:
+            def report(done, total):
+                _update(job, stage="backfill", progress_done=done, progress_total=total)
+
+            job.rows += backfill_fit_data(credentials, job.user_id, job.backfill_start, progress=report)
+
+        _update(job, stage="sync", progress_done=0, progress_total=1)
+        # A long backfill can outlive the access token it started with
+        job.rows += fetch_all_fit_data(get_credentials(job.user_id), job.user_id)
+        _update(job, status="done", progress_done=1)
+    except Exception as e:
+        SyncJob.objects.filter(pk=job_id).update(status="failed", error=str(e), updated_at=timezone.now())
+
+
+def _update(job, **fields):
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save()
+
+
+def job_progress(job):
+    """
+    JSON-serialisable summary of a SyncJob for the progress endpoint.
+    """
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "stage": job.stage,
+        "done": job.progress_done,
+        "total": job.progress_total,
+        "rows": job.rows,
+        "error": job.error,
+    }
@@ -1,3 +1,1159 @@
-from django.test import TestCase
+import datetime
+import gc
+import io
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+import unittest
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+try:
+    import pyarrow
+except ImportError:  # Optional; only needed for Parquet and Arrow uploads
+    pyarrow = None
+try:
+    import openpyxl
+except ImportError:  # Optional; only needed for Excel uploads
+    openpyxl = None
+
+from . import (
+    bulk_import, chunked_upload, dash_apps, fit_credentials, fit_sync, http_client, ingest, sync_scheduler, sync_worker,
+    upload_db, views,
+)
+from .fit_metrics import FIT_METRICS, parse_metric
+from .fit_standin import load_recorded_bucket, start_standin
+from .bulk_import import import_files
+from .dedup import ROW_HASH_COLUMN, file_sha256
+from .ingest import QUARANTINE_TABLE, REJECT_TABLE, ingest_csv, table_name_from_filename
+from .observations import MAPPING_TABLE, METRIC_TABLE, OBSERVATION_TABLE, rebuild_observations
+from .readers import ingest_arrow, ingest_xlsx
+from .upload_db import load_schema
+from .json_stream import iter_json_array
+from .models import (
+    BackfillWindow, ChunkedUpload, FitCredential, FitDataPoint, SyncJob, SyncState, UploadReject, UserCalories, UserHR,
+    UserSleep, UserSteps,
+)
+
+
+DAY_MILLIS = 86400000
+STEPS_TYPE = "com.google.step_count.delta"
+
+# One point per daily bucket, shaped like Google Fit's aggregate response
+POINT_VALUES = {
+    STEPS_TYPE: {"intVal": 100},
+    "com.google.heart_rate.bpm": {"fpVal": 70.0},
+    "com.google.calories.expended": {"fpVal": 25.0},
+    "com.google.sleep.segment": {"intVal": 4},  # Light sleep
+}
+
+
+def fake_aggregate(token, data_type_name, data_source_id, start_millis, end_millis):
+    buckets = []
+    for start in range(int(start_millis), int(end_millis), DAY_MILLIS):
+        point = {
+            "startTimeNanos": str(start * 1000000),
+            "endTimeNanos": str((start + 3600000) * 1000000),
+            "value": [POINT_VALUES[data_type_name]],
+        }
+        buckets.append({
+            "startTimeMillis": str(start),
+            "endTimeMillis": str(start + DAY_MILLIS),
+            "dataset": [{"point": [point]}],
+        })
+    return {"bucket": buckets}
+
+
+def fake_raw_points(token, data_type_name, data_source_id, start_millis, end_millis):
+    # Two step points an hour apart each day; no points for the other metrics
+    if data_type_name != STEPS_TYPE:
+        return []
+    return [
+        {
+            "startTimeNanos": str((day + hour * 3600000) * 1000000),
+            "endTimeNanos": str((day + hour * 3600000 + 60000) * 1000000),
+            "value": [{"intVal": 40}],
+            "originDataSourceId": "phone",
+        }
+        for day in range(int(start_millis) - int(start_millis) % DAY_MILLIS, int(end_millis), DAY_MILLIS)
+        for hour in (8, 9)
+        if day + hour * 3600000 >= start_millis
+    ]
+
+
+def byte_chunks(text, size=7):
+    # Small chunks, so values (and multibyte characters) are split across them
+    data = text.encode("utf-8")
+    return (data[start:start + size] for start in range(0, len(data), size))
+
+
+class FetchAllFitDataTests(TestCase):
+    credentials = types.SimpleNamespace(token="test-token")
+
+    def test_metrics_fetched_concurrently_and_stored(self):
+        # Every request waits for the others: a sync fetching one metric at a
+        # time would break the barrier
+        barrier = threading.Barrier(len(POINT_VALUES), timeout=5)
+
+        def aggregate(*args):
+            barrier.wait()
+            return fake_aggregate(*args)
+
+        with mock.patch.object(fit_sync, "aggregate_fitness_data", side_effect=aggregate) as fetch:
+            fit_sync.fetch_all_fit_data(self.credentials, "alice")
+        self.assertEqual({call.args[1] for call in fetch.call_args_list}, set(POINT_VALUES))
+
+        days = UserSteps.objects.filter(user_id="alice").count()
+        self.assertGreater(days, 0)
+        for model in (UserHR, UserCalories, UserSleep):
+            self.assertEqual(model.objects.filter(user_id="alice").count(), days)
+        self.assertEqual(set(UserSteps.objects.values_list("steps", flat=True)), {100})
+
+
+class SyncWatermarkTests(TestCase):
+    credentials = types.SimpleNamespace(token="test-token")
+
+    def setUp(self):
+        patcher = mock.patch.object(fit_sync, "aggregate_fitness_data", side_effect=fake_aggregate)
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_sync_looks_back_and_later_syncs_fetch_only_the_current_day(self):
+        today = fit_sync.floor_to_day(int(time.time() * 1000))
+        with self.settings(GOOGLE_FIT_SYNC_LOOKBACK_DAYS=30):
+            self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "alice"), 4 * 31)
+        self.assertEqual(set(SyncState.objects.filter(user_id="alice").values_list("synced_until", flat=True)), {today})
+
+        self.fetch.reset_mock()
+        self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "alice"), 4)
+        self.assertEqual({call.args[3] for call in self.fetch.call_args_list}, {today})
+        self.assertEqual(UserSteps.objects.filter(user_id="alice").count(), 31)
+
+    def test_watermarks_are_per_user_and_metric(self):
+        today = fit_sync.floor_to_day(int(time.time() * 1000))
+        SyncState.objects.create(user_id="alice", metric=STEPS_TYPE, synced_until=today - 5 * DAY_MILLIS)
+        SyncState.objects.create(user_id="bob", metric=STEPS_TYPE, synced_until=today - 20 * DAY_MILLIS)
+        fit_sync.fetch_all_fit_data(self.credentials, "alice")
+        starts = {call.args[1]: call.args[3] for call in self.fetch.call_args_list}
+        self.assertEqual(starts[STEPS_TYPE], today - 5 * DAY_MILLIS)
+        self.assertEqual(UserSteps.objects.filter(user_id="alice").count(), 6)
+
+    def test_days_already_stored_are_updated(self):
+        today = fit_sync.floor_to_day(int(time.time() * 1000))
+        with self.settings(GOOGLE_FIT_SYNC_LOOKBACK_DAYS=3):
+            fit_sync.fetch_all_fit_data(self.credentials, "alice")
+        with mock.patch.dict(POINT_VALUES, {STEPS_TYPE: {"intVal": 250}}):
+            fit_sync.fetch_all_fit_data(self.credentials, "alice")
+        steps = dict(UserSteps.objects.filter(user_id="alice").values_list("date", "steps"))
+        self.assertEqual(len(steps), 4)
+        self.assertEqual(steps.pop(datetime.datetime.fromtimestamp(today // 1000, datetime.timezone.utc).date()), 250)
+        self.assertEqual(set(steps.values()), {100})
+
+
+class BackfillTests(TestCase):
+    credentials = types.SimpleNamespace(token="test-token")
+
+    def test_windows_cover_the_range(self):
+        self.assertEqual(
+            fit_sync.split_into_windows(0, 5 * DAY_MILLIS, 2 * DAY_MILLIS),
+            [(0, 2 * DAY_MILLIS), (2 * DAY_MILLIS, 4 * DAY_MILLIS), (4 * DAY_MILLIS, 5 * DAY_MILLIS)],
+        )
+
+    def test_interrupted_backfill_resumes_from_checkpoints(self):
+        failing_start = fit_sync.date_to_millis("2024-01-31")
+
+        def fail_one_window(token, data_type_name, data_source_id, start_millis, end_millis):
+            if data_type_name == STEPS_TYPE and start_millis == failing_start:
+                raise RuntimeError("connection lost")
+            return fake_aggregate(token, data_type_name, data_source_id, start_millis, end_millis)
+
+        with mock.patch.object(fit_sync, "aggregate_fitness_data", side_effect=fail_one_window):
+            with self.assertRaises(RuntimeError):
+                fit_sync.backfill_fit_data(self.credentials, "alice", "2024-01-01", "2024-03-01",
+                                           window_days=30, max_workers=1)
+        self.assertLess(BackfillWindow.objects.filter(user_id="alice").count(), 8)
+
+        progress = []
+        with mock.patch.object(fit_sync, "aggregate_fitness_data", side_effect=fake_aggregate) as fetch:
+            fit_sync.backfill_fit_data(self.credentials, "alice", "2024-01-01", "2024-03-01",
+                                       window_days=30, progress=lambda done, total: progress.append((done, total)))
+        fetched = [(call.args[1], call.args[3]) for call in fetch.call_args_list]
+        self.assertIn((STEPS_TYPE, failing_start), fetched)
+        self.assertEqual(len(fetched), 8 - progress[0][0])
+        self.assertEqual(progress[-1], (8, 8))
+        self.assertEqual(UserSteps.objects.filter(user_id="alice").count(), 60)
+
+        with mock.patch.object(fit_sync, "aggregate_fitness_data", side_effect=fake_aggregate) as fetch:
+            self.assertEqual(
+                fit_sync.backfill_fit_data(self.credentials, "alice", "2024-01-01", "2024-03-01", window_days=30), 0
+            )
+        fetch.assert_not_called()
+
+
+class SyncWorkerTests(TestCase):
+    credentials = types.SimpleNamespace(token="test-token")
+
+    def run_job(self, job, **patches):
+        with mock.patch.multiple(sync_worker, get_credentials=lambda user_id: self.credentials, **patches):
+            sync_worker.run_sync_job(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_job_runs_backfill_then_sync_and_reports_progress(self):
+        def backfill(credentials, user_id, start_date, progress):
+            progress(0, 2)
+            progress(2, 2)
+            return 10
+
+        job = SyncJob.objects.create(user_id="alice", backfill_start="2024-01-01")
+        job = self.run_job(job, backfill_fit_data=backfill, fetch_all_fit_data=lambda credentials, user_id: 3)
+        self.assertEqual((job.status, job.stage, job.rows, job.progress_done, job.progress_total),
+                         ("done", "sync", 13, 1, 1))
+
+    def test_failed_sync_recorded_on_the_job(self):
+        job = SyncJob.objects.create(user_id="alice")
+        job = self.run_job(job, fetch_all_fit_data=mock.Mock(side_effect=RuntimeError("quota exceeded")))
+        self.assertEqual((job.status, job.error), ("failed", "quota exceeded"))
+
+    def test_job_claimed_elsewhere_not_run_again(self):
+        job = SyncJob.objects.create(user_id="alice", status="running")
+        fetch = mock.Mock(return_value=3)
+        job = self.run_job(job, fetch_all_fit_data=fetch)
+        fetch.assert_not_called()
+        self.assertEqual(job.status, "running")
+
+    def test_only_abandoned_running_jobs_resumed(self):
+        queued = SyncJob.objects.create(user_id="alice")
+        fresh = SyncJob.objects.create(user_id="bob", status="running")
+        stale = SyncJob.objects.create(user_id="carol", status="running")
+        SyncJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+
+        jobs = queue.Queue()
+        with mock.patch.multiple(sync_worker, _worker=None, _job_queue=jobs), \
+                mock.patch.object(sync_worker.threading, "Thread"), self.settings(SYNC_JOB_STALE_TIMEOUT=600):
+            sync_worker.ensure_worker_started()
+        self.assertEqual(sorted(jobs.queue), [queued.pk, stale.pk])
+        self.assertEqual(
+            dict(SyncJob.objects.values_list("user_id", "status")),
+            {"alice": "queued", "bob": "running", "carol": "queued"},
+        )
+
+    def test_status_endpoint_reports_the_latest_job(self):
+        self.assertEqual(self.client.get(reverse("sync_status")).json(), {"status": "none"})
+        SyncJob.objects.create(user_id="anonymous_user", status="done")
+        job = SyncJob.objects.create(user_id="anonymous_user", status="running", stage="backfill",
+                                     progress_done=3, progress_total=8)
+        progress = self.client.get(reverse("sync_status")).json()
+        self.assertEqual((progress["id"], progress["status"], progress["done"], progress["total"]),
+                         (job.pk, "running", 3, 8))
+
+
+class RawSyncTests(TestCase):
+    credentials = types.SimpleNamespace(token="test-token")
+
+    def test_raw_points_stored_once_and_rolled_up_by_day(self):
+        with mock.patch.object(fit_sync, "fetch_raw_points", side_effect=fake_raw_points):
+            with self.settings(GOOGLE_FIT_SYNC_LOOKBACK_DAYS=3):
+                fit_sync.fetch_all_fit_data(self.credentials, "alice", raw=True)
+            points = FitDataPoint.objects.filter(user_id="alice", data_type=STEPS_TYPE).count()
+            fit_sync.fetch_all_fit_data(self.credentials, "alice", raw=True)
+
+        self.assertGreaterEqual(points, 6)
+        self.assertEqual(FitDataPoint.objects.filter(user_id="alice").count(), points)
+        self.assertEqual(set(UserSteps.objects.filter(user_id="alice").values_list("steps", flat=True)) - {40}, {80})
+
+
+def fake_response(status, headers=None):
+    return mock.Mock(status_code=status, headers=headers or {})
+
+
+class HttpClientTests(SimpleTestCase):
+    def setUp(self):
+        # No waiting between attempts
+        patcher = mock.patch.object(http_client, "_backoff_delay", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, outcomes, **kwargs):
+        with mock.patch.object(http_client._session, "request", side_effect=outcomes) as session_request:
+            try:
+                return http_client.get("http://fit.test/", **kwargs), session_request.call_count
+            except Exception as e:
+                return e, session_request.call_count
+
+    def test_retryable_statuses_and_errors_retried(self):
+        response, attempts = self.send([fake_response(503), requests.ConnectionError(), fake_response(200)])
+        self.assertEqual((response.status_code, attempts), (200, 3))
+
+    def test_other_statuses_returned_at_once(self):
+        response, attempts = self.send([fake_response(404), fake_response(200)])
+        self.assertEqual((response.status_code, attempts), (404, 1))
+
+    def test_gives_up_after_max_retries(self):
+        response, attempts = self.send([fake_response(500)] * 3, max_retries=2)
+        self.assertEqual((response.status_code, attempts), (500, 3))
+        error, attempts = self.send([requests.Timeout()] * 3, max_retries=2)
+        self.assertIsInstance(error, requests.Timeout)
+        self.assertEqual(attempts, 3)
+
+    def test_requests_that_are_not_idempotent_retried_only_if_unprocessed(self):
+        response, attempts = self.send([fake_response(503), fake_response(429), fake_response(200)], idempotent=False)
+        self.assertEqual((response.status_code, attempts), (200, 3))
+        response, attempts = self.send([requests.ConnectTimeout(), fake_response(200)], idempotent=False)
+        self.assertEqual((response.status_code, attempts), (200, 2))
+        for outcome in (fake_response(502), requests.ReadTimeout(), requests.ConnectionError()):
+            result, attempts = self.send([outcome, fake_response(200)], idempotent=False)
+            self.assertEqual(attempts, 1)
+            self.assertIs(result, outcome)
+
+    def test_timeout_always_set(self):
+        with mock.patch.object(http_client._session, "request", return_value=fake_response(200)) as session_request:
+            http_client.post("http://fit.test/")
+        self.assertIsNotNone(session_request.call_args.kwargs["timeout"])
+
+
+class BackoffTests(SimpleTestCase):
+    def test_backoff_honours_retry_after_and_is_capped(self):
+        with self.settings(HTTP_BACKOFF_BASE=1.0, HTTP_BACKOFF_MAX=10.0):
+            self.assertEqual(http_client._backoff_delay(0, fake_response(429, {"Retry-After": "4"})), 4.0)
+            self.assertEqual(http_client._backoff_delay(0, fake_response(429, {"Retry-After": "60"})), 10.0)
+            for attempt in range(8):
+                self.assertLessEqual(http_client._backoff_delay(attempt), min(10.0, 2 ** attempt))
+
+    def test_token_bucket_allows_bursts_then_paces(self):
+        bucket = http_client.TokenBucket(rate=10, capacity=2)
+        with mock.patch.object(http_client.time, "sleep") as sleep:
+            sleep.side_effect = lambda seconds: setattr(bucket, "tokens", bucket.tokens + seconds * bucket.rate)
+            bucket.acquire()
+            bucket.acquire()
+            sleep.assert_not_called()
+            bucket.acquire()
+        self.assertEqual(sleep.call_count, 1)
+        self.assertAlmostEqual(sleep.call_args.args[0], 0.1, places=2)
+
+
+class ParseMetricTests(SimpleTestCase):
+    metrics = {metric.name: metric for metric in FIT_METRICS}
+
+    def response(self, *buckets):
+        # Buckets one day apart from 2024-01-01, each a list of (start_minute, end_minute, value) points
+        start = fit_sync.date_to_millis("2024-01-01")
+        return {"bucket": [
+            {
+                "startTimeMillis": str(start + i * DAY_MILLIS),
+                "dataset": [{"point": [
+                    {
+                        "startTimeNanos": str((start + i * DAY_MILLIS + begin * 60000) * 1000000),
+                        "endTimeNanos": str((start + i * DAY_MILLIS + end * 60000) * 1000000),
+                        "value": [value],
+                    }
+                    for begin, end, value in points
+                ]}],
+            }
+            for i, points in enumerate(buckets)
+        ]}
+
+    def parsed(self, name, data):
+        return [
+            (str(row.date), getattr(row, self.metrics[name].model_field))
+            for row in parse_metric(self.metrics[name], data, "alice")
+        ]
+
+    def test_points_reduced_per_bucket(self):
+        steps = self.response([(0, 1, {"intVal": 30}), (5, 6, {"intVal": 12})], [])
+        self.assertEqual(self.parsed("steps", steps), [("2024-01-01", 42), ("2024-01-02", 0)])
+        hr = self.response([(0, 1, {"fpVal": 60.0}), (5, 6, {"fpVal": 70.0})], [], [(0, 1, {"fpVal": 80.0})])
+        self.assertEqual(self.parsed("heart_rate", hr), [("2024-01-01", 65.0), ("2024-01-02", 0.0), ("2024-01-03", 80.0)])
+
+    def test_sleep_summed_from_segment_durations(self):
+        sleep = self.response([(0, 90, {"intVal": 4}), (90, 120, {"intVal": 5})])
+        self.assertEqual(self.parsed("sleep", sleep), [("2024-01-01", 120)])
+
+    def test_empty_response(self):
+        self.assertEqual(self.parsed("calories", {}), [])
+
+
+class SchedulerTests(TestCase):
+    def test_users_synced_round_robin_with_bounded_concurrency(self):
+        today = fit_sync.floor_to_day(int(time.time() * 1000))
+        for user_id in ("bob", "carol"):
+            for metric in FIT_METRICS:
+                SyncState.objects.create(user_id=user_id, metric=metric.data_type, synced_until=today)
+
+        lock = threading.Lock()
+        running = []
+        started = []
+        peak = []
+
+        def fetch(credentials, user_id, end_millis=None):
+            with lock:
+                running.append(user_id)
+                started.append((user_id, end_millis))
+                peak.append((len(running), running.count(user_id)))
+            time.sleep(0.02)
+            with lock:
+                running.remove(user_id)
+            return 1
+
+        patches = {"fetch_all_fit_data": fetch, "get_credentials": lambda user_id: None}
+        with mock.patch.multiple(sync_scheduler, **patches), self.settings(GOOGLE_FIT_SYNC_LOOKBACK_DAYS=90):
+            stats = sync_scheduler.run_sync_round(["alice", "bob", "carol"], max_concurrency=2, window_days=30)
+
+        # alice is 90 days behind: two whole windows, then the sync up to now
+        self.assertEqual(
+            [end for user_id, end in started if user_id == "alice"],
+            [today - 60 * DAY_MILLIS, today - 30 * DAY_MILLIS, None],
+        )
+        self.assertEqual((stats["users"], stats["slices"], stats["rows"], stats["failed"]), (3, 5, 5, 0))
+        self.assertEqual(max(peak), (2, 1))
+        # The others are not queued behind alice's catch-up
+        users = [user_id for user_id, _ in started]
+        self.assertLess(users.index("carol"), len(users) - 1 - users[::-1].index("alice"))
+
+    def test_failed_user_does_not_stop_the_round(self):
+        def fetch(credentials, user_id, end_millis=None):
+            if user_id == "alice":
+                raise RuntimeError("invalid_grant")
+            return 2
+
+        failures = []
+        patches = {"fetch_all_fit_data": fetch, "get_credentials": lambda user_id: None}
+        with mock.patch.multiple(sync_scheduler, **patches), self.settings(GOOGLE_FIT_SYNC_LOOKBACK_DAYS=1):
+            stats = sync_scheduler.run_sync_round(["alice", "bob"], window_days=30, log=failures.append)
+        self.assertEqual((stats["failed"], stats["rows"]), (1, 2))
+        self.assertEqual(failures, ["Sync failed for alice: invalid_grant"])
+
+
+class JsonStreamTests(SimpleTestCase):
+    def test_elements_split_across_chunks(self):
+        document = '{"kind": "x", "bucket": [{"v": 1}, {"v": [2, 3]}, "é", 4.5, null], "next": "p2"}'
+        rest = {}
+        elements = list(iter_json_array(byte_chunks(document, 1), "bucket", rest))
+        self.assertEqual(elements, [{"v": 1}, {"v": [2, 3]}, "é", 4.5, None])
+        self.assertEqual(rest, {"kind": "x", "next": "p2"})
+
+    def test_empty_and_missing_array(self):
+        self.assertEqual(list(iter_json_array([b'{"bucket": []}'], "bucket")), [])
+        self.assertEqual(list(iter_json_array([b'{"other": 1}'], "bucket")), [])
+
+    def test_truncated_input(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"bucket": [{"v": 1}, {"v"'], "bucket"))
+
+
+class FitStandInTests(TestCase):
+    """
+    Syncs against the local Google Fit stand-in (stats.fit_standin).
+    """
+    credentials = types.SimpleNamespace(token="test-token")
+
+    def start(self, **config):
+        server, url = start_standin(**config)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        settings_override = override_settings(GOOGLE_FIT_API_URL=url, GOOGLE_FIT_SYNC_LOOKBACK_DAYS=30)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_sync_against_synthetic_data(self):
+        self.start(points_per_bucket=4)
+        self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "alice"), 4 * 31)
+        self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "bob", raw=True), 4 * 31)
+        self.assertEqual(UserSteps.objects.filter(user_id="alice").count(), 31)
+        self.assertEqual(FitDataPoint.objects.filter(user_id="bob", data_type=STEPS_TYPE).count(), 4 * 31)
+
+    def test_sync_up_to_end_skips_metrics_already_past_it(self):
+        self.start(points_per_bucket=4)
+        end = fit_sync.floor_to_day(int(time.time() * 1000)) - 10 * DAY_MILLIS
+        self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "alice", end_millis=end), 4 * 20)
+        self.assertEqual(set(SyncState.objects.filter(user_id="alice").values_list("synced_until", flat=True)), {end})
+        self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "alice", end_millis=end), 0)
+
+    def test_replayed_fixture_shifted_onto_each_day(self):
+        self.start(replay=True)
+        fit_sync.fetch_all_fit_data(self.credentials, "alice")
+        recorded = load_recorded_bucket(STEPS_TYPE)
+        steps = sum(point["value"][0]["intVal"] for dataset in recorded["dataset"] for point in dataset["point"])
+        self.assertEqual(set(UserSteps.objects.filter(user_id="alice").values_list("steps", flat=True)), {steps})
+
+    def test_streamed_sync_stores_the_same_rows(self):
+        self.start(points_per_bucket=30)
+        fit_sync.fetch_all_fit_data(self.credentials, "alice")
+        self.assertEqual(fit_sync.fetch_all_fit_data(self.credentials, "bob", stream=True), 4 * 31)
+        for model in (UserSteps, UserHR, UserCalories, UserSleep):
+            rows = model.objects.order_by("date").values_list(*[f.name for f in model._meta.concrete_fields][2:])
+            self.assertEqual(list(rows.filter(user_id="bob")), list(rows.filter(user_id="alice")))
+
+        fit_sync.fetch_all_fit_data(self.credentials, "carol", raw=True)
+        fit_sync.fetch_all_fit_data(self.credentials, "dave", raw=True, stream=True)
+        points = FitDataPoint.objects.order_by("data_type", "start_ms").values_list("data_type", "start_ms", "value")
+        self.assertEqual(list(points.filter(user_id="dave")), list(points.filter(user_id="carol")))
+
+
+    def test_failed_streamed_sync_leaves_the_watermarks(self):
+        self.start(points_per_bucket=4, failure_rate=1.0, failure_status=400)
+        with self.assertRaises(Exception):
+            fit_sync.fetch_all_fit_data(self.credentials, "alice", stream=True)
+        self.assertFalse(SyncState.objects.filter(user_id="alice").exists())
+
+class FitCredentialTests(TestCase):
+    """
+    Refreshes access tokens against the stand-in's OAuth token endpoint.
+    """
+
+    def setUp(self):
+        server, url = start_standin()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(fit_credentials._cache.clear)
+        self.token_uri = f"http://127.0.0.1:{server.server_port}/token"
+
+    def save(self, expires_in, refresh_token="refresh-1"):
+        # google-auth uses naive UTC datetimes
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        expiry = now + datetime.timedelta(seconds=expires_in)
+        credentials = fit_credentials.Credentials(
+            token="access-1", refresh_token=refresh_token, token_uri=self.token_uri,
+            client_id="client", client_secret="secret", scopes=["fitness"], expiry=expiry,
+        )
+        fit_credentials.save_credentials("alice", credentials)
+
+    def test_valid_token_reused(self):
+        self.save(expires_in=3600)
+        self.assertEqual(fit_credentials.get_credentials("alice").token, "access-1")
+
+    def test_token_refreshed_ahead_of_expiry_and_stored(self):
+        self.save(expires_in=60)
+        with self.settings(GOOGLE_FIT_TOKEN_REFRESH_MARGIN=300):
+            token = fit_credentials.get_credentials("alice").token
+            self.assertTrue(token.startswith("standin-"))
+            self.assertEqual(FitCredential.objects.get(user_id="alice").token, token)
+            # Cached until it nears expiry again
+            self.assertEqual(fit_credentials.get_credentials("alice").token, token)
+
+    def test_refresh_token_kept_and_missing_users_reported(self):
+        self.save(expires_in=3600)
+        self.save(expires_in=3600, refresh_token=None)
+        self.assertEqual(fit_credentials.get_credentials("alice").refresh_token, "refresh-1")
+        with self.assertRaises(fit_credentials.CredentialsMissing):
+            fit_credentials.get_credentials("bob")
+
+    def test_refresh_token_and_client_secret_stored_encrypted(self):
+        self.save(expires_in=3600)
+        record = FitCredential.objects.get(user_id="alice")
+        self.assertNotIn("refresh-1", record.refresh_token)
+        self.assertNotIn("secret", record.client_secret)
+        credentials = fit_credentials.get_credentials("alice")
+        self.assertEqual((credentials.refresh_token, credentials.client_secret), ("refresh-1", "secret"))
+        fit_credentials._cache.clear()
+        # Stored under another key: the user has to connect again
+        with self.settings(FIT_CREDENTIAL_KEY=fit_credentials.Fernet.generate_key().decode()):
+            with self.assertRaises(fit_credentials.CredentialsMissing):
+                fit_credentials.get_credentials("alice")
+
+
+class ScratchDatabaseMixin:
+    """
+    Uploads load into a scratch database holding the stats tables, copied
+    from the test database, as they do into db.sqlite3.
+    """
+
+    def setUp(self):
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch)
+        self.db_path = os.path.join(scratch, "ingest.sqlite3")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE (tbl_name LIKE 'stats\\_%' ESCAPE '\\' OR tbl_name = ?) "
+                "AND sql IS NOT NULL ORDER BY type = 'index'",
+                [OBSERVATION_TABLE],
+            )
+            ddl = cursor.fetchall()
+        with sqlite3.connect(self.db_path) as conn:
+            for (statement,) in ddl:
+                conn.execute(statement)
+
+    def query(self, sql, parameters=()):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, parameters).fetchall()
+        finally:
+            conn.close()
+
+    def schema(self, table_name="hr_db"):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return load_schema(conn.cursor(), table_name)
+        finally:
+            conn.close()
+
+
+class IngestTests(ScratchDatabaseMixin, TestCase):
+    def load(self, text, table_name="hr_db", **kwargs):
+        return ingest_csv(byte_chunks(text), self.db_path, table_name, **kwargs)
+
+    def test_table_named_after_the_file(self):
+        self.assertEqual(table_name_from_filename("uploads/Heart Rate (2024).CSV"), "heartrate2024")
+
+    def test_rows_streamed_across_chunks(self):
+        self.assertEqual(self.load("Date,Comment\n2024-01-01,café au lait\n\n2024-01-02,\"a, b\"\n")["rows"], 2)
+        self.assertEqual(
+            self.query("SELECT Date, Comment FROM hr_db ORDER BY rowid"),
+            [("2024-01-01", "café au lait"), ("2024-01-02", "a, b")],
+        )
+
+    def test_rows_of_wrong_length_or_type_rejected(self):
+        rows = "".join(f"2024-01-{day:02},{60 + day}\n" for day in range(1, 10))
+        text = "Date,Heart_Rate\n" + rows + "2024-01-10\n2024-01-11,x\n2024-01-12,72\n"
+        # Several statements per batch and several batches
+        with mock.patch.multiple(ingest, MAX_ROWS_PER_INSERT=2, CSV_INSERT_BATCH_SIZE=5, SCHEMA_SAMPLE_ROWS=3):
+            self.assertEqual(self.load(text), {"rows": 10, "rejected": 2, "quarantined": 0, "duplicates": 0, "skipped": False})
+        self.assertEqual(self.query("SELECT COUNT(*), MAX(Heart_Rate) FROM hr_db"), [(10, 72)])
+        rejects = self.query(f"SELECT row_number, row, reason FROM {REJECT_TABLE} ORDER BY row_number")
+        self.assertEqual([(number, json.loads(row)) for number, row, _ in rejects],
+                         [(10, ["2024-01-10"]), (11, ["2024-01-11", "x"])])
+        self.assertEqual(rejects[0][2], "Expected 2 fields, found 1")
+        self.assertEqual(rejects[1][2], "Column 'Heart_Rate': expected INTEGER, found 'x'")
+        self.assertTrue(gc.isenabled())
+
+    def test_empty_file_refused(self):
+        with self.assertRaises(ValueError):
+            self.load("")
+
+    def test_column_types_inferred_and_stored(self):
+        result = self.load(
+            "Date,Time,Heart_Rate,Code,Taken_At,Note\n"
+            "2024-01-01,7:50,97,A07,2024-01-01T07:50:00Z,ok\n"
+            "2024-01-02,8:05,88.5,B12,2024-01-02 08:05:00,\n"
+        )
+        self.assertEqual(result["rows"], 2)
+        self.assertEqual(self.schema(), {
+            "Date": "DATE", "Time": "TIME", "Heart_Rate": "REAL",
+            "Code": "TEXT", "Taken_At": "TIMESTAMP", "Note": "TEXT",
+        })
+        self.assertEqual(
+            self.query("SELECT Date, Time, typeof(Heart_Rate), Code, Taken_At FROM hr_db ORDER BY rowid"),
+            [
+                ("2024-01-01", "07:50:00", "real", "A07", 1704095400),
+                ("2024-01-02", "08:05:00", "real", "B12", 1704182700),
+            ],
+        )
+
+    def test_values_not_fitting_the_column_rejected(self):
+        with mock.patch.object(ingest, "SCHEMA_SAMPLE_ROWS", 2):
+            result = self.load("Date,Steps\n2024-01-01,900\n2024-01-02,\n2024-01-03,many\n")
+        self.assertEqual((result["rows"], result["rejected"]), (2, 1))
+        self.assertEqual(self.query("SELECT Steps FROM hr_db ORDER BY rowid"), [(900,), (None,)])
+        self.assertEqual(
+            self.query(f"SELECT row_number, reason FROM {REJECT_TABLE}"),
+            [(3, "Column 'Steps': expected INTEGER, found 'many'")],
+        )
+
+    def test_integer_column_widened_for_real_values(self):
+        first = "Date,Heart_Rate\n2024-01-01,72\n2024-01-02,73\n"
+        self.load(first)
+        # Past the sampled rows, and in a later upload
+        with mock.patch.multiple(ingest, SCHEMA_SAMPLE_ROWS=1, CSV_INSERT_BATCH_SIZE=1):
+            result = self.load("Date,Heart_Rate\n2024-01-02,73\n2024-01-03,72.5\n2024-01-04,71\n")
+        self.assertEqual((result["rows"], result["duplicates"], result["rejected"]), (2, 1, 0))
+        self.assertEqual(self.schema()["Heart_Rate"], "REAL")
+        self.assertEqual(self.query("SELECT Heart_Rate FROM hr_db ORDER BY rowid"), [(72,), (73,), (72.5,), (71,)])
+        # Rows loaded before the column was widened are still recognised
+        self.assertEqual(self.load(first)["duplicates"], 2)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM hr_db"), [(4,)])
+
+    def test_date_columns_indexed_with_numeric_columns(self):
+        self.load("Date,Time,Heart_Rate,Note\n2024-01-01,7:50,97,ok\n")
+        self.assertEqual(
+            self.query("SELECT name FROM pragma_index_info('hr_db_Date_idx') ORDER BY seqno"),
+            [("Date",), ("Heart_Rate",)],
+        )
+        plan = self.query("EXPLAIN QUERY PLAN SELECT AVG(Heart_Rate) FROM hr_db WHERE Date >= '2024-01-01'")
+        self.assertIn("COVERING INDEX hr_db_Date_idx", plan[0][-1])
+
+    def test_rows_and_files_already_loaded_are_skipped(self):
+        text = "Date,Time,Heart_Rate\n2024-01-01,7:50,97\n2024-01-01,7:50,97\n2024-01-02,8:05,88\n"
+        first = self.load(text)
+        self.assertEqual((first["rows"], first["duplicates"]), (2, 1))
+
+        again = self.load(text)
+        self.assertEqual((again["rows"], again["duplicates"], again["skipped"]), (0, 3, False))
+        self.assertTrue(self.load(text, sha256=file_sha256(byte_chunks(text)))["skipped"])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM hr_db"), [(2,)])
+
+        # Same rows with the columns in another order
+        grown = self.load("Heart_Rate,Date,Time\n97,2024-01-01,7:50\n70,2024-01-03,9:00\n")
+        self.assertEqual((grown["rows"], grown["duplicates"]), (1, 1))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet_and_arrow_files_stored_like_csv(self):
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        table = pyarrow.table({
+            "Date": pyarrow.array([datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)]),
+            "Time": pyarrow.array([datetime.time(7, 50), datetime.time(8, 5)]),
+            "Heart_Rate": pyarrow.array([97, None], pyarrow.int32()),
+            "Taken_At": pyarrow.array([datetime.datetime(2024, 1, 1, 7, 50), datetime.datetime(2024, 1, 2, 8, 5)],
+                                      pyarrow.timestamp("ms")),
+            "Note": pyarrow.array(["ok", "rest"]),
+        })
+        parquet = io.BytesIO()
+        pyarrow.parquet.write_table(table, parquet)
+        result = ingest_arrow(parquet, self.db_path, "hr_db", "parquet")
+        self.assertEqual((result["rows"], result["rejected"]), (2, 0))
+        self.assertEqual(self.schema(), {
+            "Date": "DATE", "Time": "TIME", "Heart_Rate": "INTEGER", "Taken_At": "TIMESTAMP", "Note": "TEXT",
+        })
+        self.assertEqual(
+            self.query("SELECT Date, Time, Heart_Rate, Taken_At, Note FROM hr_db ORDER BY rowid"),
+            [("2024-01-01", "07:50:00", 97, 1704095400, "ok"), ("2024-01-02", "08:05:00", None, 1704182700, "rest")],
+        )
+
+        # The same rows as an Arrow IPC stream or as CSV are duplicates
+        stream = io.BytesIO()
+        with pyarrow.ipc.new_stream(stream, table.schema) as writer:
+            writer.write_table(table)
+        self.assertEqual(ingest_arrow(stream, self.db_path, "hr_db", "ipc")["duplicates"], 2)
+        csv_text = "Date,Time,Heart_Rate,Taken_At,Note\n2024-01-01,7:50,97,2024-01-01 07:50:00,ok\n"
+        self.assertEqual(self.load(csv_text)["duplicates"], 1)
+
+    def test_directory_and_zip_imported_in_parallel(self):
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        files = {
+            "hr_db.csv": "Date,Heart_Rate\n2024-01-01,97\n2024-01-02,88\n",
+            "2024/step_db.csv": "Date,Steps\n2024-01-01,900\n2024-01-02,x,y\n",
+            "2024/empty.csv": "",
+            ".hidden.csv": "Date,Steps\n2024-01-01,1\n",
+            "notes.txt": "not data",
+        }
+        for name, text in files.items():
+            os.makedirs(os.path.dirname(os.path.join(source, name)), exist_ok=True)
+            with open(os.path.join(source, name), "w") as f:
+                f.write(text)
+
+        results = import_files(source, self.db_path, processes=2)
+        self.assertEqual(
+            [(r["file"], r["table"], r["rows"], r["rejected"], r["skipped"], bool(r["error"])) for r in results],
+            [
+                ("2024/empty.csv", "empty", 0, 0, False, True),
+                ("2024/step_db.csv", "step_db", 1, 1, False, False),
+                ("hr_db.csv", "hr_db", 2, 0, False, False),
+            ],
+        )
+        self.assertEqual(self.query("SELECT Date, Heart_Rate FROM hr_db ORDER BY rowid"),
+                         [("2024-01-01", 97), ("2024-01-02", 88)])
+
+        # The same files in a zip archive were already loaded
+        archive = os.path.join(source, "export.zip")
+        with zipfile.ZipFile(archive, "w") as f:
+            f.writestr("hr_db.csv", files["hr_db.csv"])
+        self.assertEqual([(r["table"], r["skipped"]) for r in import_files(archive, self.db_path)], [("hr_db", True)])
+
+    def test_parsers_spawned_where_fork_is_unavailable(self):
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        with open(os.path.join(source, "hr_db.csv"), "w") as f:
+            f.write("Date,Heart_Rate\n2024-01-01,97\n")
+        with mock.patch.object(bulk_import.multiprocessing, "get_all_start_methods", return_value=["spawn"]), \
+                mock.patch.object(bulk_import.multiprocessing, "get_context",
+                                  wraps=bulk_import.multiprocessing.get_context) as get_context:
+            results = import_files(source, self.db_path, processes=2)
+        get_context.assert_called_once_with("spawn")
+        self.assertEqual([(r["table"], r["rows"], r["error"]) for r in results], [("hr_db", 1, None)])
+
+    def test_new_columns_added_to_an_existing_table(self):
+        self.load("Date,Time,Heart_Rate\n2024-01-01,7:50,97\n")
+        result = self.load("Date,Time,Heart_Rate,Resting\n2024-01-01,7:50,97,\n2024-01-02,8:05,88,58\n")
+        self.assertEqual((result["rows"], result["duplicates"]), (1, 1))
+        self.assertEqual(self.schema(), {"Date": "DATE", "Time": "TIME", "Heart_Rate": "INTEGER", "Resting": "INTEGER"})
+        self.assertEqual(
+            self.query("SELECT Date, Heart_Rate, Resting FROM hr_db ORDER BY rowid"),
+            [("2024-01-01", 97, None), ("2024-01-02", 88, 58)],
+        )
+
+    @unittest.skipIf(openpyxl is None, "openpyxl is not installed")
+    def test_workbook_sheets_loaded_into_a_table_each(self):
+        workbook = openpyxl.Workbook()
+        heart_rate = workbook.active
+        heart_rate.title = "Heart Rate"
+        heart_rate.append(["Date", "Heart_Rate", "Note"])
+        heart_rate.append([datetime.datetime(2024, 1, 1), 97, None])
+        heart_rate.append([datetime.datetime(2024, 1, 2), "=B2-9", "rest"])
+        heart_rate.append([])
+        heart_rate.append([datetime.datetime(2024, 1, 3), 70])
+        weight = workbook.create_sheet("Weight")
+        weight.append(["Taken_At", "Kg"])
+        weight.append([datetime.datetime(2024, 1, 1, 7, 30), 80.5])
+        workbook.create_sheet("Empty")
+        source = io.BytesIO()
+        workbook.save(source)
+
+        results = ingest_xlsx(source, self.db_path, "health")
+        self.assertEqual({table: result["rows"] for table, result in results.items()},
+                         {"health_heart_rate": 3, "health_weight": 1})
+        self.assertEqual(self.schema("health_heart_rate"), {"Date": "DATE", "Heart_Rate": "INTEGER", "Note": "TEXT"})
+        self.assertEqual(self.schema("health_weight"), {"Taken_At": "TIMESTAMP", "Kg": "REAL"})
+        # Formulas have no cached value in a workbook openpyxl wrote, so they read as empty
+        self.assertEqual(
+            self.query("SELECT Date, Heart_Rate, Note FROM health_heart_rate ORDER BY rowid"),
+            [("2024-01-01", 97, ""), ("2024-01-02", None, "rest"), ("2024-01-03", 70, "")],
+        )
+
+    def observations(self):
+        return self.query(
+            f"SELECT o.user_id, m.name, o.ts, o.value FROM {OBSERVATION_TABLE} o "
+            f"JOIN {METRIC_TABLE} m ON m.id = o.metric_id ORDER BY m.name, o.ts"
+        )
+
+    def test_numeric_columns_copied_into_observations(self):
+        text = "Date,Time,Heart_Rate,Steps,Note\n2024-01-01,7:50,97,,ok\n2024-01-02,,88,1200,rest\n"
+        self.load(text)
+        self.load(text)  # Duplicates add no observations
+        self.assertEqual(self.observations(), [
+            ("anonymous_user", "heart_rate", 1704095400, 97),
+            ("anonymous_user", "heart_rate", 1704153600, 88),
+            ("anonymous_user", "steps", 1704153600, 1200),
+        ])
+
+    def test_observations_written_for_the_uploader(self):
+        self.load("Date,Heart_Rate\n2024-01-01,97\n", user_id="alice")
+        self.load("Date,Heart_Rate\n2024-01-02,88\n", user_id="bob")
+        self.assertEqual(
+            [(user_id, value) for user_id, _, _, value in self.observations()], [("alice", 97), ("bob", 88)]
+        )
+
+    def test_columns_mapped_to_no_metric_write_no_observations(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                f'INSERT INTO {MAPPING_TABLE} (table_name, "column", metric_id, user_id) VALUES (?, ?, NULL, ?)',
+                ["hr_db", "Bench_Row", "alice"],
+            )
+        self.load("Date,Heart_Rate,Bench_Row\n2024-01-01,97,1\n")
+        self.assertEqual([metric for _, metric, _, _ in self.observations()], ["heart_rate"])
+
+    def test_changed_mappings_applied_by_a_rebuild(self):
+        self.load("Date,Heart_Rate,Steps\n2024-01-01,97,1200\n")
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(f"INSERT INTO {METRIC_TABLE} (name, unit) VALUES ('pulse', 'bpm')")
+            conn.execute(
+                f"UPDATE {MAPPING_TABLE} SET metric_id = (SELECT id FROM {METRIC_TABLE} WHERE name = 'pulse') "
+                f"WHERE \"column\" = 'Heart_Rate'"
+            )
+            conn.execute(f"UPDATE {MAPPING_TABLE} SET metric_id = NULL WHERE \"column\" = 'Steps'")
+        self.assertEqual(rebuild_observations(self.db_path), {"hr_db": 1})
+        self.assertEqual(self.observations(), [("anonymous_user", "pulse", 1704067200, 97)])
+
+    def test_invalid_rows_quarantined(self):
+        result = self.load(
+            "Date,Time,Heart_Rate\n"
+            "2024-01-01,7:50,97\n"
+            "2024-01-01,8:00,400\n"  # Out of range
+            "2999-01-01,8:00,80\n"  # In the future
+            "2024-01-01,7:50,75\n"  # Time already taken
+        )
+        self.assertEqual((result["rows"], result["quarantined"]), (1, 3))
+        quarantined = self.query(
+            f"SELECT row_number, reason FROM {QUARANTINE_TABLE} WHERE table_name = 'hr_db' ORDER BY row_number"
+        )
+        self.assertEqual([number for number, _ in quarantined], [2, 3, 4])
+        self.assertEqual(self.load("Date,Time,Heart_Rate\n2024-01-01,7:50,80\n")["quarantined"], 1)
+
+    def test_sleep_rows_keyed_by_date_and_sleep_start(self):
+        result = self.load(
+            "Date,Sleep_Start_Time,Wake_Up_Time,Total_Sleep_Hours\n"
+            "2024-01-01,22:00:00,06:00:00,8\n"
+            "2024-01-01,13:00:00,14:30:00,1.5\n"  # A nap the same day
+            "2024-01-01,22:00:00,07:00:00,9\n"  # Same night, other wake time
+            "2024-01-02,23:00:00,06:00:00,12\n",  # Hours do not match the times
+            "sleep_db",
+        )
+        self.assertEqual((result["rows"], result["quarantined"]), (2, 2))
+        self.assertEqual(
+            self.query(f"SELECT row_number FROM {QUARANTINE_TABLE} ORDER BY row_number"), [(3,), (4,)]
+        )
+
+    def test_new_table_deduplicated_before_its_row_hash_index_is_built(self):
+        rows = "".join(f"2024-01-{day % 7 + 1:02},{60 + day % 7}\n" for day in range(20))
+        with mock.patch.object(ingest, "CSV_INSERT_BATCH_SIZE", 3):
+            result = self.load("Date,Heart_Rate\n" + rows)
+        self.assertEqual((result["rows"], result["duplicates"]), (7, 13))
+        self.assertEqual(
+            self.query("SELECT name FROM pragma_index_info(?)", [f"hr_db_{ROW_HASH_COLUMN}_idx"]), [(ROW_HASH_COLUMN,)]
+        )
+
+        # Files loading into the same new table skip each other's rows
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        for name, text in (("a/step_db.csv", "Date,Steps\n2024-01-01,900\n2024-01-02,800\n"),
+                           ("b/step_db.csv", "Date,Steps\n2024-01-02,800\n2024-01-03,700\n")):
+            os.makedirs(os.path.join(source, os.path.dirname(name)))
+            with open(os.path.join(source, name), "w") as f:
+                f.write(text)
+        results = import_files(source, self.db_path, processes=2)
+        # Whichever file is parsed first gets the shared row
+        self.assertEqual(sorted((r["rows"], r["duplicates"]) for r in results), [(1, 1), (2, 0)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM step_db"), [(3,)])
+
+    @unittest.skipIf(openpyxl is None, "openpyxl is not installed")
+    def test_workbook_mapping_applied_to_each_sheet(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(f"INSERT INTO {METRIC_TABLE} (name, unit) VALUES ('pulse', 'bpm')")
+            conn.execute(
+                f'INSERT INTO {MAPPING_TABLE} (table_name, "column", metric_id, user_id) '
+                f"SELECT 'health', 'Heart_Rate', id, 'alice' FROM {METRIC_TABLE} WHERE name = 'pulse'"
+            )
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["Date", "Heart_Rate"])
+        workbook.active.append([datetime.datetime(2024, 1, 1), 97])
+        workbook.create_sheet("Rest").append(["Date", "Heart_Rate"])
+        workbook["Rest"].append([datetime.datetime(2024, 1, 2), 58])
+        source = io.BytesIO()
+        workbook.save(source)
+
+        ingest_xlsx(source, self.db_path, "health", user_id="alice")
+        self.assertEqual(
+            [(user_id, metric, value) for user_id, metric, _, value in self.observations()],
+            [("alice", "pulse", 97), ("alice", "pulse", 58)],
+        )
+        self.assertEqual(self.query(f"SELECT DISTINCT table_name FROM {MAPPING_TABLE} ORDER BY 1"),
+                         [("health_rest",), ("health_sheet",)])
+
+    def test_column_names_matched_regardless_of_case(self):
+        self.load("Date,Time,Heart_Rate\n2024-01-01,7:50,97\n")
+        self.assertEqual(self.load("date,TIME,heart_rate\n2024-01-01,7:50,97\n")["duplicates"], 1)
+        result = self.load("date,TIME,heart_rate,resting\n2024-01-02,8:05,88,58\n")
+        self.assertEqual((result["rows"], result["quarantined"]), (1, 0))
+        self.assertEqual(self.schema(), {"Date": "DATE", "Time": "TIME", "Heart_Rate": "INTEGER", "resting": "INTEGER"})
+        self.assertEqual(
+            self.query("SELECT Time, Heart_Rate FROM hr_db ORDER BY rowid"), [("07:50:00", 97), ("08:05:00", 88)]
+        )
+
+
+class GcPauseTests(SimpleTestCase):
+    def test_nested_and_overlapping_pauses_restore_the_collector_once(self):
+        self.assertTrue(gc.isenabled())
+        outer = upload_db._gc_paused()
+        outer.__enter__()
+        with upload_db._gc_paused():
+            self.assertFalse(gc.isenabled())
+        # The outer pause is still running
+        self.assertFalse(gc.isenabled())
+        outer.__exit__(None, None, None)
+        self.assertTrue(gc.isenabled())
+
+    def test_collector_disabled_elsewhere_left_disabled(self):
+        gc.disable()
+        self.addCleanup(gc.enable)
+        with upload_db._gc_paused():
+            pass
+        self.assertFalse(gc.isenabled())
+
+
+class ChunkedUploadTests(ScratchDatabaseMixin, TestCase):
+    """
+    Sends files through the chunked upload endpoints. Loads run in the test
+    thread (run_load) instead of the background loader.
+    """
+    data = ("Date,Heart_Rate\n" + "".join(f"2024-01-{day:02},{60 + day}\n" for day in range(1, 31))).encode()
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, CHUNKED_UPLOAD_STALL_TIMEOUT=0.2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.queue_load = chunked_upload.enqueue_load
+        patcher = mock.patch.object(chunked_upload, "enqueue_load")
+        self.enqueue_load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self, filename="hr_db.csv", size=None):
+        return self.client.post(reverse("upload_start"), {"filename": filename, "size": size or len(self.data)})
+
+    def send(self, upload_id, start, end):
+        return self.client.post(
+            reverse("upload_chunk", args=[upload_id]), self.data[start:end],
+            content_type="application/octet-stream", headers={"X-Upload-Offset": str(start)},
+        )
+
+    def run_load(self, upload_id):
+        chunked_upload._loads[upload_id] = {"arrived": threading.Event(), "processed": 0}
+        try:
+            with mock.patch.dict(settings.DATABASES["default"], NAME=self.db_path):
+                chunked_upload.run_load(upload_id)
+        finally:
+            chunked_upload._loads.pop(upload_id, None)
+        return self.client.get(reverse("upload_status", args=[upload_id])).json()
+
+    def test_chunks_appended_and_gaps_refused(self):
+        self.assertEqual(self.start("notes.txt").status_code, 400)
+        upload_id = self.start().json()["id"]
+
+        self.assertEqual(self.send(upload_id, 0, 100).json()["received"], 100)
+        self.enqueue_load.assert_called_once()
+        gap = self.send(upload_id, 150, 200)
+        self.assertEqual((gap.status_code, gap.json()["received"]), (409, 100))
+        # A resent chunk only adds the bytes not received yet
+        self.assertEqual(self.send(upload_id, 50, len(self.data)).json()["received"], len(self.data))
+
+        progress = self.run_load(upload_id)
+        self.assertEqual((progress["status"], progress["rows"], progress["processed"]), ("done", 30, len(self.data)))
+        self.assertFalse(os.path.exists(chunked_upload.part_path(ChunkedUpload.objects.get(upload_id=upload_id))))
+        self.assertEqual(self.send(upload_id, 0, 10).status_code, 409)
+
+    def test_stalled_load_resumed_by_the_next_chunk(self):
+        upload_id = self.start().json()["id"]
+        half = self.data.index(b"2024-01-16")
+        self.send(upload_id, 0, half)
+        with mock.patch.multiple(ingest, CSV_INSERT_BATCH_SIZE=5, SCHEMA_SAMPLE_ROWS=5):
+            progress = self.run_load(upload_id)
+        self.assertEqual(progress["status"], "failed")
+        self.assertIn("resume the upload", progress["error"])
+        self.assertEqual(progress["rows"], 15)
+        # Committed batch by batch: the rows read before the stall are kept
+        self.assertEqual(self.query("SELECT COUNT(*) FROM hr_db"), [(15,)])
+
+        self.send(upload_id, half, len(self.data))
+        self.assertEqual(self.enqueue_load.call_count, 2)
+        progress = self.run_load(upload_id)
+        # The rows committed by the failed attempt count as this upload's, not as duplicates
+        self.assertEqual((progress["status"], progress["rows"], progress["duplicates"]), ("done", 30, 0))
+        self.assertEqual(self.query("SELECT COUNT(*) FROM hr_db"), [(30,)])
+
+    def test_resumed_upload_reported_loading_while_queued(self):
+        upload_id = self.start().json()["id"]
+        self.send(upload_id, 0, len(self.data))
+        ChunkedUpload.objects.filter(upload_id=upload_id).update(status="failed", error="No data for a while")
+        self.addCleanup(chunked_upload._loads.pop, upload_id, None)
+        with mock.patch.object(chunked_upload.threading, "Thread") as thread:
+            self.queue_load(ChunkedUpload.objects.get(upload_id=upload_id))
+        self.assertEqual(thread.call_args.kwargs["args"], (upload_id,))
+        thread.return_value.start.assert_called_once()
+        progress = self.client.get(reverse("upload_status", args=[upload_id])).json()
+        self.assertEqual((progress["status"], progress["error"]), ("loading", ""))
+
+    def test_load_error_fails_the_upload(self):
+        upload_id = self.start().json()["id"]
+        self.send(upload_id, 0, len(self.data))
+        chunked_upload._loads[upload_id] = {"arrived": threading.Event(), "processed": 0}
+        with mock.patch.object(chunked_upload, "run_load", side_effect=OSError("Disk full")), \
+                self.assertLogs("stats.chunked_upload", "ERROR"):
+            chunked_upload._run_load_thread(upload_id)
+        self.assertNotIn(upload_id, chunked_upload._loads)
+        progress = self.client.get(reverse("upload_status", args=[upload_id])).json()
+        self.assertEqual((progress["status"], progress["error"]), ("failed", "Disk full"))
+
+    def test_load_waiting_for_chunks_lets_other_loads_run(self):
+        upload_id = self.start().json()["id"]
+        half = self.data.index(b"2024-01-16")
+        self.send(upload_id, 0, half)
+        upload = ChunkedUpload.objects.get(upload_id=upload_id)
+        load = {"arrived": threading.Event(), "processed": 0}
+
+        def other_load():
+            # Only gets the slot once the first load waits for its next chunk
+            with chunked_upload._slot:
+                with open(chunked_upload.part_path(upload), "ab") as f:
+                    f.write(self.data[half:])
+                load["arrived"].set()
+
+        other = threading.Thread(target=other_load)
+        with chunked_upload._slot:
+            chunks = chunked_upload._tail(upload, load, timeout=5)
+            self.assertEqual(next(chunks), self.data[:half])
+            other.start()
+            self.assertEqual(b"".join(chunks), self.data[half:])
+        other.join()
+
+    def test_failed_attempt_rejects_cleared_and_locks_dropped(self):
+        upload_id = self.start().json()["id"]
+        self.send(upload_id, 0, len(self.data))
+        self.assertEqual(chunked_upload._locks, {})
+        # Left behind by an earlier attempt
+        UploadReject.objects.create(table_name="hr_db", row_number=3, row="[]", reason="x", upload_id=upload_id)
+        UploadReject.objects.create(table_name="hr_db", row_number=3, row="[]", reason="x", upload_id="other")
+        self.assertEqual(self.run_load(upload_id)["status"], "done")
+        self.assertEqual(list(UploadReject.objects.values_list("upload_id", flat=True)), ["other"])
+
+
+class DashboardFigureTests(ScratchDatabaseMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch.dict(settings.DATABASES["default"], NAME=self.db_path),
+            mock.patch.dict(dash_apps._figure_cache, {"fingerprint": None, "figure": None}),
+            mock.patch.dict(dash_apps._fingerprint, {"db_path": None, "conn": None}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: dash_apps._fingerprint["conn"] and dash_apps._fingerprint["conn"].close())
+
+    def test_figure_rebuilt_only_when_chart_tables_change(self):
+        with mock.patch.object(dash_apps, "build_dashboard_figure", side_effect=lambda: object()) as build:
+            first = dash_apps.dashboard_figure()
+            self.assertIs(dash_apps.dashboard_figure(), first)
+
+            ingest_csv(byte_chunks("Date,Heart_Rate\n2024-01-01,97\n"), self.db_path, "hr_db")
+            second = dash_apps.dashboard_figure()
+            self.assertIsNot(second, first)
+            self.assertIs(dash_apps.dashboard_figure(), second)
+
+            # Rows written to a table the charts do not read
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("INSERT INTO stats_usersteps (user_id, date, steps) VALUES ('alice', '2024-01-01', 900)")
+            self.assertIs(dash_apps.dashboard_figure(), second)
+
+            ingest_csv(byte_chunks("Date,Heart_Rate\n2024-01-02,88\n"), self.db_path, "hr_db")
+            self.assertIsNot(dash_apps.dashboard_figure(), second)
+        self.assertEqual(build.call_count, 3)
+
+    def test_tables_not_uploaded_read_as_empty(self):
+        with self.assertNoLogs("stats.dash_apps"):
+            self.assertTrue(dash_apps.get_df_from_sql("hr_db").empty)
+
+    def test_figure_built_from_the_chart_tables(self):
+        text = "Date,Calories Consumed,Calories Burned\n2024-01-01,1800,400\n2024-01-01,600,150\n2024-01-02,2100,500\n"
+        ingest_csv(byte_chunks(text), self.db_path, "calorie_db")
+        traces = {trace.name: list(trace.y) for trace in dash_apps.dashboard_figure().data}
+        self.assertEqual((traces["Consumed"], traces["Burned"]), ([2400, 2100], [550, 500]))
+
+
+class AiContextTests(ScratchDatabaseMixin, TestCase):
+    def test_only_health_data_sent_to_the_model(self):
+        ingest_csv(byte_chunks("Date,Heart_Rate\n2024-01-01,97\n"), self.db_path, "hr_db")
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO stats_fitcredential (user_id, token, refresh_token, token_uri, client_id, client_secret, "
+                "scopes, updated_at) VALUES ('alice', 'access', 'refresh', 'uri', 'client', 'hunter2', '', '2024-01-01')"
+            )
+            conn.execute("INSERT INTO stats_usersteps (user_id, date, steps) VALUES ('alice', '2024-01-01', 900)")
+        with mock.patch.dict(settings.DATABASES["default"], NAME=self.db_path):
+            context = views.fetch_db_context()
+        tables = [line.split(": ")[1] for line in context.splitlines() if line.startswith("TABLE: ")]
+        self.assertEqual(
+            sorted(tables),
+            ["hr_db", "stats_fitdatapoint", "stats_usercalories", "stats_userhr", "stats_usersleep", "stats_usersteps"],
+        )
+        self.assertNotIn("hunter2", context)
+        self.assertIn("Columns: Date, Heart_Rate", context)
+        # The dashboard's table list shows the same tables
+        with mock.patch.dict(settings.DATABASES["default"], NAME=self.db_path):
+            counts = dict(views.list_tables_and_counts())
+        self.assertEqual(sorted(counts), sorted(tables))
+        self.assertEqual((counts["hr_db"], counts["stats_usersteps"]), (1, 1))
@@ -0,0 +1,90 @@
+# FILE: stats/upload_db.py
+
+import contextlib
+import gc
+import sqlite3
+import threading
+
+
+SCHEMA_TABLE = "stats_uploadcolumn"  # UploadColumn
+
+# Per-connection settings for the bulk load: a larger page cache so the
+# growing table is not spilled to disk mid-transaction, and temp b-trees
+# in memory. Journaling is left alone, so an interrupted load still rolls back.
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA cache_size = -65536",  # 64 MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+_gc_pauses = 0
+_gc_was_enabled = True
+_gc_lock = threading.Lock()
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _table_exists(cursor, table_name, schema="main"):
+    return cursor.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", [table_name]
+    ).fetchone() is not None
+
+
+def load_schema(cursor, table_name):
+    """
+    Stored {column name: type} of an uploaded table, or None if the table
+    does not exist. Tables created before types were recorded read as TEXT.
+    """
+    if not _table_exists(cursor, table_name):
+        return None
+    return dict(cursor.execute(
+        f"SELECT name, sql_type FROM {SCHEMA_TABLE} WHERE table_name = ? ORDER BY position", [table_name]
+    ).fetchall())
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    Disables the cyclic garbage collector during a bulk load. Nested and
+    concurrent loads share the pause; the last one out restores it.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
+
+@contextlib.contextmanager
+def _bulk_load(db_path, pause_gc=True):
+    """
+    Cursor for one upload, in one transaction with the bulk-load PRAGMAs.
+    Commits if the block succeeds, else rolls back and re-raises.
+    """
+    # Transactions are managed explicitly
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        for pragma in BULK_LOAD_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.execute("BEGIN")
+        with _gc_paused() if pause_gc else contextlib.nullcontext():
+            yield cursor
+        cursor.execute("COMMIT")
+        # Refreshes planner statistics for the tables and indexes that changed
+        cursor.execute("PRAGMA optimize")
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -5,12 +5,16 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('upload-secret/', views.upload_secret, name='upload_secret'),
     path('oauth2callback/', views.oauth2callback, name='oauth2callback'),
+    path('sync-status/', views.sync_status, name='sync_status'),
     path('set-api-key/', views.set_api_key, name='set_api_key'),
     path('get-ai-response/', views.get_ai_response, name='get_ai_response'),
 
     # CSV and DB actions
     path('upload-csv-create-table/', views.upload_csv_create_table, name='upload_csv_create_table'),
     path('drop-all-tables/', views.drop_all_tables, name='drop_all_tables'),
+    path('uploads/', views.upload_start, name='upload_start'),
+    path('uploads/<str:upload_id>/', views.upload_status, name='upload_status'),
+    path('uploads/<str:upload_id>/chunk/', views.upload_chunk, name='upload_chunk'),
 
     # Manual data
     path('add-manual-data/', views.add_manual_data, name='add_manual_data'),
@@ -0,0 +1,175 @@
+# FILE: stats/validation.py
+
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Metric -> (lowest, highest) plausible value, inclusive. Columns are matched
+# by the metric they map to (MetricMapping, or the default named after them).
+METRIC_RANGES = {
+    "heart_rate": (20, 250),  # bpm
+    "step_counts": (0, 100000),  # per record
+    "steps": (0, 100000),
+    "total_sleep_hours": (0, 24),
+    "sleep_hours": (0, 24),
+    "sleep_minutes": (0, 1440),
+    "calories_consumed": (0, 20000),  # kcal
+    "calories_burned": (0, 20000),
+    "calories": (0, 20000),
+    "number_of_cigarettes": (0, 200),
+    "wbc": (0.1, 100),  # 10^9/L
+    "rbc": (0.5, 10),  # 10^12/L
+    "hemoglobin": (2, 25),  # g/dL
+    "platelets": (1, 2000),  # 10^9/L
+    "glucose": (10, 1000),  # mg/dL
+    "cholesterol": (30, 1000),  # mg/dL
+    "creatinine": (0.05, 25),  # mg/dL
+    "weight": (1, 500),  # kg
+}
+EARLIEST_DATE = datetime.date(1900, 1, 1)
+SLEEP_TOLERANCE_HOURS = 0.5  # Allowed gap between a night's hours and its start and wake times
+
+DATE_NAME = re.compile(r"(^|[ _])date($|[ _])", re.IGNORECASE)
+SLEEP_START_NAME = re.compile(r"(sleep.*start|bed.*time)", re.IGNORECASE)
+WAKE_NAME = re.compile(r"wake", re.IGNORECASE)
+SLEEP_HOURS_METRICS = ("total_sleep_hours", "sleep_hours")
+
+
+def plan_checks(names, types, metrics):
+    """
+    The checks for rows with columns names of the stored types, as a dict
+    for check_rows. metrics gives the metric of each numeric column.
+
+    - ranges: numeric columns whose metric has a METRIC_RANGES entry;
+    - dates: DATE and TIMESTAMP columns, which must lie between
+      EARLIEST_DATE and tomorrow, and text columns named like a date, which
+      must hold ISO dates;
+    - sleep: hours slept, sleep start and wake time columns, which must agree;
+    - key: how to compute a row's time (check_rows returns them, for the
+      caller to find rows at a time already taken): a timestamp column, a
+      date and a "Time" column, or the date and sleep start time of a
+      night's sleep (a date can hold more than one). Tables with dates only
+      (several meals a day) have no key.
+    """
+    index = {name: position for position, name in enumerate(names)}
+    plan = {"ranges": [], "dates": [], "text_dates": [], "sleep": None, "key": None}
+    for position, (name, sql_type) in enumerate(zip(names, types)):
+        if sql_type in ("INTEGER", "REAL") and metrics.get(name) in METRIC_RANGES:
+            plan["ranges"].append((position, name, METRIC_RANGES[metrics[name]]))
+        elif sql_type in ("DATE", "TIMESTAMP"):
+            plan["dates"].append((position, name, sql_type))
+        elif sql_type == "TEXT" and DATE_NAME.search(name):
+            plan["text_dates"].append((position, name))
+
+    def first(condition):
+        return next((name for name, sql_type in zip(names, types) if condition(name, sql_type)), None)
+
+    hours = first(lambda name, sql_type: sql_type in ("INTEGER", "REAL") and metrics.get(name) in SLEEP_HOURS_METRICS)
+    start = first(lambda name, sql_type: sql_type == "TIME" and SLEEP_START_NAME.search(name))
+    wake = first(lambda name, sql_type: sql_type == "TIME" and WAKE_NAME.search(name))
+    if hours and start and wake:
+        plan["sleep"] = (index[hours], index[start], index[wake])
+
+    timestamp = first(lambda name, sql_type: sql_type == "TIMESTAMP")
+    date = first(lambda name, sql_type: sql_type == "DATE")
+    time = first(lambda name, sql_type: sql_type == "TIME" and name.lower() == "time")
+    if timestamp:
+        plan["key"] = ("timestamp", index[timestamp], None)
+    elif date and time:
+        plan["key"] = ("datetime", index[date], index[time])
+    elif date and hours and start:
+        plan["key"] = ("datetime", index[date], index[start])
+    return plan
+
+
+def has_checks(plan):
+    return bool(plan["ranges"] or plan["dates"] or plan["text_dates"] or plan["sleep"] or plan["key"])
+
+
+def _seconds_of_day(values):
+    # "HH:MM:SS[.ffffff]" -> seconds as floats, NaN if missing
+    if None not in values and set(map(len, values)) == {8}:
+        # All HH:MM:SS: read the digits straight from the characters
+        digits = np.array(values, dtype="<U8").view(np.uint32).reshape(-1, 8).astype(np.int64) - ord("0")
+        return ((digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 3] * 10 + digits[:, 4]) * 60
+                + digits[:, 6] * 10 + digits[:, 7]).astype(float)
+    return pd.to_timedelta(pd.Series(values, dtype=object), errors="coerce").dt.total_seconds().to_numpy()
+
+
+def _epoch_seconds(day):
+    return datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc).timestamp()
+
+
+def _flag(bad, mask, reason):
+    for row_index in np.flatnonzero(mask):
+        bad.setdefault(int(row_index), reason)
+
+
+def check_rows(plan, rows):
+    """
+    Runs the checks of plan (see plan_checks) over a batch of converted
+    rows, column by column with NumPy and pandas.
+    Returns ({row index: reason} for rows failing a check, the rows' times
+    as epoch seconds in a float array, NaN for rows without one, or None if
+    the plan has no key).
+    """
+    bad = {}
+    if not rows:
+        return bad, None
+    columns = list(zip(*rows))
+
+    for position, name, (low, high) in plan["ranges"]:
+        values = np.array(columns[position], dtype=float)  # None -> NaN, which passes
+        outside = (values < low) | (values > high)
+        _flag(bad, outside, f"Column {name!r}: outside the plausible range {low}-{high}")
+
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    for position, name, sql_type in plan["dates"]:
+        # Compared as ISO strings and epoch seconds: pandas timestamps end in 2262
+        if sql_type == "DATE":
+            # Usually every date is in range: two C-level passes tell
+            if None not in columns[position] and (EARLIEST_DATE.isoformat() <= min(columns[position])
+                                                  and max(columns[position]) < tomorrow.isoformat()):
+                continue
+            values = pd.Series(columns[position], dtype=object)
+            given = values.notna().to_numpy()
+            values = values.fillna("").to_numpy(dtype=str)
+            outside = given & ((values < EARLIEST_DATE.isoformat()) | (values >= tomorrow.isoformat()))
+        else:
+            values = np.array(columns[position], dtype=float)
+            outside = (values < _epoch_seconds(EARLIEST_DATE)) | (values >= _epoch_seconds(tomorrow))
+        _flag(bad, outside, f"Column {name!r}: date before {EARLIEST_DATE} or in the future")
+
+    for position, name in plan["text_dates"]:
+        values = pd.Series(columns[position], dtype=object)
+        given = values.notna() & (values != "")
+        parsed = pd.to_datetime(values.where(given), format="%Y-%m-%d", errors="coerce")
+        _flag(bad, (given & parsed.isna()).to_numpy(), f"Column {name!r}: not a date (YYYY-MM-DD)")
+
+    if plan["sleep"]:
+        hours, start, wake = plan["sleep"]
+        slept = np.array(columns[hours], dtype=float)
+        # Wake time minus sleep start, across midnight
+        between = np.mod(_seconds_of_day(columns[wake]) - _seconds_of_day(columns[start]), 86400) / 3600
+        inconsistent = np.abs(slept - between) > SLEEP_TOLERANCE_HOURS
+        _flag(bad, inconsistent, f"Sleep hours do not match the time from sleep start to wake-up "
+                                 f"(more than {SLEEP_TOLERANCE_HOURS} h apart)")
+
+    keys = None
+    if plan["key"]:
+        kind, first, second = plan["key"]
+        if kind == "timestamp":
+            times = pd.Series(columns[first], dtype=float)
+        else:
+            moments = pd.Series(columns[first], dtype=object).fillna("")
+            if kind == "datetime":
+                moments = moments + " " + pd.Series(columns[second], dtype=object).fillna("00:00:00")
+            moments = pd.to_datetime(moments, format="ISO8601", errors="coerce")
+            # In the datetimes' own unit, which depends on the pandas version; NaT -> NaN
+            unit = moments.dt.unit
+            times = (moments - pd.Timestamp(0).as_unit(unit)) // pd.Timedelta(1, "s").as_unit(unit)
+        keys = times.to_numpy(dtype=float)
+    return bad, keys
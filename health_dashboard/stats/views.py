@@ -6,15 +6,26 @@ from django.contrib import messages
 from django.http import JsonResponse, HttpResponse
 from google_auth_oauthlib.flow import Flow
 from django.db.utils import OperationalError
-from .models import UserSteps, ManualData, UserHR, UserCalories, UserSleep
+from .models import UserSteps, UserHR, UserCalories, UserSleep, FitDataPoint, ManualData, SyncJob, ChunkedUpload, Metric, MetricMapping
+from . import http_client
+from .sync_worker import enqueue_sync, job_progress
+from .chunked_upload import (
+    DEFAULT_CHUNK_SIZE, READ_SIZE, UploadConflict, start_upload, upload_progress, write_chunk,
+)
+from .fit_credentials import save_credentials
+from .dedup import ROW_HASH_COLUMN, file_sha256
+from .ingest import ingest_csv, table_name_from_filename
+from .observations import OBSERVATION_TABLE
+from .readers import ARROW_FORMATS, XLSX_EXTENSIONS, ingest_arrow, ingest_xlsx
 import os
-import time
-import requests
 import pandas as pd
 import json
 import csv
 import sqlite3
 import datetime
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Constants
 SCOPES = [
@@ -25,6 +36,7 @@ SCOPES = [
 API_KEY_FILE = os.path.join(settings.MEDIA_ROOT, "api_key.txt")
 SITE_URL = "http://localhost:8000"
 APP_NAME = "Health Dashboard"
+DEFAULT_OPENROUTER_TIMEOUT = (5, 180)  # (connect, read) seconds; a completion can take minutes
 
 
 def home(request):
@@ -70,11 +82,13 @@ def upload_secret(request):
                 scopes=SCOPES,
                 redirect_uri="http://localhost:8000/oauth2callback",
             )
+            # offline access + consent so Google issues a refresh token for unattended syncs
             authorization_url, state = flow.authorization_url(
-                access_type="offline", include_granted_scopes="true"
+                access_type="offline", include_granted_scopes="true", prompt="consent"
             )
             request.session["oauth_state"] = state
             request.session["temp_secret_path"] = temp_secret_path
+            request.session["backfill_start"] = request.POST.get("backfill_start", "").strip()
 
             return redirect(authorization_url)
         except Exception as e:
@@ -88,6 +102,7 @@ def upload_secret(request):
 def oauth2callback(request):
     temp_secret_path = request.session.pop("temp_secret_path", None)
     state = request.session.pop("oauth_state", None)
+    backfill_start = request.session.pop("backfill_start", "")
 
     if not temp_secret_path:
         messages.error(request, "Temporary client secret file not found.")
@@ -103,8 +118,9 @@ def oauth2callback(request):
         credentials = flow.credentials
 
         user_id = request.session.session_key or "anonymous_user"
-        fetch_all_fit_data(credentials, user_id)
-        messages.success(request, "Data fetched (steps, HR, calories, sleep) and saved successfully!")
+        save_credentials(user_id, credentials)
+        enqueue_sync(user_id, backfill_start)
+        messages.success(request, "Google Fit sync started (steps, HR, calories, sleep). Progress is shown below.")
     except Exception as e:
         messages.error(request, f"Error during OAuth callback: {e}")
     finally:
@@ -114,131 +130,16 @@ def oauth2callback(request):
     return redirect("home")
 
 
-def fetch_all_fit_data(credentials, user_id):
+def sync_status(request):
     """
-    Fetch Steps, HR, Calories, and Sleep from Google Fit in daily buckets
-    for a hard-coded date range. Extend or modify as needed.
+    Returns the progress of the latest Google Fit sync job for this user as JSON.
+    Polled by the dashboard while a sync is queued or running.
     """
-    start_time_str = "2024-11-01"
-    end_time_str = "2024-11-16"
-
-    start_time_millis = int(time.mktime(time.strptime(start_time_str, "%Y-%m-%d")) * 1000)
-    end_time_millis = int(time.mktime(time.strptime(end_time_str, "%Y-%m-%d")) * 1000)
-
-    def aggregate_fitness_data(data_type_name, data_source_id):
-        url = "https://www.googleapis.com/fitness/v1/users/me/dataset:aggregate"
-        headers = {"Authorization": f"Bearer {credentials.token}"}
-        body = {
-            "aggregateBy": [
-                {
-                    "dataTypeName": data_type_name,
-                    "dataSourceId": data_source_id,
-                }
-            ],
-            "bucketByTime": {"durationMillis": 86400000},  # 1 day
-            "startTimeMillis": start_time_millis,
-            "endTimeMillis": end_time_millis,
-        }
-        response = requests.post(url, headers=headers, json=body)
-        if response.status_code != 200:
-            raise Exception(f"Error fetching {data_type_name}: {response.status_code} - {response.text}")
-        return response.json()
-
-    # 1) Steps
-    steps_data = aggregate_fitness_data(
-        "com.google.step_count.delta",
-        "derived:com.google.step_count.delta:com.google.android.gms:merge_step_deltas"
-    )
-    existing_step_dates = set(
-        UserSteps.objects.filter(user_id=user_id).values_list("date", flat=True)
-    )
-    steps_to_create = []
-    for bucket in steps_data.get("bucket", []):
-        start_time = int(bucket["startTimeMillis"]) // 1000
-        date = time.strftime("%Y-%m-%d", time.gmtime(start_time))
-        steps = sum(
-            point["value"][0]["intVal"]
-            for dataset in bucket.get("dataset", [])
-            for point in dataset.get("point", [])
-        )
-        if date not in existing_step_dates:
-            steps_to_create.append(UserSteps(user_id=user_id, date=date, steps=steps))
-    UserSteps.objects.bulk_create(steps_to_create, ignore_conflicts=True)
-
-    # 2) Heart Rate
-    hr_data = aggregate_fitness_data(
-        "com.google.heart_rate.bpm",
-        "derived:com.google.heart_rate.bpm:com.google.android.gms:merge_heart_rate_bpm"
-    )
-    existing_hr_dates = set(
-        UserHR.objects.filter(user_id=user_id).values_list("date", flat=True)
-    )
-    hr_to_create = []
-    for bucket in hr_data.get("bucket", []):
-        start_time = int(bucket["startTimeMillis"]) // 1000
-        date = time.strftime("%Y-%m-%d", time.gmtime(start_time))
-
-        hr_values = []
-        for dataset in bucket.get("dataset", []):
-            for point in dataset.get("point", []):
-                hr_values.append(point["value"][0]["fpVal"])
-        if hr_values:
-            avg_hr = sum(hr_values) / len(hr_values)
-        else:
-            avg_hr = 0.0
-
-        if date not in existing_hr_dates:
-            hr_to_create.append(UserHR(user_id=user_id, date=date, average_hr=avg_hr))
-    UserHR.objects.bulk_create(hr_to_create, ignore_conflicts=True)
-
-    # 3) Calories
-    cal_data = aggregate_fitness_data(
-        "com.google.calories.expended",
-        "derived:com.google.calories.expended:com.google.android.gms:merge_calories_expended"
-    )
-    existing_cal_dates = set(
-        UserCalories.objects.filter(user_id=user_id).values_list("date", flat=True)
-    )
-    cal_to_create = []
-    for bucket in cal_data.get("bucket", []):
-        start_time = int(bucket["startTimeMillis"]) // 1000
-        date = time.strftime("%Y-%m-%d", time.gmtime(start_time))
-
-        total_cal = 0.0
-        for dataset in bucket.get("dataset", []):
-            for point in dataset.get("point", []):
-                total_cal += point["value"][0]["fpVal"]
-        if date not in existing_cal_dates:
-            cal_to_create.append(UserCalories(user_id=user_id, date=date, calories=total_cal))
-    UserCalories.objects.bulk_create(cal_to_create, ignore_conflicts=True)
-
-    # 4) Sleep
-    sleep_data = aggregate_fitness_data(
-        "com.google.sleep.segment",
-        "derived:com.google.sleep.segment:com.google.android.gms:merged"
-    )
-    existing_sleep_dates = set(
-        UserSleep.objects.filter(user_id=user_id).values_list("date", flat=True)
-    )
-    sleep_to_create = []
-    for bucket in sleep_data.get("bucket", []):
-        start_time = int(bucket["startTimeMillis"]) // 1000
-        date = time.strftime("%Y-%m-%d", time.gmtime(start_time))
-        total_sleep_mins = 0
-
-        for dataset in bucket.get("dataset", []):
-            for point in dataset.get("point", []):
-                seg_start = point["startTimeNanos"]
-                seg_end = point["endTimeNanos"]
-                duration_sec = (int(seg_end) - int(seg_start)) / 1e9
-                # Real logic might skip awake segments, but let's sum everything for simplicity
-                total_sleep_mins += duration_sec / 60.0
-
-        if date not in existing_sleep_dates:
-            sleep_to_create.append(
-                UserSleep(user_id=user_id, date=date, sleep_minutes=int(total_sleep_mins))
-            )
-    UserSleep.objects.bulk_create(sleep_to_create, ignore_conflicts=True)
+    user_id = request.session.session_key or "anonymous_user"
+    job = SyncJob.objects.filter(user_id=user_id).order_by("-id").first()
+    if job is None:
+        return JsonResponse({"status": "none"})
+    return JsonResponse(job_progress(job))
 
 
 def set_api_key(request):
@@ -290,7 +191,12 @@ def get_ai_response(request):
                 "model": "openai/gpt-4o-mini",
                 "messages": [{"role": "user", "content": full_prompt}],
             }
-            response = requests.post(openrouter_url, headers=headers, data=json.dumps(payload))
+            # Each completion is billed: only retried when OpenRouter cannot have
+            # run it, and given time to finish generating
+            response = http_client.post(
+                openrouter_url, headers=headers, data=json.dumps(payload), idempotent=False,
+                timeout=getattr(settings, "OPENROUTER_TIMEOUT", DEFAULT_OPENROUTER_TIMEOUT),
+            )
             
             # Include additional debug log for API response
             # print(f"OpenRouter API Status: {response.status_code}")
@@ -311,16 +217,43 @@ def get_ai_response(request):
             return JsonResponse({"error": f"Could not connect to OpenRouter: {str(e)}"}, status=500)
 
 
+# Health data kept in model tables; every other stats_* table is bookkeeping
+# (sync state, upload logs) or secret (FitCredential), neither listed on the
+# dashboard nor sent to the LLM
+HEALTH_MODEL_TABLES = (
+    UserSteps._meta.db_table,
+    UserHR._meta.db_table,
+    UserCalories._meta.db_table,
+    UserSleep._meta.db_table,
+    FitDataPoint._meta.db_table,
+)
+
+
+def health_data_tables(cursor):
+    """
+    Names of the health data tables: uploaded tables, manual data and the
+    synced daily metrics. The observation store is left out too, as a copy
+    of the uploaded tables' values.
+    """
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' "
+        "AND name NOT LIKE 'django_%' AND name NOT LIKE 'auth_%' AND name NOT LIKE 'sqlite_%' "
+        f"AND name != '{OBSERVATION_TABLE}' "
+        f"AND (name NOT LIKE 'stats_%' OR name IN ({', '.join('?' for _ in HEALTH_MODEL_TABLES)}));",
+        HEALTH_MODEL_TABLES,
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
 def fetch_db_context():
     """
-    Reads all table names (except for django_*) from the SQLite database,
-    grabs up to a few rows from each to give a sense of the data to the LLM.
+    Reads the names of the health data tables (see health_data_tables) from
+    the SQLite database, and grabs up to a few rows from each to give a
+    sense of the data to the LLM.
     """
     conn = sqlite3.connect(settings.DATABASES['default']['NAME'])
     cursor = conn.cursor()
-
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'django_%';")
-    tables = [row[0] for row in cursor.fetchall()]
+    tables = health_data_tables(cursor)
 
     context_lines = []
     for tbl in tables:
@@ -329,9 +262,11 @@ def fetch_db_context():
             cursor.execute(f"SELECT * FROM {tbl} LIMIT 1000;")
             rows = cursor.fetchall()
             col_names = [desc[0] for desc in cursor.description]
-            context_lines.append(f"Columns: {', '.join(col_names)}")
+            # Upload bookkeeping, meaningless to the LLM
+            keep = [i for i, name in enumerate(col_names) if name != ROW_HASH_COLUMN]
+            context_lines.append(f"Columns: {', '.join(col_names[i] for i in keep)}")
             for row in rows:
-                context_lines.append(f"Row: {row}")
+                context_lines.append(f"Row: {tuple(row[i] for i in keep)}")
         except Exception as e:
             context_lines.append(f"Error reading table {tbl}: {e}")
         context_lines.append("")
@@ -340,67 +275,170 @@ def fetch_db_context():
     return "\n".join(context_lines)
 
 
+def upload_messages(request, table_name, result):
+    """
+    Reports the outcome of loading a file (or sheet) into table_name.
+    """
+    if result["skipped"]:
+        messages.info(request, f"This file was already uploaded to table '{table_name}'; nothing was added.")
+        return
+
+    messages.success(request, f"File uploaded and table '{table_name}' created/updated ({result['rows']} rows).")
+    if result["duplicates"]:
+        messages.info(request, f"{result['duplicates']} rows were already in the table and were skipped.")
+    if result["rejected"]:
+        messages.warning(
+            request,
+            f"{result['rejected']} rows could not be inserted; see the stats_uploadreject table for the reasons.",
+        )
+    if result["quarantined"]:
+        messages.warning(
+            request,
+            f"{result['quarantined']} rows failed validation; see the stats_uploadquarantine table for the reasons.",
+        )
+
+
+def save_metric_mapping(table_name, spec, user_id):
+    """
+    Stores which metric each numeric column of table_name goes to in the
+    Observation store, from "Column=metric, Other_Column=other_metric" as
+    typed in the upload form. "Column=" leaves the column out. Columns not
+    named keep their mapping, or get the default one (see stats.observations).
+    Raises ValueError for a malformed entry.
+    """
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        column, separator, metric = (part.strip() for part in entry.partition("="))
+        if not separator or not column:
+            raise ValueError(f"Metric mapping entries look like Column=metric, not {entry!r}.")
+        MetricMapping.objects.update_or_create(
+            table_name=table_name, column=column,
+            defaults={"metric": Metric.objects.get_or_create(name=metric)[0] if metric else None, "user_id": user_id},
+        )
+
+
 def upload_csv_create_table(request):
     if request.method == "POST" and request.FILES.get('csv_file'):
         csv_file = request.FILES['csv_file']
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Only CSV files are allowed.')
+        extension = os.path.splitext(csv_file.name)[1].lower()
+        if extension != '.csv' and extension not in ARROW_FORMATS and extension not in XLSX_EXTENSIONS:
+            messages.error(request, 'Only CSV, Parquet, Arrow (.arrow, .feather) and Excel (.xlsx) files are allowed.')
             return redirect('home')
 
-        # Sanitize the table name
-        table_name = os.path.splitext(csv_file.name)[0]
-        table_name = "".join(x for x in table_name if x.isalnum() or x == '_').lower()
-
-        file_data = csv_file.read().decode('utf-8').splitlines()
-        reader = csv.reader(file_data)
-        rows = list(reader)
-        if not rows:
-            messages.error(request, 'CSV file is empty.')
+        table_name = table_name_from_filename(csv_file.name)
+        user_id = request.session.session_key or "anonymous_user"
+        try:
+            save_metric_mapping(table_name, request.POST.get("metrics", ""), user_id)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('home')
+        try:
+            # Hashed first, so a file that was already loaded is not parsed again
+            sha256 = file_sha256(csv_file.chunks())
+            if extension in XLSX_EXTENSIONS:
+                # Streamed sheet by sheet, a table per sheet
+                results = ingest_xlsx(csv_file, settings.DATABASES['default']['NAME'], table_name, sha256=sha256,
+                                      user_id=user_id)
+            elif extension in ARROW_FORMATS:
+                # Read record batch by record batch, with the column types from the file
+                results = {table_name: ingest_arrow(csv_file, settings.DATABASES['default']['NAME'], table_name,
+                                                    ARROW_FORMATS[extension], sha256=sha256, user_id=user_id)}
+            else:
+                # Streamed chunk by chunk, so memory use does not depend on the file size
+                results = {table_name: ingest_csv(csv_file.chunks(), settings.DATABASES['default']['NAME'], table_name,
+                                                  sha256=sha256, user_id=user_id)}
+        except (sqlite3.Error, csv.Error, UnicodeDecodeError) as e:
+            logger.warning("Error inserting data into %s: %s", table_name, e)
+            messages.error(request, f"Error inserting data: {e}")
+            return redirect('home')
+        except ValueError as e:
+            messages.error(request, str(e))
             return redirect('home')
 
-        headers = rows[0]
-        data_rows = rows[1:]
+        if not results:
+            messages.error(request, "The workbook has no sheet with a header row.")
+        for table_name, result in results.items():
+            upload_messages(request, table_name, result)
+        return redirect('home')
 
-        # Sanitize column names
-        sanitized_headers = [f'"{h.strip()}"' for h in headers]
+    return redirect('home')
 
-        conn = sqlite3.connect(settings.DATABASES['default']['NAME'])
-        cursor = conn.cursor()
 
-        # Create table with sanitized column names
-        columns_def = ", ".join([f'{col} TEXT' for col in sanitized_headers])
-        create_stmt = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({columns_def});'
-        cursor.execute(create_stmt)
-
-        # Insert data into the table
-        placeholders = ", ".join(["?"] * len(headers))
-        insert_stmt = f'INSERT INTO "{table_name}" ({", ".join(sanitized_headers)}) VALUES ({placeholders})'
-        for row_data in data_rows:
-            try:
-                cursor.execute(insert_stmt, row_data)
-            except sqlite3.OperationalError as e:
-                print(f"Error inserting row {row_data}: {e}")
-                messages.error(request, f"Error inserting data: {e}")
-                conn.rollback()
-                break
+def _request_chunks(request):
+    # Read in pieces rather than through request.body, which holds the whole
+    # chunk in memory and is capped by DATA_UPLOAD_MAX_MEMORY_SIZE
+    return iter(lambda: request.read(READ_SIZE), b"")
 
-        conn.commit()
-        conn.close()
 
-        messages.success(request, f"CSV uploaded and table '{table_name}' created/updated.")
-        return redirect('home')
+def _user_upload(request, upload_id):
+    user_id = request.session.session_key or "anonymous_user"
+    return ChunkedUpload.objects.filter(upload_id=upload_id, user_id=user_id).first()
+
+
+def upload_start(request):
+    """
+    Starts a chunked upload, for files too large to send in one request.
+    Takes the file's name and size in bytes; returns the upload id and the
+    chunk size to send the file in.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required."}, status=405)
+    try:
+        size = int(request.POST.get("size", ""))
+    except ValueError:
+        return JsonResponse({"error": "The file size is missing."}, status=400)
+    user_id = request.session.session_key or "anonymous_user"
+    try:
+        upload = start_upload(user_id, request.POST.get("filename", ""), size)
+        save_metric_mapping(upload.table_name, request.POST.get("metrics", ""), user_id)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    progress = upload_progress(upload)
+    progress["chunk_size"] = getattr(settings, "CHUNKED_UPLOAD_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    return JsonResponse(progress)
+
+
+def upload_chunk(request, upload_id):
+    """
+    Appends the request body to a chunked upload, at the byte offset given
+    in the X-Upload-Offset header. Answers 409 with the bytes received so far
+    when the offset does not continue them, so the client can resume there.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required."}, status=405)
+    upload = _user_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({"error": "Unknown upload."}, status=404)
+    try:
+        offset = int(request.headers.get("X-Upload-Offset", request.GET.get("offset", "")))
+    except ValueError:
+        return JsonResponse({"error": "The X-Upload-Offset header is missing."}, status=400)
+    try:
+        write_chunk(upload, offset, _request_chunks(request))
+    except UploadConflict as e:
+        return JsonResponse({"error": str(e), "received": e.received}, status=409)
+    upload.refresh_from_db()
+    return JsonResponse(upload_progress(upload))
+
+
+def upload_status(request, upload_id):
+    """
+    Returns the progress of a chunked upload as JSON: bytes received and
+    loaded, and the row counts once done. Polled by the dashboard, and used
+    to find where to resume an interrupted upload.
+    """
+    upload = _user_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({"error": "Unknown upload."}, status=404)
+    return JsonResponse(upload_progress(upload))
 
-    return redirect('home')
 
 def list_tables_and_counts():
     conn = sqlite3.connect(settings.DATABASES['default']['NAME'])
     cursor = conn.cursor()
     
-    exclude_patterns = ("django_%", "auth_%", "sqlite_sequence")
-    exclude_clause = " AND ".join([f"name NOT LIKE '{pattern}'" for pattern in exclude_patterns])
-    
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND {exclude_clause};")
-    tables = [row[0] for row in cursor.fetchall()]
+    # Bookkeeping tables and the observation store are left out: counting
+    # their rows on every page view costs more than it tells
+    tables = health_data_tables(cursor)
     
     table_info = []
     for t in tables:
@@ -431,7 +469,20 @@ def drop_all_tables(request):
             "manual", 
             "stats_userhr",
             "stats_usercalories",
-            "stats_usersleep"
+            "stats_usersleep",
+            "stats_syncstate",
+            "stats_backfillwindow",
+            "stats_syncjob",
+            "stats_fitdatapoint",
+            "stats_fitcredential",
+            "stats_uploadreject",
+            "stats_uploadcolumn",
+            "stats_uploadfile",
+            "stats_chunkedupload",
+            "stats_metric",
+            "stats_metricmapping",
+            "observation",
+            "stats_uploadquarantine",
         )
         exclude_clause = " AND ".join([f"name NOT LIKE '{pattern}'" for pattern in exclude_patterns])
         
@@ -441,6 +492,8 @@ def drop_all_tables(request):
         for tbl in tables:
             drop_stmt = f'DROP TABLE IF EXISTS "{tbl}"'
             cursor.execute(drop_stmt)
+            # Values copied from the table into the observation store go with it
+            cursor.execute(f'DELETE FROM {OBSERVATION_TABLE} WHERE source_id = ?', [tbl])
         
         conn.commit()
         conn.close()